@@ -1,21 +1,22 @@
 import binascii
+from collections import defaultdict
 import re
-import cPickle
 from datetime import datetime, timedelta
 from hashlib import sha1
 
 from django.conf import settings
 from django.db import models
-from django.db.models import Sum
+from django.db.models import Count, Sum
 from django.utils.encoding import force_unicode
 from django.utils.translation import ugettext_lazy as _
-from django.contrib.contenttypes.models import ContentType
 
-from ganeti_webmgr.utils import get_rapi
+from ganeti_webmgr.clusters.reconcile import reconcile
+from ganeti_webmgr.utils import get_rapi, serialization
 from ganeti_webmgr.utils.fields import (
     PatchedEncryptedCharField, PreciseDateTimeField, LowerCaseCharField
 )
 from ganeti_webmgr.utils.client import GanetiApiError
+from ganeti_webmgr.utils.rapi_cache import fresh_responses
 from ganeti_webmgr.utils.models import Quota
 
 
@@ -53,7 +54,7 @@ class CachedClusterObject(models.Model):
         overridden to ensure info is serialized prior to save
         """
         if not self.serialized_info:
-            self.serialized_info = cPickle.dumps(self.__info)
+            self.serialized_info = serialization.dumps(self.__info)
         super(CachedClusterObject, self).save(*args, **kwargs)
 
     def __init__(self, *args, **kwargs):
@@ -74,7 +75,7 @@ class CachedClusterObject(models.Model):
 
         if self.__info is None:
             if self.serialized_info:
-                self.__info = cPickle.loads(str(self.serialized_info))
+                self.__info = serialization.loads(self.serialized_info)
         return self.__info
 
     def _set_info(self, value):
@@ -92,15 +93,27 @@ class CachedClusterObject(models.Model):
         not to refresh the cached information with new information from the
         ganeti cluster.
 
-        This will ignore the cache when self.ignore_cache is True
+        This will ignore the cache when self.ignore_cache is True.
+
+        When ``BACKGROUND_CACHE_REFRESH`` is set the cache is never refreshed
+        here; the ``refreshdaemon`` management command keeps it up to date
+        instead, so instantiating a model never talks to Ganeti.
+
+        Querysets that don't need info should ``defer('serialized_info')``;
+        the info is then neither loaded, decoded nor refreshed here.
         """
 
         epsilon = timedelta(0, 0, 0, settings.LAZY_CACHE_REFRESH)
 
         if self.id:
-            if (self.ignore_cache
-                    or self.cached is None
-                    or datetime.now() > self.cached + epsilon):
+            if self._deferred and 'serialized_info' not in self.__dict__:
+                # serialized_info was left out with QuerySet.defer(); it is
+                # only loaded if info is actually accessed.
+                pass
+            elif (not settings.BACKGROUND_CACHE_REFRESH
+                    and (self.ignore_cache
+                         or self.cached is None
+                         or datetime.now() > self.cached + epsilon)):
                 self.refresh()
             elif self.info:
                 self.parse_transient_info()
@@ -125,7 +138,7 @@ class CachedClusterObject(models.Model):
         If communication with Ganeti fails, an error will be stored in
         ``error``.
         """
-        from ganeti_webmgr.utils.models import GanetiError
+        from ganeti_webmgr.utils.error_sink import error_sink
 
         job_data = self.check_job_status()
         for k, v in job_data.items():
@@ -133,7 +146,10 @@ class CachedClusterObject(models.Model):
 
         # XXX this try/except is far too big; see if we can pare it down.
         try:
-            info_ = self._refresh()
+            # the info is stamped as current, so it must not be a cached
+            # response
+            with fresh_responses():
+                info_ = self._refresh()
             if info_:
                 if info_['mtime']:
                     mtime = datetime.fromtimestamp(info_['mtime'])
@@ -173,12 +189,12 @@ class CachedClusterObject(models.Model):
             else:
                 msg = str(e)
                 self.error = msg
-            GanetiError.store_error(msg, obj=self, code=e.code)
+            error_sink().store(msg, self, e.code)
 
         else:
             if self.error:
                 self.error = None
-                GanetiError.objects.clear_errors(obj=self)
+                error_sink().clear(self)
 
     def _refresh(self):
         """
@@ -190,59 +206,49 @@ class CachedClusterObject(models.Model):
         raise NotImplementedError
 
     def check_job_status(self):
+        """
+        Check the jobs of this object and process the ones which completed.
+
+        All pending jobs of the cluster are polled together with a single
+        request; completed jobs of other objects are handed to those objects
+        in the same pass.
+
+        @returns dict of values to update on this object
+        """
         # preventing circular import
         from ganeti_webmgr.jobs.models import Job
+        from ganeti_webmgr.jobs.tracker import COMPLETE, JobTracker
 
         if not self.last_job_id:
             return {}
 
-        ct = ContentType.objects.get_for_model(self)
-        qs = Job.objects.filter(content_type=ct, object_id=self.pk)
-        jobs = qs.order_by("job_id")
+        tracker = JobTracker(self.cluster_id, self.rapi)
+        completed = tracker.poll(include=[self.last_job_id], exclude=self)
 
         updates = {}
-        status = 'unknown'
-        op = None
-
-        for job in jobs:
-            try:
-                data = self.rapi.GetJobStatus(job.job_id)
-
-                if Job.valid_job(data):
-                    op = Job.parse_op(data)
-                    status = data['status']
-
-            except GanetiApiError:
-                pass
 
-            if status in ('success', 'error'):
-                for k, v in Job.parse_persistent_info(data).items():
-                    setattr(job, k, v)
-
-            if status == 'unknown':
-                job.status = "unknown"
-                job.ignore_cache = False
-
-            if status in ('success', 'error', 'unknown'):
-                _updates = self._complete_job(self.cluster_id,
-                                              self.hostname, op, status)
-                # XXX if the delete flag is set in updates then delete this
-                # model this happens here because _complete_job cannot delete
-                # this model
-                if _updates:
-                    if 'deleted' in _updates:
-                        # Delete ourselves. Also delete the job that caused us
-                        # to delete ourselves; see #8439 for "fun" details.
-                        # Order matters; the job's deletion cascades over us.
-                        # Revisit that when we finally nuke all this caching
-                        # bullshit.
-                        self.delete()
-                        job.delete()
-                    else:
-                        updates.update(_updates)
+        for job in completed:
+            _updates = self._complete_job(self.cluster_id, self.hostname,
+                                          job['op'], job['status'])
+            # XXX if the delete flag is set in updates then delete this
+            # model this happens here because _complete_job cannot delete
+            # this model
+            if _updates:
+                if 'deleted' in _updates:
+                    # Delete ourselves. Also delete the job that caused us
+                    # to delete ourselves; see #8439 for "fun" details.
+                    # Order matters; the job's deletion cascades over us.
+                    # Revisit that when we finally nuke all this caching
+                    # bullshit.
+                    self.delete()
+                    Job.objects.filter(pk=job['id']).delete()
+                else:
+                    updates.update(_updates)
 
         # we only care about the very last job for resetting the cache flags
-        if not jobs or status in ('success', 'error', 'unknown'):
+        status = Job.objects.filter(pk=self.last_job_id) \
+            .values_list('status', flat=True)
+        if not status or status[0] in COMPLETE:
             updates['ignore_cache'] = False
             updates['last_job'] = None
 
@@ -294,6 +300,23 @@ class CachedClusterObject(models.Model):
         return {'mtime': datetime.fromtimestamp(info['mtime'])}
 
 
+def available_resources(total, free, allocated):
+    """
+    Build the dict of available_ram and available_disk from the totals of
+    the nodes of a cluster and the amount allocated to its VMs.  Sums over
+    no rows are None.
+    """
+    total = max(total or 0, 0)
+    used = total - max(free or 0, 0)
+    allocated = allocated or 0
+    return {
+        'total': total,
+        'free': max(total - allocated, 0),
+        'allocated': allocated,
+        'used': used,
+    }
+
+
 class Cluster(CachedClusterObject):
     """
     A Ganeti cluster that is being tracked by this manager tool
@@ -309,6 +332,13 @@ class Cluster(CachedClusterObject):
                                          max_length=128, blank=True)
     hash = models.CharField(_('hash'), max_length=40, editable=False)
 
+    # copied from info so cluster lists don't have to unpickle it
+    software_version = models.CharField(max_length=32, default="",
+                                        editable=False)
+    default_hypervisor = models.CharField(max_length=32, default="",
+                                          editable=False)
+    master = models.CharField(max_length=128, default="", editable=False)
+
     # quota properties
     virtual_cpus = models.IntegerField(_('Virtual CPUs'), null=True,
                                        blank=True)
@@ -476,20 +506,20 @@ class Cluster(CachedClusterObject):
         # preventing circular imports
         from ganeti_webmgr.virtualmachines.models import VirtualMachine
 
-        ganeti = self.instances()
-        db = self.virtual_machines.all().values_list('hostname', flat=True)
+        with fresh_responses():
+            instances = self.instances()
+        diff = reconcile(instances,
+                         self.virtual_machines.values_list('hostname',
+                                                           flat=True))
 
         # add VMs missing from the database
-        for hostname in filter(lambda x: unicode(x) not in db, ganeti):
+        for hostname in sorted(diff.added):
             vm = VirtualMachine.objects.create(cluster=self, hostname=hostname)
             vm.refresh()
 
         # deletes VMs that are no longer in ganeti
-        if remove:
-            missing_ganeti = filter(lambda x: str(x) not in ganeti, db)
-            if missing_ganeti:
-                self.virtual_machines \
-                    .filter(hostname__in=missing_ganeti).delete()
+        if remove and diff.removed:
+            self.virtual_machines.filter(hostname__in=diff.removed).delete()
 
         # Get up to date data on all VMs
         self.refresh_virtual_machines()
@@ -508,19 +538,19 @@ class Cluster(CachedClusterObject):
         # to prevent circular imports
         from ganeti_webmgr.nodes.models import Node
 
-        ganeti = self.rapi.GetNodes()
-        db = self.nodes.all().values_list('hostname', flat=True)
+        with fresh_responses():
+            nodes = self.rapi.GetNodes()
+        diff = reconcile(nodes,
+                         self.nodes.values_list('hostname', flat=True))
 
         # add Nodes missing from the database
-        for hostname in filter(lambda x: unicode(x) not in db, ganeti):
+        for hostname in sorted(diff.added):
             node = Node.objects.create(cluster=self, hostname=hostname)
             node.refresh()
 
         # deletes Nodes that are no longer in ganeti
-        if remove:
-            missing_ganeti = filter(lambda x: str(x) not in ganeti, db)
-            if missing_ganeti:
-                self.nodes.filter(hostname__in=missing_ganeti).delete()
+        if remove and diff.removed:
+            self.nodes.filter(hostname__in=diff.removed).delete()
 
         # Get up to date data for all Nodes
         self.refresh_nodes()
@@ -529,16 +559,26 @@ class Cluster(CachedClusterObject):
         for node in self.nodes.all():
             node.refresh()
 
+    def bulk_sync(self, remove=False):
+        """
+        Synchronizes Nodes and VirtualMachines with the information this
+        ganeti cluster has, using one bulk RAPI call for each.  Only rows
+        that changed in ganeti are written.
+
+        This is the fast equivalent of calling sync_nodes() and
+        sync_virtual_machines().
+        """
+        # preventing circular imports
+        from ganeti_webmgr.clusters.sync import sync_cluster
+        return sync_cluster(self, remove)
+
     @property
     def missing_in_ganeti(self):
         """
         Returns a list of VirtualMachines that are missing from the Ganeti
         cluster but present in the database.
         """
-        ganeti = self.instances()
-        qs = self.virtual_machines.exclude(template__isnull=False)
-        db = qs.values_list('hostname', flat=True)
-        return [x for x in db if str(x) not in ganeti]
+        return sorted(self.reconcile_virtual_machines().removed)
 
     @property
     def missing_in_db(self):
@@ -546,9 +586,7 @@ class Cluster(CachedClusterObject):
         Returns list of VirtualMachines that are missing from the database, but
         present in ganeti
         """
-        ganeti = self.instances()
-        db = self.virtual_machines.all().values_list('hostname', flat=True)
-        return [x for x in ganeti if unicode(x) not in db]
+        return sorted(self.reconcile_virtual_machines().added)
 
     @property
     def nodes_missing_in_db(self):
@@ -556,12 +594,7 @@ class Cluster(CachedClusterObject):
         Returns list of Nodes that are missing from the database, but present
         in ganeti.
         """
-        try:
-            ganeti = self.rapi.GetNodes()
-        except GanetiApiError:
-            ganeti = []
-        db = self.nodes.all().values_list('hostname', flat=True)
-        return [x for x in ganeti if unicode(x) not in db]
+        return sorted(self.reconcile_nodes().added)
 
     @property
     def nodes_missing_in_ganeti(self):
@@ -569,65 +602,136 @@ class Cluster(CachedClusterObject):
         Returns list of Nodes that are missing from the ganeti cluster
         but present in the database
         """
+        return sorted(self.reconcile_nodes().removed)
+
+    def reconcile_virtual_machines(self, ganeti=None):
+        """
+        Compares the VirtualMachines in ganeti with those in the database.
+        VirtualMachines which are still being deployed are never removed.
+
+        @param ganeti - hostnames of the instances in ganeti; requested from
+        ganeti if not given
+        @returns Reconciliation
+        """
+        if ganeti is None:
+            ganeti = self.instances()
+        db = dict(self.virtual_machines.values_list('hostname', 'template'))
+        diff = reconcile(ganeti, db)
+        diff.removed.difference_update([hostname for hostname in diff.removed
+                                        if db[hostname] is not None])
+        return diff
+
+    def reconcile_nodes(self):
+        """
+        Compares the Nodes in ganeti with those in the database.
+
+        @returns Reconciliation
+        """
         try:
             ganeti = self.rapi.GetNodes()
         except GanetiApiError:
             ganeti = []
-        db = self.nodes.all().values_list('hostname', flat=True)
-        return filter(lambda x: str(x) not in ganeti, db)
+        return reconcile(ganeti, self.nodes.values_list('hostname', flat=True))
 
     @property
     def available_ram(self):
         """ returns dict of free and total ram """
         nodes = self.nodes.exclude(ram_total=-1) \
             .aggregate(total=Sum('ram_total'), free=Sum('ram_free'))
-        total = max(nodes.get("total", 0), 0)
-        free = max(nodes.get("free", 0), 0)
-        used = total - free
         values = self.virtual_machines \
             .filter(status='running') \
             .exclude(ram=-1).order_by() \
             .aggregate(used=Sum('ram'))
-
-        if values.get("used") is None:
-            allocated = 0
-        else:
-            allocated = values["used"]
-
-        free = max(total - allocated, 0)
-
-        return {
-            'total': total,
-            'free': free,
-            'allocated': allocated,
-            'used': used,
-        }
+        return available_resources(nodes.get("total"), nodes.get("free"),
+                                   values.get("used"))
 
     @property
     def available_disk(self):
         """ returns dict of free and total disk space """
         nodes = self.nodes.exclude(disk_total=-1) \
             .aggregate(total=Sum('disk_total'), free=Sum('disk_free'))
-        total = max(nodes.get("total", 0), 0)
-        free = max(nodes.get("free", 0), 0)
-        used = total - free
         values = self.virtual_machines \
             .exclude(disk_size=-1).order_by() \
             .aggregate(used=Sum('disk_size'))
+        return available_resources(nodes.get("total"), nodes.get("free"),
+                                   values.get("used"))
 
-        if values.get("used") is None:
-            allocated = 0
-        else:
-            allocated = values["used"]
+    @classmethod
+    def with_stats(cls, clusters):
+        """
+        Attach the numbers shown for each cluster in lists to ``stats`` of
+        every cluster, using a few grouped queries for all of them instead
+        of several queries per cluster.
 
-        free = max(total - allocated, 0)
+        ``stats`` is a dict of ``running_vms``, ``total_vms``,
+        ``online_nodes`` and ``total_nodes``, plus ``ram`` and ``disk`` in the
+        format of available_ram and available_disk.  VM numbers are read from
+        the clusters' ResourceSummaries.
 
-        return {
-            'total': total,
-            'free': free,
-            'allocated': allocated,
-            'used': used,
-        }
+        @param clusters - queryset or list of clusters
+        @returns list of the clusters
+        """
+        # preventing circular imports
+        from ganeti_webmgr.nodes.models import Node
+        from ganeti_webmgr.virtualmachines.models import ResourceSummary
+
+        clusters = list(clusters)
+        ids = [cluster.id for cluster in clusters]
+
+        vms = dict((values['cluster'], values) for values in
+                   ResourceSummary.objects.filter(cluster__in=ids)
+                   .values('cluster').order_by()
+                   .annotate(total=Sum('total'), running=Sum('running'),
+                             ram=Sum('ram'), disk=Sum('disk')))
+
+        nodes = defaultdict(lambda: {'online': 0, 'total': 0})
+        for values in Node.objects.filter(cluster__in=ids) \
+                .values('cluster', 'offline').order_by() \
+                .annotate(count=Count('pk')):
+            counts = nodes[values['cluster']]
+            counts['total'] += values['count']
+            if not values['offline']:
+                counts['online'] += values['count']
+
+        ram = dict((values['cluster'], values) for values in
+                   Node.objects.filter(cluster__in=ids)
+                   .exclude(ram_total=-1).values('cluster').order_by()
+                   .annotate(total=Sum('ram_total'), free=Sum('ram_free')))
+        disk = dict((values['cluster'], values) for values in
+                    Node.objects.filter(cluster__in=ids)
+                    .exclude(disk_total=-1).values('cluster').order_by()
+                    .annotate(total=Sum('disk_total'),
+                              free=Sum('disk_free')))
+
+        for cluster in clusters:
+            vm = vms.get(cluster.id, {})
+            node_ram = ram.get(cluster.id, {})
+            node_disk = disk.get(cluster.id, {})
+            cluster.stats = {
+                'running_vms': vm.get('running') or 0,
+                'total_vms': vm.get('total') or 0,
+                'online_nodes': nodes[cluster.id]['online'],
+                'total_nodes': nodes[cluster.id]['total'],
+                'ram': available_resources(node_ram.get('total'),
+                                           node_ram.get('free'),
+                                           vm.get('ram')),
+                'disk': available_resources(node_disk.get('total'),
+                                            node_disk.get('free'),
+                                            vm.get('disk')),
+            }
+        return clusters
+
+    @classmethod
+    def parse_persistent_info(cls, info):
+        """
+        Loads all values from cached info, included persistent properties that
+        are stored in the database
+        """
+        data = super(Cluster, cls).parse_persistent_info(info)
+        data['software_version'] = info.get('software_version') or ''
+        data['default_hypervisor'] = info.get('default_hypervisor') or ''
+        data['master'] = info.get('master') or ''
+        return data
 
     def _refresh(self):
         return self.rapi.GetInfo()
@@ -665,3 +769,101 @@ class Cluster(CachedClusterObject):
         Cluster.objects.filter(pk=self.id) \
             .update(last_job=job, ignore_cache=True)
         return job
+
+
+class VirtualMachineDiff(models.Model):
+    """
+    The VirtualMachines of a cluster that are missing from the database or
+    from ganeti, as found when the cluster was last checked.
+
+    Finding them requires listing the instances of the cluster, so they are
+    recorded whenever a cluster is synchronized or explicitly rechecked,
+    instead of being requested from ganeti each time they are shown.
+    Hostnames are checked against the database when they are read, so VMs
+    imported or removed since the last check are left out.
+    """
+    cluster = models.OneToOneField(Cluster, related_name='vm_diff')
+    serialized_diff = models.TextField(default='')
+    checked = PreciseDateTimeField(null=True, editable=False)
+
+    @classmethod
+    def record(cls, cluster, ganeti, now=None):
+        """
+        Record the differences between a cluster's VirtualMachines in the
+        database and the instances in ganeti.
+
+        @param ganeti - hostnames of all instances in ganeti
+        """
+        diff = cluster.reconcile_virtual_machines(ganeti)
+        diff = {
+            'missing_in_db': sorted(diff.added),
+            'missing_in_ganeti': sorted(diff.removed),
+        }
+        values = dict(serialized_diff=serialization.dumps(diff),
+                      checked=now or datetime.now())
+        if not cls.objects.filter(cluster=cluster).update(**values):
+            cls.objects.create(cluster=cluster, **values)
+
+    @classmethod
+    def check(cls, cluster):
+        """
+        Request the instances of a cluster from ganeti and record its
+        differences.
+
+        @raises GanetiApiError if ganeti can't be reached
+        """
+        with fresh_responses():
+            instances = cluster.rapi.GetInstances()
+        cls.record(cluster, instances)
+
+    @classmethod
+    def get_diffs(cls, clusters):
+        """
+        The recorded differences of several clusters.  Clusters which were
+        never checked are checked now; those which can't be reached have no
+        differences.
+
+        @returns dict of cluster id to a dict with the sorted hostnames
+        "missing_in_db" and "missing_in_ganeti", and the time they were
+        "checked"
+        """
+        # preventing circular imports
+        from ganeti_webmgr.virtualmachines.models import VirtualMachine
+
+        diffs = dict((cluster_id, (serialized, checked))
+                     for cluster_id, serialized, checked
+                     in cls.objects.filter(cluster__in=clusters)
+                     .values_list('cluster', 'serialized_diff', 'checked'))
+        for cluster in clusters:
+            if cluster.id not in diffs:
+                try:
+                    cls.check(cluster)
+                except GanetiApiError:
+                    continue
+                diffs[cluster.id] = cls.objects.filter(cluster=cluster) \
+                    .values_list('serialized_diff', 'checked')[0]
+
+        checked_field = cls._meta.get_field('checked')
+        result = {}
+        for cluster_id, (serialized, checked) in diffs.items():
+            diff = serialization.loads(serialized)
+            diff['checked'] = checked_field.to_python(checked)
+            result[cluster_id] = diff
+
+        # leave out hostnames which were imported or removed since
+        hostnames = set()
+        for diff in result.values():
+            hostnames.update(diff['missing_in_db'])
+            hostnames.update(diff['missing_in_ganeti'])
+        db = set()
+        if hostnames:
+            db = set(VirtualMachine.objects
+                     .filter(cluster__in=result.keys(),
+                             hostname__in=hostnames)
+                     .values_list('cluster', 'hostname'))
+        for cluster_id, diff in result.items():
+            diff['missing_in_db'] = [h for h in diff['missing_in_db']
+                                     if (cluster_id, h) not in db]
+            diff['missing_in_ganeti'] = [h for h in diff['missing_in_ganeti']
+                                         if (cluster_id, h) in db]
+        return result
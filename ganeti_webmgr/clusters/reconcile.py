@@ -0,0 +1,72 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Reconciliation of the objects of a cluster in ganeti with the database.
+
+Both sides are hashed by hostname once, so comparing them takes a single
+pass no matter how many objects the cluster has.
+"""
+
+from collections import namedtuple
+
+
+class Reconciliation(namedtuple("Reconciliation",
+                                "added removed changed unchanged")):
+    """
+    Sets of hostnames: ``added`` are only in ganeti and missing from the
+    database, ``removed`` are only in the database and missing from ganeti,
+    and ``changed`` and ``unchanged`` are in both.
+    """
+    __slots__ = ()
+
+
+def _by_hostname(objects):
+    if isinstance(objects, dict):
+        return dict((unicode(hostname), value)
+                    for hostname, value in objects.iteritems())
+    return dict.fromkeys(unicode(hostname) for hostname in objects)
+
+
+def reconcile(ganeti, db, changed=None):
+    """
+    Compare the objects of a cluster in ganeti with those in the database.
+
+    @param ganeti - hostnames of the objects in ganeti, or a dict of hostname
+    to info
+    @param db - hostnames of the objects in the database, or a dict of
+    hostname to row
+    @param changed - callable(info, row) telling whether an object in both
+    needs to be written.  Without it every object in both is unchanged.
+    @returns Reconciliation
+    """
+    ganeti = _by_hostname(ganeti)
+    db = _by_hostname(db)
+
+    added = set()
+    changed_ = set()
+    unchanged = set()
+    for hostname, info in ganeti.iteritems():
+        if hostname not in db:
+            added.add(hostname)
+        elif changed is not None and changed(info, db[hostname]):
+            changed_.add(hostname)
+        else:
+            unchanged.add(hostname)
+
+    removed = set(hostname for hostname in db if hostname not in ganeti)
+    return Reconciliation(added, removed, changed_, unchanged)
@@ -0,0 +1,362 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Bulk synchronization of a cluster's Nodes and VirtualMachines.
+
+Refreshing objects one at a time costs a RAPI call and a couple of queries
+per object.  The functions here fetch every node and instance of a cluster
+with a single RAPI call each, compare the results against the database by
+mtime, and only write the rows which actually changed.
+
+Clusters which support the query API are only asked for the fields stored
+in the database; the full info is then fetched for the new and changed
+objects alone.  Older clusters return full info with bulk requests.
+"""
+
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from ganeti_webmgr.clusters.models import VirtualMachineDiff
+from ganeti_webmgr.clusters.reconcile import reconcile
+from ganeti_webmgr.ganeti_web import caps
+from ganeti_webmgr.jobs.tracker import JobTracker
+from ganeti_webmgr.nodes.models import Node
+from ganeti_webmgr.utils import query_rows, serialization
+from ganeti_webmgr.utils.client import GanetiApiError
+from ganeti_webmgr.utils.error_sink import error_sink
+from ganeti_webmgr.utils.rapi_cache import fresh_responses
+from ganeti_webmgr.virtualmachines.models import (ResourceSummary,
+                                                  VirtualMachine)
+
+
+# Fields requested with the query API: everything parse_persistent_info()
+# reads, which is what the object lists show.
+NODE_FIELDS = ["name", "mtime", "offline", "role", "mtotal", "mfree",
+               "dtotal", "dfree", "csockets"]
+INSTANCE_FIELDS = ["name", "mtime", "status", "admin_state", "oper_state",
+                   "os", "pnode", "snodes", "beparams", "disk.sizes"]
+
+# With the query API, new and changed objects are fetched one at a time up
+# to this many; beyond that a single bulk request is cheaper.
+REFETCH_LIMIT = 10
+
+# Maximum number of ids passed to a single ``pk__in`` lookup.  SQLite refuses
+# queries with more than 999 parameters.
+BATCH_SIZE = 500
+
+
+def _chunks(items, size=BATCH_SIZE):
+    items = list(items)
+    for i in xrange(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _field_names(model, data):
+    """
+    Translate attnames such as ``primary_node_id`` to field names; unlike
+    the model constructor, QuerySet.update() only accepts the latter.
+    """
+    names = dict((f.attname, f.name) for f in model._meta.fields)
+    return dict((names.get(k, k), v) for k, v in data.iteritems())
+
+
+def _uses_query(cluster):
+    return (settings.QUERY_API_REFRESH and cluster.info is not None
+            and caps.has_query(cluster))
+
+
+def _by_name(infos):
+    return dict((info['name'], info) for info in infos)
+
+
+def _fetch(cluster, resource, fields, get, get_bulk):
+    """
+    Retrieve the info of every node or instance of a cluster.
+
+    Clusters which support the query API are asked for ``fields`` only;
+    the returned fetch callable retrieves the full info of the objects
+    which turn out to need writing.  Older clusters return everything with
+    one bulk request, and no fetch callable.
+
+    @returns tuple of a dict of hostname to info and the fetch callable
+    """
+    if not _uses_query(cluster):
+        return _by_name(get_bulk(bulk=True)), None
+
+    def fetch(hostnames):
+        if len(hostnames) > REFETCH_LIMIT:
+            wanted = set(hostnames)
+            return _by_name(info for info in get_bulk(bulk=True)
+                            if info['name'] in wanted)
+        full = {}
+        for hostname in hostnames:
+            try:
+                full[hostname] = get(hostname)
+            except GanetiApiError as e:
+                # removed since the query; it is dropped next time
+                if e.code != 404:
+                    raise
+        return full
+
+    return _by_name(query_rows(cluster.rapi, resource, fields)), fetch
+
+
+class _Plan(object):
+    """
+    The writes bringing the rows of a model in line with ganeti, worked out
+    before any of them is made.
+    """
+
+    def __init__(self, model, ganeti, parse, created, updated, unchanged,
+                 missing, pending):
+        self.model = model
+        self.ganeti = ganeti
+        self.parse = parse
+        self.created = created
+        self.updated = updated
+        self.unchanged = unchanged
+        self.missing = missing
+        self.pending = pending
+
+    def summary(self):
+        return {
+            'created': len(self.created),
+            'updated': len(self.updated),
+            'unchanged': len(self.unchanged),
+            'deleted': len(self.missing),
+            'refreshed': len(self.pending),
+        }
+
+
+def _plan(cluster, model, ganeti, parse, busy, remove, fetch=None):
+    """
+    Diff bulk info from ganeti against the database.
+
+    @param cluster - Cluster the objects belong to
+    @param model - Node or VirtualMachine
+    @param ganeti - dict of hostname to bulk info for the object
+    @param parse - callable returning persistent fields for a bulk info dict
+    @param busy - callable returning True for a values() row which must be
+    refreshed on its own, e.g. because it is being deleted
+    @param remove - delete objects which are no longer in ganeti
+    @param fetch - given when ``ganeti`` only holds the persisted fields; a
+    callable returning the full info of a list of hostnames, used for the
+    objects which are written
+
+    @returns _Plan of the writes, made with _write()
+    """
+    mtime_field = model._meta.get_field('mtime')
+    fields = ['id', 'hostname', 'mtime', 'cached']
+    if model is VirtualMachine:
+        fields += ['pending_delete', 'template']
+    db = dict((row['hostname'], row) for row in
+              model.objects.filter(cluster=cluster).values(*fields))
+
+    parsed = dict((hostname, parse(info))
+                  for hostname, info in ganeti.iteritems())
+
+    def changed(data, row):
+        current = mtime_field.to_python(row['mtime'])
+        mtime = data['mtime']
+        # objects which were never modified have no mtime at all; those are
+        # only written if they were never cached
+        return row['cached'] is None or (mtime is not None and (
+            current is None or mtime > current))
+
+    diff = reconcile(parsed, db, changed)
+    pending = [db[h]['id'] for h in diff.changed | diff.unchanged
+               if busy(db[h])]
+    created = [(h, ganeti[h]) for h in diff.added]
+    updated = [(db[h]['id'], h, ganeti[h]) for h in diff.changed
+               if not busy(db[h])]
+    unchanged = [db[h]['id'] for h in diff.unchanged if not busy(db[h])]
+
+    if fetch is not None and (created or updated):
+        full = fetch([h for h, info in created] +
+                     [h for pk, h, info in updated])
+        created = [(h, full[h]) for h, info in created if h in full]
+        updated = [(pk, h, full[h]) for pk, h, info in updated if h in full]
+
+    missing = list(diff.removed) if remove else []
+    return _Plan(model, ganeti, parse, created, updated, unchanged, missing,
+                 pending)
+
+
+def _write(cluster, plan, now):
+    """
+    Make the writes of a _Plan.  Callers wrap this in a transaction.
+
+    The persistent fields are parsed here rather than when planning, so
+    they refer to the nodes written before.
+
+    @param now - timestamp to use for ``cached``
+    """
+    model = plan.model
+    if plan.created:
+        model.objects.bulk_create([
+            model(cluster=cluster, hostname=hostname,
+                  cluster_hash=cluster.hash,
+                  serialized_info=serialization.dumps(info),
+                  cached=now, **plan.parse(info))
+            for hostname, info in plan.created])
+
+    for pk, hostname, info in plan.updated:
+        model.objects.filter(pk=pk) \
+            .update(serialized_info=serialization.dumps(info),
+                    cached=now, **_field_names(model, plan.parse(info)))
+
+    for chunk in _chunks(plan.unchanged):
+        model.objects.filter(pk__in=chunk).update(cached=now)
+
+    for chunk in _chunks(plan.missing):
+        model.objects.filter(cluster=cluster, hostname__in=chunk).delete()
+
+    # everything that was synced is reachable again
+    ct = ContentType.objects.get_for_model(model)
+    synced = [pk for pk, hostname, info in plan.updated] + plan.unchanged
+    error_sink().clear_objects(cluster.pk, ct.pk, synced)
+
+
+def _refresh_pending(plan):
+    """
+    Objects which are being deployed or deleted go through the regular
+    refresh so their job status is checked and completed.
+    """
+    for obj in plan.model.objects.filter(pk__in=plan.pending):
+        obj.refresh()
+
+
+def _plan_nodes(cluster, remove):
+    rapi = cluster.rapi
+    with fresh_responses():
+        ganeti, fetch = _fetch(cluster, "node", NODE_FIELDS, rapi.GetNode,
+                               rapi.GetNodes)
+        return _plan(cluster, Node, ganeti, Node.parse_persistent_info,
+                     lambda row: False, remove, fetch)
+
+
+def _plan_virtual_machines(cluster, remove, nodes):
+    """
+    @param nodes - dict of node hostnames to ids, which is filled in by
+    _write_virtual_machines() once the nodes are written
+    """
+    rapi = cluster.rapi
+
+    def parse(info):
+        return VirtualMachine.parse_persistent_info(info, nodes=nodes)
+
+    def busy(row):
+        return row['pending_delete'] or row['template'] is not None
+
+    with fresh_responses():
+        ganeti, fetch = _fetch(cluster, "instance", INSTANCE_FIELDS,
+                               rapi.GetInstance, rapi.GetInstances)
+        return _plan(cluster, VirtualMachine, ganeti, parse, busy, remove,
+                     fetch)
+
+
+def _write_virtual_machines(cluster, plan, nodes, now):
+    # primary and secondary nodes are looked up once for the whole cluster
+    nodes.clear()
+    nodes.update(cluster.nodes.values_list('hostname', 'id'))
+    _write(cluster, plan, now)
+    # bulk writes bypass the signals maintaining the resource summaries
+    if plan.created or plan.updated:
+        ResourceSummary.recount(cluster.id)
+
+
+def sync_nodes(cluster, remove=False, now=None):
+    """
+    Synchronize a cluster's Nodes using a single query, or a single bulk
+    GetNodes call on clusters which don't support the query API.
+
+    Nodes missing from the database are created, nodes with a newer mtime in
+    ganeti are updated, and with ``remove`` nodes no longer in ganeti are
+    deleted.  Jobs are left to the JobTracker; see sync_cluster().
+
+    @returns dict with the number of created, updated, unchanged, deleted
+    and individually refreshed nodes
+    """
+    now = now or datetime.now()
+    plan = _plan_nodes(cluster, remove)
+    with transaction.commit_on_success():
+        _write(cluster, plan, now)
+    _refresh_pending(plan)
+    return plan.summary()
+
+
+def sync_virtual_machines(cluster, remove=False, now=None):
+    """
+    Synchronize a cluster's VirtualMachines using a single query, or a
+    single bulk GetInstances call on clusters which don't support the query
+    API.
+
+    Nodes must be synchronized first; primary and secondary nodes are looked
+    up from the database once for the whole cluster.  VirtualMachines that
+    are being deployed or deleted are refreshed individually.  The VMs
+    missing from the database or from ganeti are recorded in the cluster's
+    VirtualMachineDiff.
+
+    @returns dict like sync_nodes()
+    """
+    now = now or datetime.now()
+    nodes = {}
+    plan = _plan_virtual_machines(cluster, remove, nodes)
+    with transaction.commit_on_success():
+        _write_virtual_machines(cluster, plan, nodes, now)
+    _refresh_pending(plan)
+    VirtualMachineDiff.record(cluster, plan.ganeti, now)
+    return plan.summary()
+
+
+def sync_cluster(cluster, remove=False):
+    """
+    Synchronize all Nodes and then all VirtualMachines of a cluster.
+
+    Everything is fetched from ganeti first, and the changed rows of both
+    are then written in a single transaction, so a failure leaves neither
+    half synchronized.
+
+    Pending jobs are polled first, all with one request, so objects whose
+    jobs completed are synchronized with the outcome.  Objects whose jobs
+    are still running are synchronized like any other and keep polling
+    their jobs when they are loaded.
+
+    @returns dict with a summary for "nodes" and "virtual_machines"
+    """
+    now = datetime.now()
+    version = caps.classify(cluster) if cluster.info else None
+    JobTracker(cluster.id, cluster.rapi, version).poll()
+
+    nodes = {}
+    node_plan = _plan_nodes(cluster, remove)
+    vm_plan = _plan_virtual_machines(cluster, remove, nodes)
+    with transaction.commit_on_success():
+        _write(cluster, node_plan, now)
+        _write_virtual_machines(cluster, vm_plan, nodes, now)
+
+    _refresh_pending(node_plan)
+    _refresh_pending(vm_plan)
+    VirtualMachineDiff.record(cluster, vm_plan.ganeti, now)
+    return {
+        'nodes': node_plan.summary(),
+        'virtual_machines': vm_plan.summary(),
+    }
@@ -1,3 +1,4 @@
 from .forms import *
 from .models import *
+from .reconcile import *
 from .views import *
@@ -17,20 +17,42 @@
 
 
 from datetime import datetime
+import json
 
 from django.contrib.auth.models import User
-from django.test import TestCase
-
-from ganeti_webmgr.utils.proxy.constants import INFO, JOB_RUNNING, JOB
-
-from ganeti_webmgr.virtualmachines.models import VirtualMachine
-from ganeti_webmgr.clusters.models import Cluster
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+
+from ganeti_webmgr.utils.proxy import ResponseMap
+from ganeti_webmgr.utils.proxy.constants import (INFO, JOB_RUNNING, JOB,
+                                                 INSTANCES_BULK, NODES_BULK)
+
+from ganeti_webmgr.virtualmachines.models import (ResourceSummary,
+                                                  VirtualMachine)
+from ganeti_webmgr.clusters.models import Cluster, VirtualMachineDiff
+from ganeti_webmgr.clusters.sync import INSTANCE_FIELDS, NODE_FIELDS
 from ganeti_webmgr.jobs.models import Job
 from ganeti_webmgr.nodes.models import Node
+from ganeti_webmgr.utils import RAPI_CLIENTS, clear_rapi_cache
+from ganeti_webmgr.utils.client import GanetiRapiClient
 from ganeti_webmgr.utils.models import Quota
+from ganeti_webmgr.utils.rapi_cache import ResponseCache
+
+
+__all__ = ['TestClusterModel', 'TestSyncTransaction']
 
 
-__all__ = ['TestClusterModel']
+def query_result(fields, infos):
+    """
+    The response of a query for ``fields`` of the objects in ``infos``.
+    """
+    return {
+        'fields': [{'name': field} for field in fields],
+        'data': [[[0, info.get(field)] for field in fields]
+                 for info in infos],
+    }
 
 
 class TestClusterModel(TestCase):
@@ -68,6 +90,7 @@ class TestClusterModel(TestCase):
         Verifies:
             * mtime and ctime are parsed
             * ram, virtual_cpus, and disksize are parsed
+            * version, hypervisor, and master are parsed
         """
         cluster = Cluster(hostname='foo.fake.hostname')
         cluster.save()
@@ -77,6 +100,10 @@ class TestClusterModel(TestCase):
                          datetime.fromtimestamp(1270685309.818239))
         self.assertEqual(cluster.mtime,
                          datetime.fromtimestamp(1283552454.2998919))
+        self.assertEqual(INFO['software_version'], cluster.software_version)
+        self.assertEqual(INFO['default_hypervisor'],
+                         cluster.default_hypervisor)
+        self.assertEqual(INFO['master'], cluster.master)
 
         cluster.delete()
 
@@ -247,6 +274,158 @@ class TestClusterModel(TestCase):
         node_removed.delete()
         cluster.delete()
 
+    def test_bulk_sync(self):
+        """
+        Tests synchronizing Nodes and VirtualMachines with bulk info from
+        the ganeti cluster
+
+        Verifies:
+            * one bulk call is made for nodes and one for instances
+            * objects missing from the database are added with their info
+            * up to date objects are not rewritten
+            * objects no longer in ganeti are deleted only with remove
+            * resource summaries count synchronized VMs
+            * VMs missing from ganeti are recorded
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        vm_current = VirtualMachine.objects.create(
+            cluster=cluster, hostname='gimager2.example.bak')
+        vm_removed = VirtualMachine.objects.create(
+            cluster=cluster, hostname='does.not.exist.org')
+        cluster.rapi.GetInstances.reset()
+        cluster.rapi.GetNodes.reset()
+        cluster.rapi.GetInstance.reset()
+
+        stats = cluster.bulk_sync()
+        self.assertEqual([((), {'bulk': True})],
+                         cluster.rapi.GetInstances.calls)
+        self.assertEqual([((), {'bulk': True})], cluster.rapi.GetNodes.calls)
+        cluster.rapi.GetInstance.assertNotCalled(self)
+        self.assertEqual(3, stats['nodes']['created'])
+        self.assertEqual(1, stats['virtual_machines']['created'])
+        self.assertEqual(1, stats['virtual_machines']['updated'])
+        self.assertEqual(0, stats['virtual_machines']['deleted'])
+
+        vm = VirtualMachine.objects.get(cluster=cluster,
+                                        hostname='gimager.example.bak')
+        self.assertTrue(vm.cached)
+        self.assertEqual('gimager.example.bak', vm.info['name'])
+        self.assertEqual('gtest1.example.bak', vm.primary_node.hostname)
+        vm = VirtualMachine.objects.get(pk=vm_current.pk)
+        self.assertEqual(512, vm.ram)
+        self.assertTrue(VirtualMachine.objects.filter(pk=vm_removed.pk))
+        summary = ResourceSummary.objects.get(cluster=cluster, owner=None)
+        self.assertEqual(3, summary.total)
+        diff = VirtualMachineDiff.get_diffs([cluster])[cluster.id]
+        self.assertEqual([], diff['missing_in_db'])
+        self.assertEqual(['does.not.exist.org'], diff['missing_in_ganeti'])
+
+        stats = cluster.bulk_sync(remove=True)
+        self.assertEqual(0, stats['virtual_machines']['created'])
+        self.assertEqual(0, stats['virtual_machines']['updated'])
+        self.assertEqual(2, stats['virtual_machines']['unchanged'])
+        self.assertEqual(1, stats['virtual_machines']['deleted'])
+        self.assertFalse(VirtualMachine.objects.filter(pk=vm_removed.pk))
+        summary = ResourceSummary.objects.get(cluster=cluster, owner=None)
+        self.assertEqual(2, summary.total)
+
+        cluster.delete()
+
+    @override_settings(RAPI_RESPONSE_CACHE_TTL={'GetInstances': 60})
+    def test_diff_check_fresh(self):
+        """
+        Rechecking a cluster asks ganeti, not the response cache.
+        """
+        cache.clear()
+        clear_rapi_cache()
+        cluster = Cluster.objects.create(hostname='ganeti.example.test',
+                                         slug='ganeti')
+        rapi = GanetiRapiClient(cluster.hostname,
+                                response_cache=ResponseCache(cluster.hash))
+        RAPI_CLIENTS.add(cluster.pk, cluster.hash, lambda: rapi)
+        instances = [{'id': 'vm1.example.test'}]
+
+        class Response(object):
+            status_code = 200
+
+            @property
+            def content(self):
+                return json.dumps(instances)
+        rapi._GetSession().request = lambda *args, **kwargs: Response()
+
+        self.assertEqual(['vm1.example.test'], cluster.rapi.GetInstances())
+        instances.append({'id': 'vm2.example.test'})
+        VirtualMachineDiff.check(cluster)
+        diff = VirtualMachineDiff.get_diffs([cluster])[cluster.id]
+        self.assertEqual(['vm1.example.test', 'vm2.example.test'],
+                         diff['missing_in_db'])
+
+        clear_rapi_cache()
+        cluster.delete()
+
+    def test_bulk_sync_query(self):
+        """
+        Tests synchronizing with the query API
+
+        Verifies:
+            * one query is made for nodes and one for instances
+            * full info is fetched for new objects only
+            * nothing but the query is requested when nothing changed
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        cluster.info = dict(INFO, software_version='2.6.0')
+        cluster.save()
+        rapi = cluster.rapi
+        responses = rapi.GetNode.response, rapi.GetInstance.response
+        rapi.Query.response = ResponseMap([
+            ((('node', NODE_FIELDS, None), {}),
+             query_result(NODE_FIELDS, NODES_BULK)),
+            ((('instance', INSTANCE_FIELDS, None), {}),
+             query_result(INSTANCE_FIELDS, INSTANCES_BULK)),
+        ])
+        rapi.GetNode.response = ResponseMap(
+            [(((info['name'],), {}), info) for info in NODES_BULK])
+        rapi.GetInstance.response = ResponseMap(
+            [(((info['name'],), {}), info) for info in INSTANCES_BULK])
+
+        try:
+            for proxy in (rapi.Query, rapi.GetNodes, rapi.GetInstances,
+                          rapi.GetNode, rapi.GetInstance):
+                proxy.reset()
+
+            stats = cluster.bulk_sync()
+            self.assertEqual(2, len(rapi.Query.calls))
+            rapi.GetNodes.assertNotCalled(self)
+            rapi.GetInstances.assertNotCalled(self)
+            self.assertEqual(3, len(rapi.GetNode.calls))
+            self.assertEqual(2, len(rapi.GetInstance.calls))
+            self.assertEqual(3, stats['nodes']['created'])
+            self.assertEqual(2, stats['virtual_machines']['created'])
+
+            vm = VirtualMachine.objects.get(cluster=cluster,
+                                            hostname='gimager.example.bak')
+            self.assertEqual(INSTANCES_BULK[0], vm.info)
+            self.assertEqual('gtest1.example.bak', vm.primary_node.hostname)
+
+            rapi.GetNode.reset()
+            rapi.GetInstance.reset()
+            stats = cluster.bulk_sync()
+            rapi.GetNode.assertNotCalled(self)
+            rapi.GetInstance.assertNotCalled(self)
+            self.assertEqual(3, stats['nodes']['unchanged'])
+            self.assertEqual(2, stats['virtual_machines']['unchanged'])
+
+            with override_settings(QUERY_API_REFRESH=False):
+                rapi.Query.reset()
+                cluster.bulk_sync()
+                rapi.Query.assertNotCalled(self)
+                rapi.GetInstances.assertCalled(self, bulk=True)
+        finally:
+            rapi.GetNode.response, rapi.GetInstance.response = responses
+            rapi.Query.response = None
+
+        cluster.delete()
+
     def test_missing_in_database(self):
         """
         Tests missing_in_ganeti property
@@ -407,6 +586,55 @@ class TestClusterModel(TestCase):
         c.delete()
         c2.delete()
 
+    def test_with_stats(self):
+        """
+        Tests that Cluster.with_stats() agrees with the per cluster
+        properties, using the same queries for any number of clusters.
+        """
+        c = Cluster.objects.create(hostname='ganeti.example.test')
+        c2 = Cluster.objects.create(hostname='ganeti2.example.test',
+                                    slug='argh')
+        c3 = Cluster.objects.create(hostname='ganeti3.example.test',
+                                    slug='empty')
+        node = Node.objects.create(cluster=c, hostname='node.example.test')
+        node1 = Node.objects.create(cluster=c2, hostname='node1.example.test')
+        node.refresh()
+        Node.objects.filter(pk=node1.pk).update(offline=True)
+
+        VirtualMachine.objects.create(cluster=c, primary_node=node,
+                                      hostname='foo', ram=123, disk_size=10,
+                                      virtual_cpus=1, status='running')
+        VirtualMachine.objects.create(cluster=c, primary_node=node,
+                                      hostname='xoo', ram=789, disk_size=20,
+                                      virtual_cpus=1, status='admin_down')
+        VirtualMachine.objects.create(cluster=c, primary_node=node,
+                                      hostname='boo', status='running')
+        VirtualMachine.objects.create(cluster=c2, primary_node=node1,
+                                      hostname='gar', ram=888, disk_size=30,
+                                      virtual_cpus=2, status='running')
+
+        # instantiating clusters mustn't refresh them
+        Cluster.objects.update(cached=datetime.now())
+        with self.assertNumQueries(5):
+            clusters = Cluster.with_stats(Cluster.objects.all())
+        stats = dict((cluster.id, cluster.stats) for cluster in clusters)
+
+        for cluster in (c, c2, c3):
+            self.assertEqual(cluster.available_ram, stats[cluster.id]['ram'])
+            self.assertEqual(cluster.available_disk,
+                             stats[cluster.id]['disk'])
+        self.assertEqual(2, stats[c.id]['running_vms'])
+        self.assertEqual(3, stats[c.id]['total_vms'])
+        self.assertEqual(1, stats[c.id]['online_nodes'])
+        self.assertEqual(1, stats[c.id]['total_nodes'])
+        self.assertEqual(0, stats[c2.id]['online_nodes'])
+        self.assertEqual(1, stats[c2.id]['total_nodes'])
+        self.assertEqual(0, stats[c3.id]['total_vms'])
+
+        VirtualMachine.objects.all().delete()
+        Node.objects.all().delete()
+        Cluster.objects.all().delete()
+
     def test_redistribute_config(self):
         """
         Test Cluster.redistribute_config()
@@ -438,3 +666,77 @@ class TestClusterModel(TestCase):
         self.assertTrue(Job.objects.get(id=job_id).finished)
 
         cluster.delete()
+
+    def test_background_cache_refresh(self):
+        """
+        Test instantiating objects with BACKGROUND_CACHE_REFRESH enabled
+
+        Verifies:
+            * expired objects are loaded from the cache without a refresh
+            * objects without any cached info report an error
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        cluster.info = INFO
+        cluster.save()
+        Cluster.objects.filter(id=cluster.id).update(cached=None)
+        cluster.rapi.GetInfo.reset()
+
+        with override_settings(BACKGROUND_CACHE_REFRESH=True):
+            loaded = Cluster.objects.get(id=cluster.id)
+            cluster.rapi.GetInfo.assertNotCalled(self)
+            self.assertEqual(loaded.ctime,
+                             datetime.fromtimestamp(1270685309.818239))
+            self.assertFalse(loaded.error)
+
+            Cluster.objects.filter(id=cluster.id).update(serialized_info='')
+            loaded = Cluster.objects.get(id=cluster.id)
+            cluster.rapi.GetInfo.assertNotCalled(self)
+            self.assertEqual('No Cached Info', loaded.error)
+
+        cluster.delete()
+
+    def test_deferred_info(self):
+        """
+        Test loading objects with serialized_info deferred
+
+        Verifies:
+            * info is not loaded when the object is instantiated
+            * info is loaded when it is accessed
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test')
+        cluster.info = INFO
+        cluster.save()
+
+        with override_settings(BACKGROUND_CACHE_REFRESH=True):
+            with self.assertNumQueries(1):
+                loaded = Cluster.objects.defer('serialized_info') \
+                    .get(id=cluster.id)
+            self.assertFalse(loaded.error)
+            with self.assertNumQueries(1):
+                self.assertEqual(INFO['name'], loaded.info['name'])
+
+        cluster.delete()
+
+
+class TestSyncTransaction(TransactionTestCase):
+
+    def test_rollback(self):
+        """
+        Nodes are not synchronized when the VirtualMachines fail to be.
+        """
+        cluster = Cluster.objects.create(hostname='ganeti.example.test',
+                                         slug='ganeti')
+        recount = vars(ResourceSummary)['recount']
+
+        def fail(cls, cluster_id, owner_ids=None):
+            raise DatabaseError('disk full')
+
+        ResourceSummary.recount = classmethod(fail)
+        try:
+            self.assertRaises(DatabaseError, cluster.bulk_sync)
+        finally:
+            ResourceSummary.recount = recount
+
+        self.assertFalse(Node.objects.filter(cluster=cluster).exists())
+        self.assertFalse(VirtualMachine.objects.filter(cluster=cluster)
+                         .exists())
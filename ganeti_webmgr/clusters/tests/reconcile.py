@@ -0,0 +1,54 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+from django.test import SimpleTestCase
+
+from ..reconcile import reconcile
+
+__all__ = (
+    "TestReconcile",
+)
+
+
+class TestReconcile(SimpleTestCase):
+
+    def test_hostnames(self):
+        diff = reconcile(["a", "b", "c"], [u"b", u"c", u"d"])
+        self.assertEqual(set([u"a"]), diff.added)
+        self.assertEqual(set([u"d"]), diff.removed)
+        self.assertEqual(set(), diff.changed)
+        self.assertEqual(set([u"b", u"c"]), diff.unchanged)
+
+    def test_changed(self):
+        """
+        Objects in both are compared with the given callable, which gets the
+        info from ganeti and the row from the database.
+        """
+        ganeti = {"a": 1, "b": 2, "c": 3}
+        db = {u"a": 1, u"b": 1}
+        diff = reconcile(ganeti, db, lambda info, row: info > row)
+        self.assertEqual(set([u"c"]), diff.added)
+        self.assertEqual(set([u"b"]), diff.changed)
+        self.assertEqual(set([u"a"]), diff.unchanged)
+
+    def test_single_pass(self):
+        """
+        Querysets and other iterables are only consumed once.
+        """
+        diff = reconcile(iter(["a", "b"]), iter(["b"]))
+        self.assertEqual(set([u"a"]), diff.added)
+        self.assertEqual(set([u"b"]), diff.unchanged)
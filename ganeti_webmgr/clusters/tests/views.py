@@ -16,7 +16,10 @@
 # USA.
 
 
+from datetime import datetime
+
 from django.contrib.auth.models import User, Group
+from django.db import connection
 from django.test import TestCase
 from django.test.client import Client
 # Per #6579, do not change this import without discussion.
@@ -31,13 +34,15 @@ from ganeti_webmgr.utils.proxy.constants import NODES, NODES_BULK
 
 from ganeti_webmgr.clusters.models import Cluster
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
+from ganeti_webmgr.jobs.models import Job
 from ganeti_webmgr.utils.models import Quota, SSHKey
 
 
 __all__ = [
     "TestClusterViews",
     "TestClusterQuotaViews",
-    "TestClusterVMListView"
+    "TestClusterVMListView",
+    "TestClusterJobListView",
 ]
 
 
@@ -146,9 +151,9 @@ class TestClusterViews(TestCase, ViewTestMixin, UserTestMixin):
         self.assertEqual(200, response.status_code)
         self.assertEquals('text/html; charset=utf-8', response['content-type'])
         self.assertTemplateUsed(response, 'ganeti/cluster/list.html')
-        clusters = response.context['cluster_list']
-        self.assertTrue(self.cluster in clusters)
-        self.assertTrue(cluster1 not in clusters)
+        clusters = [c.pk for c in response.context['cluster_list']]
+        self.assertTrue(self.cluster.pk in clusters)
+        self.assertTrue(cluster1.pk not in clusters)
         self.assertEqual(1, len(clusters))
 
         # authorized (superuser)
@@ -158,13 +163,59 @@ class TestClusterViews(TestCase, ViewTestMixin, UserTestMixin):
         self.assertEqual(200, response.status_code)
         self.assertEquals('text/html; charset=utf-8', response['content-type'])
         self.assertTemplateUsed(response, 'ganeti/cluster/list.html')
-        clusters = response.context['cluster_list']
-        self.assertTrue(self.cluster in clusters)
-        self.assertTrue(cluster1 in clusters)
+        clusters = [c.pk for c in response.context['cluster_list']]
+        self.assertTrue(self.cluster.pk in clusters)
+        self.assertTrue(cluster1.pk in clusters)
         self.assertEqual(2, len(clusters))
 
         cluster1.delete()
 
+    def test_view_list_queries(self):
+        """
+        The cluster list is rendered in the same number of queries no matter
+        how many clusters, nodes, and virtual machines there are.
+        """
+        url = '/clusters/'
+        self.assertTrue(self.c.login(username=self.superuser.username,
+                                     password='secret'))
+
+        def count_queries():
+            # connection.queries is reset when the request starts
+            connection.use_debug_cursor = True
+            try:
+                response = self.c.get(url)
+            finally:
+                connection.use_debug_cursor = None
+            self.assertEqual(200, response.status_code)
+            return len(connection.queries), response
+
+        queries, response = count_queries()
+
+        clusters = [Cluster.objects.create(hostname='cluster%d' % i,
+                                           slug='cluster%d' % i)
+                    for i in range(3)]
+        for cluster in clusters:
+            for i in range(2):
+                VirtualMachine.objects.create(cluster=cluster,
+                                              hostname='vm%d.example' % i)
+        Cluster.objects.filter(pk=clusters[0].pk).update(
+            software_version='2.4.1', default_hypervisor='kvm',
+            master='node.example')
+
+        more_queries, response = count_queries()
+        self.assertEqual(queries, more_queries)
+
+        rows = dict((cluster.pk, cluster)
+                    for cluster in response.context['cluster_list'])
+        self.assertEqual(2, rows[clusters[0].pk].vm_count)
+        self.assertEqual(0, rows[clusters[0].pk].node_count)
+        self.assertEqual(0, rows[self.cluster.pk].vm_count)
+        self.assertContains(response, 'node.example')
+        self.assertContains(response, '2.4.1')
+
+        for cluster in clusters:
+            cluster.delete()
+
     def test_view_add(self):
         """
         Tests adding a new cluster
@@ -1174,3 +1225,64 @@ class TestClusterVMListView(TestCase):
         vms = [vm.pk for vm in response.context['object_list']]
         expected_vms = [self.vm1.pk]
         self.assertEqual(vms, expected_vms)
+
+
+class TestClusterJobListView(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_user(
+            username="admin", password="secret")
+        self.cluster = Cluster.objects.create(
+            hostname='test.example.test',
+            slug='OSL_TEST'
+        )
+        self.admin.grant('admin', self.cluster)
+        for job_id, day in ((1, 3), (2, None), (3, 5), (4, 4), (5, 5)):
+            finished = datetime(2011, 1, day) if day else None
+            Job.objects.create(job_id=job_id, obj=self.cluster,
+                               cluster=self.cluster, finished=finished,
+                               status='success')
+
+    def tearDown(self):
+        Job.objects.all().delete()
+        self.admin.delete()
+        self.cluster.delete()
+
+    def get_jobs(self, query=''):
+        url = '/cluster/%s/jobs?count=2' % self.cluster.slug
+        # don't poll the jobs from ganeti
+        with self.settings(BACKGROUND_CACHE_REFRESH=True):
+            response = self.client.get(url + query)
+        self.assertEqual(response.status_code, 200)
+        table = response.context['table']
+        return [job.job_id for job in table.data], table.keyset
+
+    def test_pages(self):
+        """
+        Jobs are paged newest first, with unfinished jobs before any other,
+        in both directions.
+        """
+        self.client.login(username=self.admin.username, password='secret')
+        jobs, page = self.get_jobs()
+        self.assertEqual([2, 5], jobs)
+        self.assertFalse(page.has_previous)
+
+        jobs, page = self.get_jobs('&after=%s' % page.next_cursor)
+        self.assertEqual([3, 4], jobs)
+
+        jobs, last = self.get_jobs('&after=%s' % page.next_cursor)
+        self.assertEqual([1], jobs)
+        self.assertFalse(last.has_next)
+
+        jobs, page = self.get_jobs('&before=%s' % page.previous_cursor)
+        self.assertEqual([2, 5], jobs)
+        self.assertFalse(page.has_previous)
+
+        jobs, page = self.get_jobs('&sort=finished')
+        self.assertEqual([1, 4], jobs)
+        jobs, page = self.get_jobs('&sort=finished&after=%s'
+                                   % page.next_cursor)
+        self.assertEqual([3, 5], jobs)
+        jobs, page = self.get_jobs('&sort=finished&after=%s'
+                                   % page.next_cursor)
+        self.assertEqual([2], jobs)
@@ -24,7 +24,7 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
-from django.db.models import Q, Sum
+from django.db.models import Q
 from django.http import (HttpResponse, HttpResponseRedirect,
                          HttpResponseForbidden)
 from django.shortcuts import get_object_or_404, render_to_response, redirect
@@ -46,11 +46,13 @@ from object_log.views import list_for_object
 log_action = LogItem.objects.log_action
 
 from ganeti_webmgr.ganeti_web.backend.queries import (vm_qs_for_users,
-                                                      cluster_qs_for_user)
+                                                      cluster_qs_for_user,
+                                                      cluster_list_qs)
 
 from .forms import EditClusterForm, QuotaForm
 from .models import Cluster
 from ganeti_webmgr.authentication.models import Profile, ClusterUser
+from ganeti_webmgr.nodes.models import NO_RESOURCES, allocated_resources
 from ganeti_webmgr.utils.models import SSHKey
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 from ganeti_webmgr.jobs.models import Job
@@ -59,6 +61,7 @@ from ganeti_webmgr.ganeti_web.views import render_404
 from ganeti_webmgr.ganeti_web.views.generic import (NO_PRIVS,
                                                     LoginRequiredMixin,
                                                     PaginationMixin,
+                                                    KeysetPaginationMixin,
                                                     GWMBaseView)
 from ganeti_webmgr.ganeti_web.views.tables import (ClusterTable,
                                                    ClusterVMTable,
@@ -113,8 +116,9 @@ class ClusterListView(LoginRequiredMixin, PaginationMixin, GWMBaseView,
     def get_queryset(self):
         self.queryset = cluster_qs_for_user(self.request.user)
         qs = super(ClusterListView, self).get_queryset()
-        qs = qs.select_related("nodes", "virtual_machines")
-        return qs
+        # the list only shows fields, so leave out the info; stale rows
+        # aren't refreshed then either
+        return cluster_list_qs(qs).defer('serialized_info')
 
     def get_context_data(self, **kwargs):
         user = self.request.user
@@ -158,16 +162,23 @@ class ClusterVMListView(BaseVMListView):
         return context
 
 
-class ClusterJobListView(LoginRequiredMixin, PaginationMixin, GWMBaseView,
-                         SingleTableView):
+class ClusterJobListView(LoginRequiredMixin, KeysetPaginationMixin,
+                         GWMBaseView, SingleTableView):
 
     template_name = "ganeti/cluster/jobs.html"
     model = Job
     table_class = ClusterJobTable
+    keyset_fields = {
+        'job_id': 'job_id',
+        'operation': 'op',
+        'status': 'status',
+        'finished': 'finished',
+    }
+    default_keyset_order = '-finished'
 
     def get_template_names(self):
         if self.request.is_ajax():
-            template = ['table.html']  # all we need is the table
+            template = ['table_keyset.html']  # all we need is the table
         else:
             template = [self.template_name]
         return template
@@ -201,29 +212,17 @@ def nodes(request, cluster_slug):
     if not (user.is_superuser or user.has_perm('admin', cluster)):
         raise PermissionDenied(NO_PRIVS)
 
-    # query allocated CPUS for all nodes in this list.  Must be done here to
-    # avoid querying Node.allocated_cpus for each node in the list.  Repackage
-    # list so it is easier to retrieve the values in the template
-    values = VirtualMachine.objects \
-        .filter(cluster=cluster, status='running') \
-        .exclude(virtual_cpus=-1) \
-        .order_by() \
-        .values('primary_node') \
-        .annotate(cpus=Sum('virtual_cpus'))
-    cpus = {}
-    nodes = cluster.nodes.all()
-    for d in values:
-        cpus[d['primary_node']] = d['cpus']
-
-    # Include nodes that do not have any virtual machines on them.
+    # query the resources allocated on all nodes in this list at once, to
+    # avoid the aggregates of Node.ram, Node.disk and Node.allocated_cpus for
+    # each node in the list.
+    allocated = allocated_resources(cluster.id)
+    nodes = list(cluster.nodes.all())
     for node in nodes:
-        if node.pk not in cpus:
-            cpus[node.pk] = 0
+        node.allocated = allocated.get(node.pk, NO_RESOURCES)
 
     return render_to_response("ganeti/node/table.html",
                               {'cluster': cluster,
                                'nodes': nodes,
-                               'cpus': cpus,
                                },
                               context_instance=RequestContext(request),
                               )
@@ -252,8 +251,7 @@ def edit(request, cluster_slug=None):
             #   virtual machines on edit of cluster
             if cluster.info is None:
                 try:
-                    cluster.sync_nodes()
-                    cluster.sync_virtual_machines()
+                    cluster.bulk_sync()
                 except GanetiApiError:
                     # ganeti errors here are silently discarded.  It's
                     # valid to enter bad info.  A user might be adding
@@ -291,8 +289,7 @@ def refresh(request, cluster_slug):
     cluster = get_object_or_404(Cluster, slug=cluster_slug)
     try:
         cluster.refresh()
-        cluster.sync_nodes(remove=True)
-        cluster.sync_virtual_machines(remove=True)
+        cluster.bulk_sync(remove=True)
     except GanetiApiError as e:
         msg = str(e)
         msg = "<p>%s</p>" % msg
@@ -447,7 +444,8 @@ def job_status(request, id, rest=False):
     jobs = Job.objects.filter(status__in=("error", "running", "waiting"),
                               content_type=ct,
                               object_id=id).order_by('job_id')
-    jobs = [j.info for j in jobs]
+    # jobs the refresh daemon has not polled yet have no info
+    jobs = [j.info for j in jobs if j.info is not None]
 
     if rest:
         return jobs
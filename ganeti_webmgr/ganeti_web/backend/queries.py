@@ -15,11 +15,13 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
 # USA.
 
+from django.db import connection
 from django.db.models import Q
 
 from object_permissions import get_users_any, get_groups_any
 
 from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.nodes.models import Node
 from ganeti_webmgr.authentication.models import ClusterUser
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 
@@ -43,6 +45,28 @@ def cluster_qs_for_user(user, groups=True, readonly=True, **kwargs):
     return qs
 
 
+def _count_by_cluster(model):
+    qn = connection.ops.quote_name
+    return "SELECT COUNT(*) FROM %s WHERE %s.%s = %s.%s" % (
+        qn(model._meta.db_table), qn(model._meta.db_table),
+        qn(model._meta.get_field("cluster").column),
+        qn(Cluster._meta.db_table), qn(Cluster._meta.pk.column))
+
+
+def cluster_list_qs(qs):
+    """
+    Annotate clusters with the number of nodes and virtual machines they have,
+    as ``node_count`` and ``vm_count``.
+
+    The counts are correlated subqueries rather than a join with GROUP BY so
+    the two relations don't multiply each other.
+    """
+    return qs.extra(select={
+        "node_count": _count_by_cluster(Node),
+        "vm_count": _count_by_cluster(VirtualMachine),
+    })
+
+
 def admin_qs_for_cluster(cluster):
     """
     Get all users and groups which have admin permissions on a cluster.
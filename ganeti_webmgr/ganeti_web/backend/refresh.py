@@ -0,0 +1,224 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Refreshing of cached cluster objects outside of the request cycle.
+
+With ``BACKGROUND_CACHE_REFRESH`` enabled, models never refresh themselves
+when they are instantiated.  The functions here keep ``serialized_info``,
+``cached`` and ``mtime`` up to date instead; they are driven by the
+``refreshdaemon`` management command.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from Queue import Queue, Empty
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.ganeti_web import caps
+from ganeti_webmgr.jobs.tracker import JobTracker
+from ganeti_webmgr.nodes.models import Node
+from ganeti_webmgr.utils.client import GanetiApiError
+from ganeti_webmgr.utils.error_sink import ErrorSink
+from ganeti_webmgr.utils.rate_limit import background_requests
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_interval(cluster):
+    """
+    Returns how often a cluster is refreshed.
+
+    ``BACKGROUND_REFRESH_SCHEDULE`` may override the default
+    ``BACKGROUND_REFRESH_INTERVAL`` per cluster slug.
+    """
+    seconds = settings.BACKGROUND_REFRESH_SCHEDULE.get(
+        cluster.slug, settings.BACKGROUND_REFRESH_INTERVAL)
+    return timedelta(seconds=seconds)
+
+
+def refresh_cluster(cluster):
+    """
+    Refresh a cluster along with all of its nodes and virtual machines.
+
+    Nodes and virtual machines are fetched in bulk, and only the rows which
+    changed in ganeti are written.
+
+    Errors are stored and cleared together once the cluster is refreshed,
+    see ErrorSink.  Requests to the cluster yield to those of people using
+    the web interface, see background_requests().
+
+    @return the summary from Cluster.bulk_sync(), or None if the cluster
+    itself could not be refreshed
+    """
+    with ErrorSink(), background_requests():
+        cluster.refresh()
+        if cluster.error:
+            return None
+        return cluster.bulk_sync()
+
+
+def refresh_clusters(clusters, workers=8, timeout=None):
+    """
+    Refresh several clusters in parallel with a bounded pool of threads.
+
+    A cluster which takes longer than ``timeout`` seconds is reported as
+    timed out and its thread is abandoned; a replacement thread picks up the
+    remaining clusters so one hung cluster cannot stall the others.
+
+    @param clusters - queryset of the clusters to refresh
+    @return list of dicts, in the order of ``clusters``, with the keys
+    "cluster", "time" (seconds), "error" and "stats" (see refresh_cluster)
+    """
+    # without their info the clusters don't refresh themselves as they are
+    # loaded; each is refreshed once, by its worker
+    clusters = list(clusters.defer('serialized_info'))
+    results = [None] * len(clusters)
+    started = {}
+    pending = Queue()
+    lock = threading.Lock()
+
+    for i, cluster in enumerate(clusters):
+        pending.put(i)
+
+    def finish(i, error=None, stats=None):
+        with lock:
+            if results[i] is None:
+                results[i] = {
+                    'cluster': clusters[i],
+                    'time': time.time() - started[i],
+                    'error': error,
+                    'stats': stats,
+                }
+
+    def work():
+        try:
+            while True:
+                try:
+                    i = pending.get_nowait()
+                except Empty:
+                    return
+                started[i] = time.time()
+                try:
+                    stats = refresh_cluster(clusters[i])
+                except Exception as e:
+                    finish(i, error=str(e) or e.__class__.__name__)
+                else:
+                    finish(i, error=clusters[i].error, stats=stats)
+        finally:
+            # each thread gets its own database connection
+            connection.close()
+
+    def spawn():
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+
+    for x in xrange(min(workers, len(clusters))):
+        spawn()
+
+    while None in results:
+        time.sleep(0.05)
+        if timeout is None:
+            continue
+        now = time.time()
+        for i, start in started.items():
+            if results[i] is None and now - start > timeout:
+                finish(i, error='Timed out after %ss' % timeout)
+                spawn()
+
+    return results
+
+
+def refresh_pending(cluster):
+    """
+    Poll the pending jobs of a cluster, all with one request, and refresh
+    the objects whose jobs completed.
+
+    Objects with ``ignore_cache`` set and no job left to wait for are
+    refreshed as well; objects whose jobs are still running are left alone
+    until their jobs complete.
+    """
+    due = Q(last_job=None) & (Q(ignore_cache=True) | Q(cached=None))
+
+    with ErrorSink(), background_requests():
+        version = caps.classify(cluster) if cluster.info else None
+        JobTracker(cluster.id, cluster.rapi, version).poll()
+
+        for model in (Node, VirtualMachine):
+            for obj in model.objects.filter(due, cluster=cluster):
+                obj.refresh()
+
+        if Cluster.objects.filter(due, pk=cluster.pk).exists():
+            cluster.refresh()
+
+
+class CacheRefresher(object):
+    """
+    Refreshes every cluster on its own schedule.
+
+    A cluster is due when its interval has passed since it was last cached,
+    or since the last attempt to refresh it, so an unreachable cluster is
+    retried on schedule rather than on every cycle.
+    """
+
+    def __init__(self):
+        self.attempted = {}
+
+    def is_due(self, cluster, now):
+        times = [t for t in (cluster.cached, self.attempted.get(cluster.pk))
+                 if t is not None]
+        return not times or now >= max(times) + refresh_interval(cluster)
+
+    def run_once(self):
+        """
+        Run a single refresh cycle.
+
+        A cluster which fails to refresh is logged and skipped, so it can't
+        stop the others from being refreshed.
+
+        @return list of clusters which were fully refreshed
+        """
+        refreshed = []
+        for cluster in Cluster.objects.all():
+            now = datetime.now()
+            if self.is_due(cluster, now):
+                self.attempted[cluster.pk] = now
+                try:
+                    refresh_cluster(cluster)
+                except GanetiApiError:
+                    # the error is stored on the cluster; retry on schedule
+                    continue
+                except Exception:
+                    logger.exception("Failed to refresh cluster %s",
+                                     cluster.hostname)
+                    continue
+                refreshed.append(cluster)
+            else:
+                try:
+                    refresh_pending(cluster)
+                except Exception:
+                    logger.exception("Failed to refresh pending jobs of "
+                                     "cluster %s", cluster.hostname)
+        return refreshed
@@ -0,0 +1,184 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Retention of job and error history.
+
+Finished jobs and cleared errors which are older than the retention policy of
+their cluster, or beyond the number of rows it keeps, are moved to the
+JobArchive and GanetiErrorArchive tables.  Rows are moved in small batches,
+each in its own transaction, so the history tables are never locked for
+long.  The functions here are driven by the ``prunehistory`` management
+command.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Q
+from django.db.models.sql import DeleteQuery
+
+from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.jobs.models import Job, JobArchive
+from ganeti_webmgr.nodes.models import Node
+from ganeti_webmgr.utils.models import GanetiError, GanetiErrorArchive
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
+
+
+FINISHED = ('success', 'error', 'canceled')
+
+JOB_FIELDS = ('job_id', 'content_type', 'object_id', 'cluster', 'finished',
+              'status', 'op')
+ERROR_FIELDS = ('cluster', 'msg', 'code', 'timestamp', 'obj_type', 'obj_id')
+
+
+class Pruned(namedtuple("Pruned", "jobs errors")):
+    """
+    Numbers of jobs and errors pruned from a cluster.
+    """
+    __slots__ = ()
+
+
+def retention_policy(cluster):
+    """
+    Returns the retention policy of a cluster, a dict of the ``age`` in days
+    and the ``count`` of rows kept, either of which may be None.
+
+    ``HISTORY_RETENTION_SCHEDULE`` may override the default
+    ``HISTORY_RETENTION`` per cluster slug.
+    """
+    policy = dict(settings.HISTORY_RETENTION)
+    policy.update(settings.HISTORY_RETENTION_SCHEDULE.get(cluster.slug, {}))
+    return policy
+
+
+def expired(qs, field, policy, now=None):
+    """
+    Narrow a queryset to the rows which fall outside a retention policy.
+
+    @param qs - rows of a single cluster
+    @param field - the date the rows are aged by
+    @returns queryset, or None if the policy keeps every row
+    """
+    clauses = []
+
+    if policy.get("age") is not None:
+        cutoff = (now or datetime.now()) - timedelta(days=policy["age"])
+        clauses.append(Q(**{"%s__lt" % field: cutoff}))
+
+    if policy.get("count") is not None:
+        # the newest row beyond the count, and every row older than it
+        count = policy["count"]
+        rows = qs.order_by("-" + field, "-pk").values_list(field, "pk")
+        rows = list(rows[count:count + 1])
+        if rows:
+            value, pk = rows[0]
+            clauses.append(Q(**{"%s__lt" % field: value}) |
+                           Q(**{field: value, "pk__lte": pk}))
+
+    if not clauses:
+        return None
+    return qs.filter(reduce(lambda a, b: a | b, clauses))
+
+
+def prunable_jobs(cluster):
+    """
+    Finished jobs of a cluster.  Jobs which are still the last job of a
+    cluster, node or virtual machine are never pruned.
+    """
+    qs = Job.objects.filter(cluster=cluster, status__in=FINISHED,
+                            finished__isnull=False)
+    for model in (Cluster, Node, VirtualMachine):
+        last_jobs = model.objects.filter(last_job__isnull=False)
+        qs = qs.exclude(pk__in=last_jobs.values("last_job"))
+    return qs
+
+
+def prunable_errors(cluster):
+    """
+    Cleared errors of a cluster.
+    """
+    return GanetiError.objects.filter(cluster=cluster, cleared=True)
+
+
+def archive(qs, archive_model, fields, batch_size):
+    """
+    Move the rows of a queryset to an archive table, a batch at a time.
+
+    Rows are deleted without being instantiated, so jobs are never refreshed
+    from ganeti on their way out.
+
+    @param fields - names of the fields copied to the archive
+    @returns the number of rows moved
+    """
+    model = qs.model
+    using = router.db_for_write(model)
+    attnames = [archive_model._meta.get_field(name).attname
+                for name in fields]
+    moved = 0
+
+    while True:
+        with transaction.commit_on_success(using=using):
+            ids = list(qs.values_list("pk", flat=True)[:batch_size])
+            if not ids:
+                break
+            rows = model.objects.filter(pk__in=ids).values_list(*fields)
+            archive_model.objects.bulk_create(
+                [archive_model(**dict(zip(attnames, row))) for row in rows])
+            DeleteQuery(model).delete_batch(ids, using)
+        moved += len(ids)
+
+    return moved
+
+
+def prune_cluster(cluster, batch_size=None, dry_run=False, now=None):
+    """
+    Archive the jobs and errors of a cluster which fall outside its retention
+    policy.
+
+    @param dry_run - only count the rows which would be archived
+    @returns Pruned
+    """
+    batch_size = batch_size or settings.HISTORY_RETENTION_BATCH
+    policy = retention_policy(cluster)
+    jobs = expired(prunable_jobs(cluster), "finished", policy, now)
+    errors = expired(prunable_errors(cluster), "timestamp", policy, now)
+
+    if dry_run:
+        return Pruned(jobs.count() if jobs is not None else 0,
+                      errors.count() if errors is not None else 0)
+
+    return Pruned(
+        archive(jobs, JobArchive, JOB_FIELDS, batch_size)
+        if jobs is not None else 0,
+        archive(errors, GanetiErrorArchive, ERROR_FIELDS, batch_size)
+        if errors is not None else 0)
+
+
+def prune_history(clusters=None, **kwargs):
+    """
+    Archive the jobs and errors which fall outside the retention policies of
+    the given clusters, or of every cluster.
+
+    @returns dict of Cluster to Pruned
+    """
+    if clusters is None:
+        clusters = Cluster.objects.all()
+    return dict((cluster, prune_cluster(cluster, **kwargs))
+                for cluster in clusters)
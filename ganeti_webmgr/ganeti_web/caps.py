@@ -40,7 +40,13 @@ def classify(cluster):
     """
 
     # Extract the version string from the cluster.
-    s = cluster.info["software_version"]
+    return classify_version(cluster.info["software_version"])
+
+
+def classify_version(s):
+    """
+    Determine the class of a Ganeti version string.
+    """
 
     # First, try the whole splitting thing. If we can't do it that way, assume
     # it's ancient.
@@ -98,3 +104,11 @@ def has_sharedfile(cluster):
     """
 
     return classify(cluster) >= GANETI25
+
+
+def has_query(cluster):
+    """
+    Determine whether a cluster supports the query resource of the RAPI.
+    """
+
+    return classify(cluster) >= GANETI26
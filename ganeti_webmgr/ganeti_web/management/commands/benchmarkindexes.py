@@ -0,0 +1,208 @@
+import random
+import time
+from datetime import datetime
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from south.db import db
+from south.management.commands import patch_for_test_db_setup
+
+from ganeti_webmgr.authentication.models import ClusterUser
+from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.jobs.models import Job
+from ganeti_webmgr.nodes.models import Node
+from ganeti_webmgr.utils.models import GanetiError
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
+
+
+# the composite indexes added by the add_hot_filter_indexes migrations
+HOT_INDEXES = (
+    (Job, ('content_type', 'object_id', 'status')),
+    (GanetiError, ('obj_type', 'obj_id', 'cleared')),
+    (GanetiError, ('cluster', 'cleared')),
+    (VirtualMachine, ('cluster', 'status')),
+    (VirtualMachine, ('owner', 'cluster')),
+    (VirtualMachine, ('primary_node', 'status')),
+    (VirtualMachine, ('secondary_node', 'status')),
+)
+
+STATUSES = ('running', 'running', 'running', 'ADMIN_down', 'ERROR_down')
+
+
+def index_columns(model, fields):
+    return [model._meta.get_field(name).column for name in fields]
+
+
+class Command(BaseCommand):
+    help = ("Shows the query plans and timings of the hottest filters on a "
+            "seeded throw-away database, without and with the composite "
+            "indexes on Jobs, GanetiErrors and VirtualMachines.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--vms', type='int', dest='vms', default=100000,
+                    help='Virtual machines to seed the database with.'),
+        make_option('--clusters', type='int', dest='clusters', default=10,
+                    help='Clusters the virtual machines are spread over.'),
+        make_option('--repeat', type='int', dest='repeat', default=20,
+                    help='Times each query is run.'),
+        make_option('--noinput', action='store_false', dest='interactive',
+                    default=True,
+                    help='Replace a leftover test database without '
+                         'asking.'),
+    )
+
+    def handle(self, **options):
+        # build the test database from the models, which don't declare the
+        # composite indexes, rather than by migrating it
+        settings.SOUTH_TESTS_MIGRATE = False
+        patch_for_test_db_setup()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=0, autoclobber=not options['interactive'])
+
+        try:
+            self.stdout.write('Seeding %d virtual machines...\n'
+                              % options['vms'])
+            queries = self.seed(options['vms'], options['clusters'])
+
+            before = self.measure(queries, options['repeat'])
+            with transaction.commit_on_success():
+                for model, fields in HOT_INDEXES:
+                    db.create_index(model._meta.db_table,
+                                    index_columns(model, fields))
+            self.analyze()
+            after = self.measure(queries, options['repeat'])
+
+            for name, qs in queries:
+                self.stdout.write('\n%s\n' % name)
+                for label, results in (('before', before), ('after', after)):
+                    best, mean, plan = results[name]
+                    self.stdout.write('  %s: best %.2fms, mean %.2fms\n'
+                                      % (label, best, mean))
+                    for line in plan:
+                        self.stdout.write('    %s\n' % line)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def seed(self, vms, clusters):
+        """
+        Fill the database with clusters, nodes, owners, VMs, a job for each
+        VM and an error for every tenth, and return the hot queries to
+        measure against it as a list of (name, queryset).
+        """
+        rand = random.Random(0)
+        vm_type = ContentType.objects.get_for_model(VirtualMachine)
+
+        clusters = [Cluster.objects.create(hostname='cluster%d.example.test'
+                                           % i, slug='cluster%d' % i)
+                    for i in range(clusters)]
+        Node.objects.bulk_create([
+            Node(cluster=cluster, hostname='node%d.%s' % (i, cluster.hostname),
+                 cluster_hash=cluster.hash)
+            for cluster in clusters for i in range(20)])
+        nodes = {}
+        for pk, cluster_id in Node.objects.values_list('pk', 'cluster'):
+            nodes.setdefault(cluster_id, []).append(pk)
+        ClusterUser.objects.bulk_create(
+            [ClusterUser(name='owner%d' % i) for i in range(max(vms // 100,
+                                                                1))])
+        owners = list(ClusterUser.objects.values_list('pk', flat=True))
+
+        def vm(i):
+            cluster = clusters[i % len(clusters)]
+            primary, secondary = rand.sample(nodes[cluster.pk], 2)
+            return VirtualMachine(
+                cluster=cluster, hostname='vm%d.%s' % (i, cluster.hostname),
+                cluster_hash=cluster.hash, owner_id=rand.choice(owners),
+                status=rand.choice(STATUSES), primary_node_id=primary,
+                secondary_node_id=secondary)
+
+        for start in range(0, vms, 1000):
+            VirtualMachine.objects.bulk_create(
+                [vm(i) for i in range(start, min(start + 1000, vms))])
+
+        rows = list(VirtualMachine.objects.values_list('pk', 'cluster'))
+        now = time.time()
+        for start in range(0, len(rows), 1000):
+            Job.objects.bulk_create([
+                Job(job_id=i, content_type=vm_type, object_id=pk,
+                    cluster_id=cluster_id, op='OP_INSTANCE_STARTUP',
+                    status='error' if i % 20 == 0 else 'success')
+                for i, (pk, cluster_id) in enumerate(rows[start:start + 1000],
+                                                     start)])
+            GanetiError.objects.bulk_create([
+                GanetiError(cluster_id=cluster_id, obj_type=vm_type,
+                            obj_id=pk, msg='error', cleared=i % 3 != 0,
+                            timestamp=datetime.fromtimestamp(now - i))
+                for i, (pk, cluster_id) in enumerate(rows[start:start + 1000],
+                                                     start)
+                if i % 10 == 0])
+        self.analyze()
+
+        cluster = clusters[0]
+        owner = VirtualMachine.objects.filter(cluster=cluster) \
+            .values_list('owner', flat=True)[0]
+        node = nodes[cluster.pk][0]
+        owned = list(VirtualMachine.objects.filter(owner=owner)
+                     .values_list('pk', flat=True))
+
+        return [
+            ('Job(content_type, object_id, status)',
+             Job.objects.filter(content_type=vm_type, object_id__in=owned,
+                                status='error')),
+            ('GanetiError(obj_type, obj_id, cleared)',
+             GanetiError.objects.filter(obj_type=vm_type, obj_id__in=owned,
+                                        cleared=False)),
+            ('GanetiError(cluster, cleared)',
+             GanetiError.objects.filter(cluster=cluster, cleared=False)),
+            ('VirtualMachine(cluster, status)',
+             VirtualMachine.objects.filter(cluster=cluster,
+                                           status='running')),
+            ('VirtualMachine(owner, cluster)',
+             VirtualMachine.objects.filter(owner=owner, cluster=cluster)),
+            ('VirtualMachine(primary_node, status)',
+             VirtualMachine.objects.filter(primary_node=node,
+                                           status='running')),
+            ('VirtualMachine(secondary_node, status)',
+             VirtualMachine.objects.filter(secondary_node=node,
+                                           status='running')),
+        ]
+
+    def analyze(self):
+        """
+        Refresh the statistics the query planner chooses indexes by.
+        """
+        if connection.vendor in ('sqlite', 'postgresql'):
+            cursor = connection.cursor()
+            cursor.execute('ANALYZE')
+            transaction.commit_unless_managed()
+
+    def measure(self, queries, repeat):
+        """
+        Run each query, returning a dict of name to (best ms, mean ms, plan).
+        """
+        if connection.vendor == 'sqlite':
+            explain = 'EXPLAIN QUERY PLAN '
+        else:
+            explain = 'EXPLAIN '
+
+        results = {}
+        for name, qs in queries:
+            qs = qs.order_by().values_list('pk', flat=True)
+            sql, params = qs.query.sql_with_params()
+            cursor = connection.cursor()
+            cursor.execute(explain + sql, params)
+            plan = [' '.join(unicode(column) for column in row)
+                    for row in cursor.fetchall()]
+
+            timings = []
+            for i in range(repeat):
+                start = time.time()
+                list(qs.all())
+                timings.append((time.time() - start) * 1000)
+            results[name] = (min(timings), sum(timings) / len(timings), plan)
+        return results
@@ -0,0 +1,40 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.ganeti_web.backend.retention import prune_history
+
+
+class Command(BaseCommand):
+    help = ("Moves finished jobs and cleared errors which are older than "
+            "HISTORY_RETENTION to the archive tables.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--cluster', action='append', dest='clusters',
+                    default=[], metavar='SLUG',
+                    help='Only prune this cluster. May be repeated.'),
+        make_option('--batch-size', type='int', dest='batch_size',
+                    default=settings.HISTORY_RETENTION_BATCH,
+                    help='Rows moved per transaction.'),
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                    default=False,
+                    help='Only report what would be pruned.'),
+    )
+
+    def handle(self, **options):
+        verbosity = int(options.get('verbosity'))
+        clusters = Cluster.objects.all()
+        if options.get('clusters'):
+            clusters = clusters.filter(slug__in=options['clusters'])
+
+        pruned = prune_history(clusters, batch_size=options['batch_size'],
+                               dry_run=options['dry_run'])
+
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        for cluster in sorted(pruned, key=lambda c: c.slug):
+            jobs, errors = pruned[cluster]
+            if verbosity > 1 or (verbosity > 0 and (jobs or errors)):
+                self.stdout.write('%s %d jobs and %d errors of %s\n' % (
+                    verb, jobs, errors, cluster.hostname))
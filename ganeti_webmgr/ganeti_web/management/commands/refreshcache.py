@@ -1,14 +1,25 @@
+import time
+from optparse import make_option
+
 from django.core.management.base import NoArgsCommand
 from ganeti_webmgr.clusters.models import Cluster
 from ganeti_webmgr.nodes.models import Node
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 
-from ganeti_webmgr.utils.client import GanetiApiError
+from ganeti_webmgr.ganeti_web.backend.refresh import refresh_clusters
 
 
 class Command(NoArgsCommand):
     help = "Refreshes the Cache for Clusters, Nodes and Virtual Machines."
 
+    option_list = NoArgsCommand.option_list + (
+        make_option('--workers', type='int', dest='workers', default=8,
+                    help='Number of clusters refreshed in parallel.'),
+        make_option('--timeout', type='int', dest='timeout', default=300,
+                    help='Seconds after which a cluster is reported as '
+                         'timed out. 0 waits forever.'),
+    )
+
     def handle_noargs(self, **options):
         self.refresh_objects(**options)
 
@@ -18,7 +29,9 @@ class Command(NoArgsCommand):
         and then 0010 'force_object_refresh' migration
 
         Force a refresh of all Cluster, Nodes, and VirtualMachines, and
-        import any new Nodes.
+        import any new Nodes and VirtualMachines.  Clusters are refreshed in
+        parallel; a summary with the time taken and any error is printed for
+        each of them.
         """
         write = self.stdout.write
         flush = self.stdout.flush
@@ -31,33 +44,36 @@ class Command(NoArgsCommand):
                 flush()
 
         verbosity = int(options.get('verbosity'))
+        workers = max(options.get('workers'), 1)
+        timeout = options.get('timeout') or None
 
         wf('- Refreshing Cached Cluster Objects', verbosity=verbosity)
 
-        wf('> Synchronizing Cluster Nodes ', True, verbosity=verbosity)
-        flush()
+        # clearing mtime forces every object to be rewritten
         Cluster.objects.all().update(mtime=None)
-        for cluster in Cluster.objects.all().iterator():
-            try:
-                cluster.sync_nodes()
-                wf('.', verbosity=verbosity)
-            except GanetiApiError:
-                wf('E', verbosity=verbosity)
-
         Node.objects.all().update(mtime=None)
-        wf('> Refreshing Node Caches ', True, verbosity=verbosity)
-        for node in Node.objects.all().iterator():
-            try:
-                wf('.', verbosity=verbosity)
-            except GanetiApiError:
-                wf('E', verbosity=verbosity)
-
         VirtualMachine.objects.all().update(mtime=None)
-        wf('> Refreshing Instance Caches ', True, verbosity=verbosity)
-        for instance in VirtualMachine.objects.all().iterator():
-            try:
-                wf('.', verbosity=verbosity)
-            except GanetiApiError:
-                    wf('E', verbosity=verbosity)
+
+        summary = '%(created)d new, %(updated)d updated'
+
+        start = time.time()
+        results = refresh_clusters(Cluster.objects.all(), workers, timeout)
+
+        for result in results:
+            if result['error']:
+                status = 'E %s' % result['error']
+            elif result['stats']:
+                status = 'nodes: %s; VMs: %s' % (
+                    summary % result['stats']['nodes'],
+                    summary % result['stats']['virtual_machines'])
+            else:
+                status = 'OK'
+            wf('> %s %.2fs %s' % (result['cluster'].hostname, result['time'],
+                                  status), True, verbosity=verbosity)
+
+        errors = len([r for r in results if r['error']])
+        wf('> Refreshed %d clusters with %d errors in %.2fs' % (
+            len(results), errors, time.time() - start), True,
+            verbosity=verbosity)
 
         wf('\n', verbosity=verbosity)
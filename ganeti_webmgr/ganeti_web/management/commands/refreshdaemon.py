@@ -0,0 +1,40 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from ganeti_webmgr.ganeti_web.backend.refresh import CacheRefresher
+
+
+class Command(BaseCommand):
+    help = ("Keeps the cache for Clusters, Nodes and Virtual Machines fresh. "
+            "Use together with BACKGROUND_CACHE_REFRESH.")
+
+    option_list = BaseCommand.option_list + (
+        make_option('--once', action='store_true', dest='once',
+                    default=False,
+                    help='Run a single refresh cycle and exit.'),
+        make_option('--tick', type='int', dest='tick', default=5,
+                    help='Seconds to sleep between refresh cycles. Pending '
+                         'jobs are polled once per cycle.'),
+    )
+
+    def handle(self, **options):
+        verbosity = int(options.get('verbosity'))
+        refresher = CacheRefresher()
+
+        try:
+            while True:
+                start = time.time()
+                refreshed = refresher.run_once()
+                if verbosity > 0 and refreshed:
+                    self.stdout.write('Refreshed %s in %.2fs\n' % (
+                        ', '.join(c.hostname for c in refreshed),
+                        time.time() - start))
+                    self.stdout.flush()
+
+                if options.get('once'):
+                    break
+                time.sleep(options.get('tick'))
+        except KeyboardInterrupt:
+            pass
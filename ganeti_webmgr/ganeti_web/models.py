@@ -23,9 +23,11 @@ from django.contrib.auth.models import User, Group
 from django.contrib.sites import models as sites_app
 from django.contrib.sites.management import create_default_site
 from django.contrib.sites.models import Site
-from django.db.models.signals import post_save, post_syncdb
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      post_syncdb, pre_delete)
 from django.db.utils import DatabaseError
 
+from ganeti_webmgr.utils import invalidate_rapi
 from ganeti_webmgr.utils.logs import register_log_actions
 
 from object_log.models import LogItem
@@ -38,7 +40,8 @@ from ganeti_webmgr.muddle_users import signals as muddle_user_signals
 from ganeti_webmgr.authentication.models import Organization
 from ganeti_webmgr.clusters.models import Cluster
 from ganeti_webmgr.nodes.models import Node
-from ganeti_webmgr.virtualmachines.models import VirtualMachine
+from ganeti_webmgr.virtualmachines.models import (ResourceSummary,
+                                                  VirtualMachine)
 from ganeti_webmgr.utils.client import GanetiApiError
 
 import permissions
@@ -68,11 +71,20 @@ def create_profile(sender, instance, **kwargs):
 
 def update_cluster_hash(sender, instance, **kwargs):
     """
-    Updates the Cluster hash for all of it's VirtualMachines, Nodes, and Jobs
+    Updates the Cluster hash for all of it's VirtualMachines, Nodes, and Jobs,
+    and drops its RAPI client if it was created with other credentials.
     """
     instance.virtual_machines.all().update(cluster_hash=instance.hash)
     instance.jobs.all().update(cluster_hash=instance.hash)
     instance.nodes.all().update(cluster_hash=instance.hash)
+    invalidate_rapi(instance.pk, instance.hash)
+
+
+def drop_cluster_rapi(sender, instance, **kwargs):
+    """
+    Drops the RAPI client of a deleted Cluster, closing its connections.
+    """
+    invalidate_rapi(instance.pk)
 
 
 def update_organization(sender, instance, **kwargs):
@@ -83,9 +95,93 @@ def update_organization(sender, instance, **kwargs):
     org.name = instance.name
     org.save()
 
+
+# attributes of a VirtualMachine that its ResourceSummary depends on
+SUMMARY_ATTNAMES = ('cluster_id', 'owner_id', 'status', 'ram', 'disk_size',
+                    'virtual_cpus')
+
+
+def remember_summary(sender, instance, **kwargs):
+    """
+    Remembers the ResourceSummary a VirtualMachine was counted in when it was
+    loaded, and what it was counted as, so that summary can be adjusted when
+    the VM changes.
+
+    Nothing is remembered for VMs loaded without some of these fields, since
+    loading them would take a query per VM; their cluster is recounted
+    instead when they are saved, and they are loaded when they are deleted.
+    """
+    if not isinstance(instance, VirtualMachine):
+        return
+    if instance.pk is None:
+        # not saved yet, so not counted anywhere
+        instance._summary = None
+    elif not instance._deferred or all(a in instance.__dict__
+                                       for a in SUMMARY_ATTNAMES):
+        instance._summary = (instance.cluster_id, instance.owner_id,
+                             ResourceSummary.counted(instance))
+
+
+def load_summary(sender, instance, **kwargs):
+    """
+    Loads what a VirtualMachine loaded without the fields of its
+    ResourceSummary is counted as, while it can still be loaded before it is
+    deleted.
+    """
+    if (isinstance(instance, VirtualMachine)
+            and not hasattr(instance, '_summary')):
+        instance._summary = (instance.cluster_id, instance.owner_id,
+                             ResourceSummary.counted(instance))
+
+
+def update_summary(sender, instance, **kwargs):
+    """
+    Moves a VirtualMachine that was saved or deleted from the totals it was
+    counted in to the ones it counts in now.
+    """
+    if not isinstance(instance, VirtualMachine):
+        return
+    if kwargs['signal'] is post_delete:
+        summary = None
+    else:
+        summary = (instance.cluster_id, instance.owner_id,
+                   ResourceSummary.counted(instance))
+
+    if kwargs.get('raw') or not hasattr(instance, '_summary'):
+        # what the VM was counted as isn't known; raw saves, like loaddata,
+        # build VMs that look loaded but may not be counted at all
+        ResourceSummary.recount(instance.cluster_id)
+        instance._summary = summary
+        return
+    if summary == instance._summary:
+        return
+
+    changes = {}
+    if instance._summary is not None:
+        cluster_id, owner_id, totals = instance._summary
+        changes[cluster_id, owner_id] = dict((f, -v)
+                                             for f, v in totals.items())
+    if summary is not None:
+        cluster_id, owner_id, totals = summary
+        diff = changes.setdefault((cluster_id, owner_id),
+                                  dict.fromkeys(totals, 0))
+        for f, v in totals.items():
+            diff[f] += v
+    for (cluster_id, owner_id), diff in changes.items():
+        ResourceSummary.adjust(cluster_id, owner_id, diff)
+    instance._summary = summary
+
+
 post_save.connect(create_profile, sender=User)
 post_save.connect(update_cluster_hash, sender=Cluster)
+post_delete.connect(drop_cluster_rapi, sender=Cluster)
 post_save.connect(update_organization, sender=Group)
+# VMs loaded with defer() or only() are instances of a subclass, which sends
+# the signals as their sender
+post_init.connect(remember_summary)
+pre_delete.connect(load_summary)
+post_save.connect(update_summary)
+post_delete.connect(update_summary)
 
 
 def regenerate_cu_children(sender, **kwargs):
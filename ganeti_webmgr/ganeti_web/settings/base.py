@@ -193,9 +193,76 @@ LANGUAGES = (
 #    checked when the object is instantiated. It defaults to 600000ms, or ten
 #    minutes.
 LAZY_CACHE_REFRESH = 600000
+#    BACKGROUND_CACHE_REFRESH disables the lazy refresh entirely; objects are
+#    only ever loaded from the cache and the refreshdaemon management command
+#    keeps it fresh.  Each cluster is refreshed every
+#    BACKGROUND_REFRESH_INTERVAL seconds, unless BACKGROUND_REFRESH_SCHEDULE
+#    maps its slug to a different interval.
+BACKGROUND_CACHE_REFRESH = False
+BACKGROUND_REFRESH_INTERVAL = 600
+BACKGROUND_REFRESH_SCHEDULE = {}
+#    SERIALIZED_INFO_FORMAT is the encoding used for newly cached info:
+#    'zjson' (compressed JSON), 'json' or 'pickle'.  Rows in any of these
+#    formats can always be read.
+SERIALIZED_INFO_FORMAT = 'zjson'
+#    QUERY_API_REFRESH makes cluster refreshes ask clusters running Ganeti 2.6
+#    or newer for just the fields stored in the database, using the query
+#    API.  Full info is then only retrieved for objects that changed.
+QUERY_API_REFRESH = True
+# Finished jobs and cleared errors are moved to archive tables by the
+# prunehistory management command.  HISTORY_RETENTION keeps them for 'age'
+# days and keeps at most the newest 'count' of each per cluster; either may
+# be None.  HISTORY_RETENTION_SCHEDULE maps cluster slugs to policies
+# overriding it.  HISTORY_RETENTION_BATCH rows are moved per transaction.
+HISTORY_RETENTION = {'age': 90, 'count': 10000}
+HISTORY_RETENTION_SCHEDULE = {}
+HISTORY_RETENTION_BATCH = 500
 # Other GWM Stuff
 VNC_PROXY = 'localhost:8888'
 RAPI_CONNECT_TIMEOUT = 3
+# Each cached RAPI client keeps a pool of keep-alive connections to its
+# cluster master.  RAPI_POOL_SIZE is the number of connections kept per
+# cluster and RAPI_POOL_IDLE_TIMEOUT (seconds) is how long an unused pool is
+# kept before it is closed.
+RAPI_POOL_SIZE = 10
+RAPI_POOL_IDLE_TIMEOUT = 60
+# Each process keeps at most RAPI_CLIENT_CACHE_SIZE RAPI clients, dropping
+# the least recently used first.  Clients unused for RAPI_CLIENT_CACHE_TTL
+# seconds are dropped too; None keeps them until they are pushed out.
+RAPI_CLIENT_CACHE_SIZE = 100
+RAPI_CLIENT_CACHE_TTL = 3600
+# After RAPI_CIRCUIT_BREAKER_THRESHOLD failures in a row to connect to a
+# cluster master, requests to it fail immediately for
+# RAPI_CIRCUIT_BREAKER_COOLDOWN seconds.  Then a single request probes whether
+# the master is back.  The state is kept in Django's cache.
+RAPI_CIRCUIT_BREAKER_THRESHOLD = 3
+RAPI_CIRCUIT_BREAKER_COOLDOWN = 30
+# RAPI_LIMITS caps the requests sent to each cluster master: at most
+# 'concurrency' at once and 'rate' per second, in bursts of up to 'burst'.
+# The 'reserved' fraction of both is kept for requests made by pages rather
+# than by the background refresh.  Requests wait up to 'wait' seconds for
+# their turn before failing.  Set 'concurrency' or 'rate' to None to lift
+# that limit.  The state is kept in Django's cache.
+RAPI_LIMITS = {
+    'concurrency': 6,
+    'rate': 20,
+    'burst': 40,
+    'reserved': 0.25,
+    'wait': 10,
+}
+# Browsers follow running jobs by long-polling; JOB_WAIT_TIMEOUT (seconds) is
+# how long such a request is held open when the job doesn't change.
+JOB_WAIT_TIMEOUT = 30
+# Responses of read-only RAPI requests are kept in Django's cache.
+# RAPI_RESPONSE_CACHE_TTL maps client methods to the seconds their responses
+# are kept; other methods are not cached.  Submitting a job to a cluster
+# drops its cached responses.
+RAPI_RESPONSE_CACHE_TTL = {
+    'GetInfo': 60,
+    'GetOperatingSystems': 300,
+    'GetNodes': 30,
+    'GetInstances': 30,
+}
 
 
 def create_secrets(folder='.secrets'):
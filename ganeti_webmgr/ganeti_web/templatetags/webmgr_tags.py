@@ -343,14 +343,21 @@ def num_reducer(num1, num2, size_tag):
         return "%.2f / %.2f" % (num1/1024**5, num2/1024**5)
 
 
-# XXX Possible QuerySet (cluster.available_ram)
+def _cluster_stats(cluster):
+    """
+    Numbers precomputed by Cluster.with_stats(), if any.
+    """
+    return getattr(cluster, "stats", None)
+
+
 @register.simple_tag
 def cluster_memory(cluster, allocated=True, tag=False):
     """
     Pretty-print a memory quantity of the whole cluster
     in a dynamic unit based on filesizeformat
     """
-    d = cluster.available_ram
+    stats = _cluster_stats(cluster)
+    d = stats["ram"] if stats else cluster.available_ram
     size_tag = (filesizeformat(d["total"]*1024**2)).split(" ")[1]
     if tag is True:
         return "[%s]" % size_tag
@@ -361,14 +368,14 @@ def cluster_memory(cluster, allocated=True, tag=False):
                        float(d['total']*1024**2), size_tag.strip())
 
 
-# XXX Possible QuerySet (cluster.available_disk)
 @register.simple_tag
 def cluster_disk(cluster, allocated=True, tag=False):
     """
     Pretty-print a memory quantity of the whole cluster in a
     dyanmic unit based on filesizeformat
     """
-    d = cluster.available_disk
+    stats = _cluster_stats(cluster)
+    d = stats["disk"] if stats else cluster.available_disk
     size_tag = (filesizeformat(d["total"]*1024**2)).split(" ")[1]
     if tag is True:
         return "[%s]" % (size_tag)
@@ -379,23 +386,27 @@ def cluster_disk(cluster, allocated=True, tag=False):
                        float(d['total']*1024**2), size_tag.strip())
 
 
-# XXX QuerySet
 @register.simple_tag
 def format_running_vms(cluster):
     """
     Return number of VMs that are available and number of all VMs
     """
+    stats = _cluster_stats(cluster)
+    if stats:
+        return "%d/%d" % (stats["running_vms"], stats["total_vms"])
     return "%d/%d" % \
         (cluster.virtual_machines.filter(status="running").count(),
          cluster.virtual_machines.all().count())
 
 
-# XXX Possible QuerySet
 @register.simple_tag
 def format_online_nodes(cluster):
     """
     Return number of nodes that are online and number of all nodes
     """
+    stats = _cluster_stats(cluster)
+    if stats:
+        return "%d/%d" % (stats["online_nodes"], stats["total_nodes"])
     annotation = cluster.nodes.values('offline').annotate(count=Count('pk'))
     offline = online = 0
     for values in annotation:
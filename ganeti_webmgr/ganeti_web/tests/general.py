@@ -15,6 +15,8 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
 # USA.
 
+from datetime import datetime
+
 from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User, Group
@@ -26,12 +28,13 @@ from django.utils import simplejson as json
 from ganeti_webmgr.django_test_tools.views import ViewTestMixin
 
 from ganeti_webmgr.utils.proxy.constants import JOB_ERROR
-from ganeti_webmgr.utils.models import SSHKey
+from ganeti_webmgr.utils.models import GanetiError, SSHKey
 
 from ganeti_webmgr.clusters.models import Cluster
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 from ganeti_webmgr.jobs.models import Job
 from ..backend.queries import vm_qs_for_admins
+from ..views.general import merge_errors
 
 
 __all__ = ('TestGeneralViews', 'TestOverviewVMSummary')
@@ -73,6 +76,63 @@ class TestGeneralViews(TestCase, ViewTestMixin):
         Group.objects.all().delete()
         Job.objects.all().delete()
 
+    def test_merge_errors(self):
+        """
+        Errors and jobs are merged newest first, reading no further than the
+        merge has been consumed.
+        """
+        errors = [GanetiError(pk=2, timestamp=datetime(2011, 1, 6)),
+                  GanetiError(pk=1, timestamp=datetime(2011, 1, 4))]
+        with self.settings(BACKGROUND_CACHE_REFRESH=True):
+            jobs = [Job(pk=3), Job(pk=2, finished=datetime(2011, 1, 5)),
+                    Job(pk=1, finished=datetime(2011, 1, 3))]
+        read = []
+
+        def reading(objects):
+            for obj in objects:
+                read.append(obj)
+                yield obj
+
+        merged = merge_errors(reading(errors), reading(jobs))
+        self.assertEqual((False, jobs[0]), merged.next())
+        self.assertEqual((True, errors[0]), merged.next())
+        self.assertEqual(3, len(read))
+        self.assertEqual([(False, jobs[1]), (True, errors[1]),
+                          (False, jobs[2])], list(merged))
+
+    def test_view_errors(self):
+        """
+        Errors are listed newest first, a page at a time.
+        """
+        Job.objects.create(job_id=1, obj=self.vm, cluster=self.cluster,
+                           finished=datetime(2011, 1, 5), status="error")
+        Job.objects.create(job_id=2, obj=self.vm, cluster=self.cluster,
+                           status="error")
+        Job.objects.create(job_id=3, obj=self.vm, cluster=self.cluster,
+                           finished=datetime(2011, 1, 8), status="success")
+        for day in (4, 6, 7):
+            GanetiError.objects.create(cluster=self.cluster, obj=self.cluster,
+                                       msg="error %d" % day,
+                                       timestamp=datetime(2011, 1, day))
+
+        def listed(query=""):
+            response = self.c.get("/clusters/errors" + query)
+            self.assertEqual(200, response.status_code)
+            self.assertTemplateUsed(response, "ganeti/errors.html")
+            errors = [error.job_id if isinstance(error, Job) else error.msg
+                      for is_ganeti_error, error in response.context["errors"]]
+            return errors, response.context["older"]
+
+        self.assertTrue(self.c.login(username=self.user2.username,
+                        password="secret"))
+        # don't poll the jobs from ganeti
+        with self.settings(ITEMS_PER_PAGE=3, BACKGROUND_CACHE_REFRESH=True):
+            errors, older = listed()
+            self.assertEqual([2, "error 7", "error 6"], errors)
+            errors, last = listed("?" + older)
+            self.assertEqual([1, "error 4"], errors)
+            self.assertEqual(None, last)
+
     def test_view_overview(self):
         """
         Tests overview (status) page
@@ -293,3 +293,51 @@ class ImportViews(TestCase):
         self.assertFalse(response.context['form'].errors)
         self.assertEqual([], response.context['vms'])
         self.assertTrue(VirtualMachine.objects.filter(hostname='vm2').exists())
+
+    def test_recheck(self):
+        """
+        Tests that the missing VMs recorded for a cluster are shown until
+        they are rechecked
+
+        Verifies:
+            * clusters are only asked for their VMs the first time
+            * VMs imported since the last check are left out
+            * recheck records the current VMs and redirects to next
+        """
+        url = '/import/missing_db/'
+        recheck = '/import/recheck/'
+        self.cluster0.rapi.GetInstances.response = ['vm0', 'vm1', 'vm2']
+        self.cluster1.rapi.GetInstances.response = ['vm3', 'vm4']
+        self.user.is_superuser = True
+        self.user.save()
+        self.assertTrue(self.c.login(username=self.user.username,
+                                     password='secret'))
+
+        response = self.c.get(url)
+        self.assertEqual(['vm2'], [vm[2] for vm in response.context['vms']])
+        self.assertTrue(response.context['checked'])
+
+        self.cluster0.rapi.GetInstances.reset()
+        self.cluster0.rapi.GetInstances.response = ['vm0', 'vm1', 'vm6']
+        response = self.c.get(url)
+        self.assertEqual(['vm2'], [vm[2] for vm in response.context['vms']])
+        self.cluster0.rapi.GetInstances.assertNotCalled(self)
+
+        VirtualMachine.objects.create(hostname='vm2', cluster=self.cluster0)
+        response = self.c.get(url)
+        self.assertEqual([], response.context['vms'])
+
+        # GET is not allowed
+        response = self.c.get(recheck)
+        self.assertEqual(405, response.status_code)
+
+        response = self.c.post(recheck, {'next': url})
+        self.assertRedirects(response, url)
+        response = self.c.get(url)
+        self.assertEqual(['vm6'], [vm[2] for vm in response.context['vms']])
+
+        # unauthorized user
+        self.user.is_superuser = False
+        self.user.save()
+        response = self.c.post(recheck, {'next': url})
+        self.assertEqual(403, response.status_code)
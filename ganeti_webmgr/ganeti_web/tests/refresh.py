@@ -0,0 +1,170 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+import time
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..backend import refresh
+from ..backend.refresh import CacheRefresher, refresh_interval
+from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
+
+__all__ = (
+    "TestCacheRefresher",
+    "TestRefreshClusters",
+)
+
+
+@override_settings(BACKGROUND_CACHE_REFRESH=True,
+                   BACKGROUND_REFRESH_INTERVAL=600,
+                   BACKGROUND_REFRESH_SCHEDULE={"slow": 3600})
+class TestCacheRefresher(TestCase):
+
+    def setUp(self):
+        self.cluster = Cluster.objects.create(hostname="test.example.bak",
+                                              slug="test")
+        self.vm = VirtualMachine.objects.create(cluster=self.cluster,
+                                                hostname="gimager.example.bak")
+        self.refresher = CacheRefresher()
+
+    def test_refresh_interval(self):
+        self.assertEqual(timedelta(seconds=600),
+                         refresh_interval(self.cluster))
+        self.cluster.slug = "slow"
+        self.assertEqual(timedelta(seconds=3600),
+                         refresh_interval(self.cluster))
+
+    def test_run_once(self):
+        """
+        A cluster which was never cached is refreshed along with its VMs, and
+        is not refreshed again until its interval has passed.
+        """
+        self.assertEqual([self.cluster], self.refresher.run_once())
+
+        cluster = Cluster.objects.get(pk=self.cluster.pk)
+        self.assertTrue(cluster.cached)
+        self.assertTrue(cluster.info)
+        vm = VirtualMachine.objects.get(pk=self.vm.pk)
+        self.assertTrue(vm.cached)
+        self.assertTrue(vm.info)
+
+        self.assertEqual([], self.refresher.run_once())
+
+        later = datetime.now() + timedelta(seconds=601)
+        self.assertTrue(self.refresher.is_due(cluster, later))
+
+    def test_errors(self):
+        """
+        A cluster failing with an unexpected error is skipped and retried on
+        schedule, without stopping the cycle.
+        """
+        other = Cluster.objects.create(hostname="other.example.bak",
+                                       slug="other")
+        refresh_cluster = refresh.refresh_cluster
+
+        def broken(cluster):
+            if cluster.pk == self.cluster.pk:
+                raise KeyError("beparams")
+            return refresh_cluster(cluster)
+
+        refresh.refresh_cluster = broken
+        try:
+            self.assertEqual([other], self.refresher.run_once())
+        finally:
+            refresh.refresh_cluster = refresh_cluster
+        self.assertTrue(self.cluster.pk in self.refresher.attempted)
+
+        refresh_pending = refresh.refresh_pending
+
+        def broken_pending(cluster):
+            raise KeyError("status")
+
+        refresh.refresh_pending = broken_pending
+        try:
+            self.assertEqual([], self.refresher.run_once())
+        finally:
+            refresh.refresh_pending = refresh_pending
+
+    def test_refresh_pending(self):
+        """
+        Objects waiting on a job are refreshed on every cycle.
+        """
+        self.refresher.run_once()
+        VirtualMachine.objects.filter(pk=self.vm.pk).update(ignore_cache=True,
+                                                           cached=None)
+        self.refresher.run_once()
+        self.assertTrue(VirtualMachine.objects.get(pk=self.vm.pk).cached)
+
+
+class TestRefreshClusters(TestCase):
+
+    def setUp(self):
+        for hostname in ("ok", "slow", "broken"):
+            Cluster.objects.create(hostname="%s.example.bak" % hostname,
+                                   slug=hostname)
+        self.clusters = Cluster.objects.order_by("pk")
+        self.refreshed = []
+        self.refresh_cluster = refresh.refresh_cluster
+        refresh.refresh_cluster = self.fake_refresh
+
+    def tearDown(self):
+        refresh.refresh_cluster = self.refresh_cluster
+
+    def fake_refresh(self, cluster):
+        self.refreshed.append(cluster)
+        if cluster.hostname == "slow.example.bak":
+            time.sleep(1)
+        elif cluster.hostname == "broken.example.bak":
+            raise RuntimeError("connection refused")
+        return {"nodes": {}, "virtual_machines": {}}
+
+    def test_refresh_clusters(self):
+        """
+        Results are reported per cluster, in order, with errors.
+        """
+        results = refresh.refresh_clusters(self.clusters, workers=3)
+        self.assertEqual([c.pk for c in self.clusters],
+                         [r["cluster"].pk for r in results])
+        self.assertEqual(None, results[0]["error"])
+        self.assertTrue(results[0]["stats"])
+        self.assertTrue(results[1]["time"] >= 1)
+        self.assertEqual("connection refused", results[2]["error"])
+
+    def test_timeout(self):
+        """
+        A slow cluster times out without holding up the others, even with a
+        single worker.
+        """
+        start = time.time()
+        results = refresh.refresh_clusters(self.clusters, workers=1,
+                                           timeout=0.2)
+        self.assertTrue(time.time() - start < 1)
+        self.assertEqual(None, results[0]["error"])
+        self.assertEqual("Timed out after 0.2s", results[1]["error"])
+        self.assertEqual("connection refused", results[2]["error"])
+
+    def test_no_lazy_refresh(self):
+        """
+        Clusters are only refreshed by their worker, not as they are loaded.
+        """
+        refresh.refresh_clusters(self.clusters)
+        self.assertEqual(3, len(self.refreshed))
+        for cluster in self.refreshed:
+            self.assertEqual(None, cluster.cached)
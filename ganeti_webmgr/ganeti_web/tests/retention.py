@@ -0,0 +1,130 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ..backend.retention import Pruned, prune_history, retention_policy
+from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.jobs.models import Job, JobArchive
+from ganeti_webmgr.utils.models import GanetiError, GanetiErrorArchive
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
+
+__all__ = (
+    "TestRetention",
+)
+
+
+@override_settings(BACKGROUND_CACHE_REFRESH=True,
+                   HISTORY_RETENTION={"age": 30, "count": None},
+                   HISTORY_RETENTION_SCHEDULE={"short": {"count": 1}},
+                   HISTORY_RETENTION_BATCH=2)
+class TestRetention(TestCase):
+
+    def setUp(self):
+        self.cluster = Cluster.objects.create(hostname="test.example.bak",
+                                              slug="test")
+        self.vm = VirtualMachine.objects.create(cluster=self.cluster,
+                                                hostname="vm.example.bak")
+
+    def create_job(self, job_id, age, status="success"):
+        finished = datetime.now() - timedelta(days=age) if age else None
+        return Job.objects.create(job_id=job_id, obj=self.vm,
+                                  cluster=self.cluster, finished=finished,
+                                  status=status, op="OP_INSTANCE_STARTUP")
+
+    def create_error(self, msg, age, cleared=True):
+        timestamp = datetime.now() - timedelta(days=age)
+        return GanetiError.objects.create(cluster=self.cluster, obj=self.vm,
+                                          msg=msg, timestamp=timestamp,
+                                          cleared=cleared)
+
+    def job_ids(self, model=Job):
+        return sorted(model.objects.values_list("job_id", flat=True))
+
+    def test_retention_policy(self):
+        self.assertEqual({"age": 30, "count": None},
+                         retention_policy(self.cluster))
+        self.cluster.slug = "short"
+        self.assertEqual({"age": 30, "count": 1},
+                         retention_policy(self.cluster))
+
+    def test_age(self):
+        """
+        Finished jobs older than the policy are archived in batches, unless
+        they are still the last job of an object.
+        """
+        self.create_job(1, 10)
+        self.create_job(2, 40)
+        self.create_job(3, 50, status="error")
+        self.create_job(4, 60)
+        self.create_job(5, None, status="running")
+        last = self.create_job(6, 70)
+        VirtualMachine.objects.filter(pk=self.vm.pk).update(last_job=last)
+
+        pruned = prune_history()
+        self.assertEqual({self.cluster: Pruned(3, 0)}, pruned)
+        self.assertEqual([1, 5, 6], self.job_ids())
+        self.assertEqual([2, 3, 4], self.job_ids(JobArchive))
+        self.assertTrue(VirtualMachine.objects.filter(pk=self.vm.pk).exists())
+
+        archived = JobArchive.objects.get(job_id=3)
+        self.assertEqual("error", archived.status)
+        self.assertEqual("OP_INSTANCE_STARTUP", archived.op)
+        obj = archived.content_type.get_object_for_this_type(
+            pk=archived.object_id)
+        self.assertEqual(self.vm, obj)
+
+    def test_count(self):
+        """
+        Only the newest rows within the count of a cluster are kept.
+        """
+        self.cluster.slug = "short"
+        self.cluster.save()
+        self.create_job(1, 3)
+        self.create_job(2, 1)
+        self.create_job(3, 2)
+
+        self.assertEqual({self.cluster: Pruned(2, 0)}, prune_history())
+        self.assertEqual([2], self.job_ids())
+
+    def test_errors(self):
+        """
+        Only cleared errors are archived.
+        """
+        self.create_error("old", 40)
+        self.create_error("new", 10)
+        self.create_error("current", 40, cleared=False)
+
+        self.assertEqual({self.cluster: Pruned(0, 1)}, prune_history())
+        self.assertEqual(["current", "new"], sorted(
+            GanetiError.objects.values_list("msg", flat=True)))
+        archived = GanetiErrorArchive.objects.get()
+        self.assertEqual(("old", self.cluster, self.vm.pk),
+                         (archived.msg, archived.cluster, archived.obj_id))
+
+    def test_dry_run(self):
+        self.create_job(1, 40)
+        self.create_error("old", 40)
+
+        self.assertEqual({self.cluster: Pruned(1, 1)},
+                         prune_history(dry_run=True))
+        self.assertEqual([1], self.job_ids())
+        self.assertFalse(JobArchive.objects.exists())
+        self.assertFalse(GanetiErrorArchive.objects.exists())
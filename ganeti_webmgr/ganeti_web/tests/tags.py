@@ -60,5 +60,26 @@ class TestFilters(unittest.TestCase):
         self.assertEqual(fpt(512, 2048), "0.5 / 2")
         self.assertEqual(fpt(510972, 870910), "499 / 850.5")
 
+    def test_cluster_stats(self):
+        """
+        Numbers attached by Cluster.with_stats() are used without querying.
+        """
+        class FakeCluster(object):
+            stats = {
+                "running_vms": 2, "total_vms": 3,
+                "online_nodes": 1, "total_nodes": 2,
+                "ram": {"total": 2048, "free": 1024, "allocated": 1024,
+                        "used": 512},
+                "disk": {"total": 4096, "free": 1024, "allocated": 3072,
+                         "used": 2048},
+            }
+
+        cluster = FakeCluster()
+        self.assertEqual(tags.format_running_vms(cluster), "2/3")
+        self.assertEqual(tags.format_online_nodes(cluster), "1/2")
+        self.assertEqual(tags.cluster_memory(cluster), "1.00 / 2.00")
+        self.assertEqual(tags.cluster_memory(cluster, False), "0.50 / 2.00")
+        self.assertEqual(tags.cluster_disk(cluster), "3.00 / 4.00")
+
     def test_hvs(self):
         self.assertEqual(tags.hvs(["kvm", "xen-hvm"]), ["KVM", "Xen (HVM)"])
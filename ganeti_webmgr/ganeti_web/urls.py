@@ -130,6 +130,8 @@ urlpatterns += patterns(
         name='import-missing'),
     url(r'^import/missing_db/', 'missing_db',
         name='import-missing_db'),
+    url(r'^import/recheck/', 'recheck',
+        name='import-recheck'),
 )
 
 
@@ -15,25 +15,30 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
 # USA.
 
-from itertools import chain, izip, repeat
+from datetime import datetime
+import heapq
+from itertools import chain, islice
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied
-from django.db.models import Q, Count
+from django.db.models import Q, Count, Sum
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
+from django.utils.http import urlencode
 from django.utils.translation import ugettext as _
 from django.views.generic.base import TemplateView
 from django.http import HttpResponse
 
 from . import render_404
-from .generic import NO_PRIVS
+from .generic import NO_PRIVS, keyset_page
 from ..constants import VERSION
 from ..backend.queries import vm_qs_for_admins
 
-from ganeti_webmgr.clusters.models import Cluster
-from ganeti_webmgr.virtualmachines.models import VirtualMachine
+from ganeti_webmgr.clusters.models import Cluster, VirtualMachineDiff
+from ganeti_webmgr.virtualmachines.models import (ResourceSummary,
+                                                  VirtualMachine)
 from ganeti_webmgr.jobs.models import Job
 from ganeti_webmgr.utils.models import GanetiError
 from ganeti_webmgr.authentication.models import (ClusterUser,
@@ -49,23 +54,42 @@ class AboutView(TemplateView):
         return super(AboutView, self).render_to_response(context, **kwargs)
 
 
-def merge_errors(errors, jobs):
+def _error_age(obj):
     """
-    Merge iterables of errors and jobs together.
-
-    The resulting list contains tuples of (bool, object) where the first
-    member indicates whether the object is a ``GanetiError`` or ``Job``.
+    How long before the end of time an error or job happened.  Jobs which have
+    not finished are the newest, as with keyset_page().
     """
+    when = getattr(obj, "timestamp", None) or obj.finished or datetime.max
+    return datetime.max - when
 
-    def keyfunc(x):
-        """
-        Either the "finished" or "timestamp" attribute.
-        """
 
-        return getattr(x[1], "finished", getattr(x[1], "timestamp", 0))
+def merge_errors(errors, jobs):
+    """
+    Merge iterables of errors and jobs together, newest first.
 
-    i = chain(izip(repeat(True), errors), izip(repeat(False), jobs))
-    return list(sorted(i, key=keyfunc))
+    Both iterables must already be ordered newest first, and then by primary
+    key descending.  They are merged lazily, so no more of either is read than
+    is consumed.  The merge yields tuples of (bool, object) where the first
+    member indicates whether the object is a ``GanetiError`` or ``Job``.
+    """
+    heap = []
+    for is_ganeti_error, objects in ((True, errors), (False, jobs)):
+        objects = iter(objects)
+        for obj in objects:
+            heap.append((_error_age(obj), not is_ganeti_error, -obj.pk, obj,
+                         objects))
+            break
+    heapq.heapify(heap)
+
+    while heap:
+        age, is_job, pk, obj, objects = heap[0]
+        yield not is_job, obj
+        for obj in objects:
+            heapq.heapreplace(heap, (_error_age(obj), is_job, -obj.pk, obj,
+                                     objects))
+            break
+        else:
+            heapq.heappop(heap)
 
 
 USED_NOTHING = dict(disk=0, ram=0, virtual_cpus=0)
@@ -73,8 +97,8 @@ USED_NOTHING = dict(disk=0, ram=0, virtual_cpus=0)
 
 @login_required
 def get_errors(request):
-    """ Returns all errors that have ever been generated for clusters/vms
-    and then sends them to the errors page.
+    """ Returns a page of the errors that have ever been generated for
+    clusters/vms, newest first, and then sends them to the errors page.
     """
     user = request.user
 
@@ -110,8 +134,32 @@ def get_errors(request):
     if admin:
         ganeti_errors |= qs.get_errors(obj=clusters)
 
-    # merge error lists
-    errors = merge_errors(ganeti_errors, job_errors)
+    # merge a page of each list, seeking past the errors and jobs already
+    # shown on the previous pages
+    def cursor(name):
+        try:
+            return int(request.GET[name])
+        except (KeyError, ValueError):
+            return None
+
+    per_page = settings.ITEMS_PER_PAGE
+    cursors = {"errors_after": cursor("errors_after"),
+               "jobs_after": cursor("jobs_after")}
+    newer = any(pk is not None for pk in cursors.values())
+    ganeti_page = keyset_page(ganeti_errors, "-timestamp", per_page,
+                              after=cursors["errors_after"])
+    job_page = keyset_page(job_errors, "-finished", per_page,
+                           after=cursors["jobs_after"])
+    merged = merge_errors(ganeti_page.object_list, job_page.object_list)
+    errors = list(islice(merged, per_page))
+
+    older = None
+    if ganeti_page.has_next or job_page.has_next or list(islice(merged, 1)):
+        for is_ganeti_error, error in errors:
+            key = "errors_after" if is_ganeti_error else "jobs_after"
+            cursors[key] = error.pk
+        older = urlencode(dict((key, pk) for key, pk in cursors.items()
+                               if pk is not None))
 
     return render_to_response("ganeti/errors.html",
                               {
@@ -119,49 +167,95 @@ def get_errors(request):
                                   'cluster_list': clusters,
                                   'user': request.user,
                                   'errors': errors,
+                                  'newer': newer,
+                                  'older': older,
                               },
                               context_instance=RequestContext(request))
 
 
+def summary_resources(summary, quota):
+    """
+    Resources of a cluster for get_used_resources(), from the owner's
+    ResourceSummary of the cluster, if there is one.
+    """
+    if summary is None:
+        return {"used": USED_NOTHING, "set": quota, "total": 0, "running": 0}
+    return {"used": summary.used(), "set": quota, "total": summary.total,
+            "running": summary.running}
+
+
 def get_used_resources(cluster_user):
     """ help function for querying resources used for a given cluster_user """
     resources = {}
-    owned_vms = cluster_user.virtual_machines.all()
-    used = cluster_user.used_resources()
+    summaries = dict((summary.cluster_id, summary) for summary in
+                     ResourceSummary.objects.filter(owner=cluster_user))
     clusters = cluster_user.permissable.get_objects_any_perms(Cluster)
     quotas = Cluster.get_quotas(clusters, cluster_user)
 
     for cluster, quota in quotas.items():
-        resources[cluster] = {
-            "used": used.pop(cluster.id)
-            if cluster.id in used else USED_NOTHING,
-            "set": quota
-        }
-        resources[cluster]["total"] = owned_vms.filter(cluster=cluster).count()
-        resources[cluster]["running"] = owned_vms \
-            .filter(cluster=cluster, status="running").count()
+        resources[cluster] = summary_resources(summaries.pop(cluster.id, None),
+                                               quota)
 
     # add any clusters that have used resources
     # but no perms (and thus no quota)
     # since we know they don't have a custom quota just add the default quota
-    if used:
-        for cluster in Cluster.objects.filter(pk__in=used):
-            resources[cluster] = {"used": used[cluster.id],
-                                  "set": cluster.get_default_quota()}
-            resources[cluster]["total"] = owned_vms \
-                .filter(cluster=cluster).count()
-            resources[cluster]["running"] = owned_vms \
-                .filter(cluster=cluster, status="running").count()
+    if summaries:
+        for cluster in Cluster.objects.filter(pk__in=summaries):
+            resources[cluster] = summary_resources(
+                summaries[cluster.id], cluster.get_default_quota())
 
     return resources
 
 
+def get_vm_summary(user):
+    """
+    Count the running and total VMs a user administers, per cluster.
+
+    VMs on clusters the user administers are counted from the clusters'
+    ResourceSummaries.  Only VMs administered through permissions on the VMs
+    themselves are counted from the VirtualMachine table.
+
+    @returns dict of cluster hostname to a dict with the cluster's slug,
+    "running" and "total"
+    """
+    if user.is_superuser:
+        clusters = Cluster.objects.all()
+        vms = VirtualMachine.objects.none()
+    else:
+        clusters = user.get_objects_any_perms(Cluster, ['admin'])
+        vms = user.get_objects_any_perms(VirtualMachine, groups=True,
+                                         perms=['admin']) \
+            .exclude(cluster__in=clusters)
+
+    summaries = ResourceSummary.objects.filter(cluster__in=clusters) \
+        .values('cluster__hostname', 'cluster__slug') \
+        .annotate(total=Sum('total'), running=Sum('running'))
+    vms_total = vms.order_by() \
+        .values('cluster__hostname', 'cluster__slug') \
+        .annotate(total=Count('pk'))
+    vms_running = vms.filter(status='running').order_by() \
+        .values('cluster__hostname').annotate(running=Count('pk'))
+
+    vm_summary = {}
+    for cluster in chain(summaries, vms_total):
+        name = cluster.pop('cluster__hostname')
+        cluster.setdefault('running', 0)
+        vm_summary[name] = cluster
+    for cluster in vms_running:
+        vm_summary[cluster['cluster__hostname']]['running'] = \
+            cluster['running']
+    return vm_summary
+
+
 def get_vm_counts(clusters):
     """
     Helper for getting the list of orphaned/ready to import/missing VMs.
 
     @param clusters the list of clusters, for which numbers of VM are counted.
                     May be None, if update is set.
+
+    VMs ready to import and missing VMs are read from the differences
+    recorded when the clusters were last synchronized or rechecked.
     """
     format_key = 'cluster_admin_%d'
     orphaned = import_ready = missing = 0
@@ -177,14 +271,19 @@ def get_vm_counts(clusters):
         for i in annotated:
             result[format_key % i["cluster__pk"]] = {"orphaned": i["orphaned"]}
             orphaned += i["orphaned"]
+        diffs = VirtualMachineDiff.get_diffs(clusters)
         for cluster in clusters:
             key = format_key % cluster.pk
 
             if key not in result:
                 result[key] = {"orphaned": 0}
 
-            result[key]["import_ready"] = len(cluster.missing_in_db)
-            result[key]["missing"] = len(cluster.missing_in_ganeti)
+            diff = diffs.get(cluster.pk)
+            if diff is None:
+                result[key]["import_ready"] = result[key]["missing"] = 0
+                continue
+            result[key]["import_ready"] = len(diff["missing_in_db"])
+            result[key]["missing"] = len(diff["missing_in_ganeti"])
 
             import_ready += result[key]["import_ready"]
             missing += result[key]["missing"]
@@ -228,8 +327,8 @@ def overview(request, rest=False):
     select_clause = Q(content_type=vm_type, object_id__in=vms)
     if admin:
         select_clause |= Q(cluster__in=clusters)
-    job_errors = Job.objects.filter(error_clause & select_clause) \
-        .order_by("-finished")[:5]
+    job_errors = Job.objects.filter(error_clause & select_clause)
+    job_errors = keyset_page(job_errors, "-finished", 5).object_list
 
     # Build the list of job errors. Include jobs from any VMs for which the
     # user has access.
@@ -241,24 +340,10 @@ def overview(request, rest=False):
         ganeti_errors |= qs.get_errors(obj=clusters)
 
     # merge error lists
-    errors = merge_errors(ganeti_errors, job_errors)
-
-    # get vm summary - running and totals need to be done as separate queries
-    # and then merged into a single list
-    vms_running = (vms.filter(status='running')
-                      .order_by()
-                      .values('cluster__hostname', 'cluster__slug')
-                      .annotate(running=Count('pk')))
-    vms_total = (vms.order_by()
-                    .values('cluster__hostname', 'cluster__slug')
-                    .annotate(total=Count('pk')))
-    vm_summary = {}
-    for cluster in vms_total:
-        name = cluster.pop('cluster__hostname')
-        vm_summary[name] = cluster
-    for cluster in vms_running:
-        name = cluster['cluster__hostname']
-        vm_summary[name]['running'] = cluster['running']
+    ganeti_errors = ganeti_errors.order_by("-timestamp", "-pk").iterator()
+    errors = list(merge_errors(ganeti_errors, job_errors))
+
+    vm_summary = get_vm_summary(user)
 
     # get list of personas for the user: All groups, plus the user.
     # include the user if they own a vm or have perms on at least one cluster
@@ -277,7 +362,7 @@ def overview(request, rest=False):
     else:
         context = {
             'admin': admin,
-            'cluster_list': clusters,
+            'cluster_list': Cluster.with_stats(clusters),
             'user': request.user,
             'errors': errors,
             'orphaned': orphaned,
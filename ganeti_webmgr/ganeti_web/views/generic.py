@@ -6,6 +6,7 @@ from collections import Iterable
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.db.models import Q
 from django.utils.decorators import method_decorator
 from django.utils.http import urlencode
 from django.utils.translation import ugettext as _
@@ -105,6 +106,171 @@ class PaginationMixin(object):
         return self.request.GET.get("count", self.paginate_by)
 
 
+def _pk(row):
+    return row["id"] if isinstance(row, dict) else row.pk
+
+
+class KeysetPage(object):
+    """
+    A page of rows selected by keyset_page().
+
+    The cursors are the primary keys of the rows at the edges of the page,
+    to be passed as ``after`` or ``before`` to select the adjacent pages.
+    """
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return _pk(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return _pk(self.object_list[0])
+
+
+def _nullable(model, field):
+    """
+    Whether a field, which may span relations, can be NULL.
+    """
+    names = field.split("__")
+    for name in names[:-1]:
+        model = model._meta.get_field(name).rel.to
+    return model._meta.get_field(names[-1]).null
+
+
+def keyset_page(qs, order_by, per_page, after=None, before=None):
+    """
+    Select a page of a queryset ordered by a field and then by primary key,
+    starting after (or ending before) the row with the given primary key.
+
+    Unlike slicing, which makes the database count off every row before the
+    page, this seeks directly to the page through the ordering, so late pages
+    cost as much as the first.  Rows where a nullable ``order_by`` is NULL are
+    ordered as greater than all others, whatever the database does with them.
+
+    @param qs - queryset, or values() queryset including ``id``
+    @param order_by - field name, prefixed with "-" for descending order
+    @param after - primary key of the last row of the previous page
+    @param before - primary key of the first row of the next page
+    @returns KeysetPage.  A cursor which is no longer in ``qs`` selects the
+    first page.
+    """
+    field = order_by.lstrip("-")
+    descending = order_by.startswith("-")
+    cursor = after if after is not None else before
+    forward = after is not None or before is None
+
+    value = None
+    if cursor is not None:
+        values = list(qs.filter(pk=cursor).values_list(field, flat=True)[:1])
+        if values:
+            value = values[0]
+        else:
+            cursor = None
+            forward = True
+
+    # whether the rows come after the cursor in the order of the table
+    greater = forward != descending
+    op = "gt" if greater else "lt"
+    # rows with a value, and rows without one, which come after the cursor
+    if cursor is None:
+        seek, nulls = qs, qs
+    elif value is None:
+        seek = None if greater else qs
+        nulls = qs.filter(**{"pk__%s" % op: cursor})
+    else:
+        seek = qs.filter(Q(**{"%s__%s" % (field, op): value}) |
+                         Q(**{field: value, "pk__%s" % op: cursor}))
+        nulls = qs if greater else None
+
+    if _nullable(qs.model, field):
+        if seek is not None:
+            seek = seek.filter(**{"%s__isnull" % field: False})
+        if nulls is not None:
+            nulls = nulls.filter(**{"%s__isnull" % field: True})
+        segments = [seek, nulls] if greater else [nulls, seek]
+    else:
+        segments = [seek]
+
+    prefix = "" if greater else "-"
+    rows = []
+    for segment in segments:
+        if segment is not None and len(rows) <= per_page:
+            segment = segment.order_by(prefix + field, prefix + "pk")
+            rows.extend(segment[:per_page + 1 - len(rows)])
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if forward:
+        return KeysetPage(rows, more, cursor is not None)
+    rows.reverse()
+    return KeysetPage(rows, cursor is not None, more)
+
+
+class KeysetPaginationMixin(object):
+    """
+    Paginates the table of a SingleTableView with keyset_page() instead of
+    page numbers.
+
+    The table may be sorted by the columns in ``keyset_fields``, which maps
+    column names to the fields they are ordered by.  Rows are selected from
+    get_keyset_queryset() and may be turned into the records of the table by
+    get_keyset_rows().  The page is available to templates as
+    ``table.keyset``.
+    """
+
+    keyset_fields = {}
+    default_keyset_order = None
+    paginate_by = settings.ITEMS_PER_PAGE
+    table_pagination = False
+
+    def get_paginate_by(self, queryset):
+        # the table is paginated by keyset; don't count the list for pages
+        return None
+
+    def get_keyset_order(self):
+        order_field = self.get_table_class()._meta.order_by_field
+        order = self.request.GET.get(order_field, self.default_keyset_order)
+        if order.lstrip("-") not in self.keyset_fields:
+            order = self.default_keyset_order
+        prefix = "-" if order.startswith("-") else ""
+        return prefix + self.keyset_fields[order.lstrip("-")]
+
+    def get_keyset_queryset(self):
+        return self.object_list
+
+    def get_keyset_rows(self, rows):
+        return rows
+
+    def get_table_data(self):
+        def cursor(name):
+            try:
+                return int(self.request.GET[name])
+            except (KeyError, ValueError):
+                return None
+
+        try:
+            per_page = int(self.request.GET.get("count", self.paginate_by))
+        except ValueError:
+            per_page = self.paginate_by
+
+        self.keyset = keyset_page(self.get_keyset_queryset(),
+                                  self.get_keyset_order(), max(per_page, 1),
+                                  cursor("after"), cursor("before"))
+        return self.get_keyset_rows(self.keyset.object_list)
+
+    def get_table(self):
+        table = super(KeysetPaginationMixin, self).get_table()
+        table.keyset = self.keyset
+        return table
+
+
 class SortingMixin(object):
     """
     A mixin which provides sorting for a ListView
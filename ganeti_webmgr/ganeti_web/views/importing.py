@@ -16,18 +16,38 @@
 # USA.
 from collections import defaultdict
 
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
-from django.shortcuts import render_to_response
+from django.core.urlresolvers import reverse
+from django.shortcuts import redirect, render_to_response
 from django.template import RequestContext
+from django.utils.http import is_safe_url
+from django.views.decorators.http import require_POST
 
 from ..forms.importing import ImportForm, OrphanForm, VirtualMachineForm
 from .generic import NO_PRIVS
 
-from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.clusters.models import Cluster, VirtualMachineDiff
+from ganeti_webmgr.utils.client import GanetiApiError
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 
 
+def recorded_vms(clusters, key):
+    """
+    VMs of the clusters from their recorded VirtualMachineDiffs.
+
+    @param key - "missing_in_db" or "missing_in_ganeti"
+    @returns list of (cluster, hostname) tuples, and the time of the oldest
+    check of the clusters
+    """
+    diffs = VirtualMachineDiff.get_diffs(clusters)
+    vms = [(cluster, hostname) for cluster in clusters
+           if cluster.id in diffs for hostname in diffs[cluster.id][key]]
+    checked = [diff['checked'] for diff in diffs.values()]
+    return vms, min(checked) if checked else None
+
+
 @login_required
 def orphans(request):
     """
@@ -101,10 +121,8 @@ def missing_ganeti(request):
         if not clusters:
             raise PermissionDenied(NO_PRIVS)
 
-    vms = []
-    for cluster in clusters:
-        for vm in cluster.missing_in_ganeti:
-            vms.append((vm, vm))
+    recorded, checked = recorded_vms(clusters, 'missing_in_ganeti')
+    vms = [(vm, vm) for cluster, vm in recorded]
 
     if request.method == 'POST':
         # process updates if this was a form submission
@@ -122,15 +140,15 @@ def missing_ganeti(request):
             q.delete()
 
             # remove updated vms from the list
-            vms = filter(lambda x: unicode(x[0]) not in vm_ids, vms)
+            recorded = [(cluster, vm) for cluster, vm in recorded
+                        if vm not in vm_ids]
 
     else:
         form = VirtualMachineForm(vms)
 
     vms = {}
-    for cluster in clusters:
-        for vm in cluster.missing_in_ganeti:
-            vms[vm] = (cluster.hostname, vm)
+    for cluster, vm in recorded:
+        vms[vm] = (cluster.hostname, vm)
 
     vmhostnames = vms.keys()
     vmhostnames.sort()
@@ -143,7 +161,8 @@ def missing_ganeti(request):
 
     return render_to_response("ganeti/importing/missing.html",
                               {'vms': vms,
-                               'form': form, },
+                               'form': form,
+                               'checked': checked, },
                               context_instance=RequestContext(request), )
 
 
@@ -160,10 +179,9 @@ def missing_db(request):
         if not clusters:
             raise PermissionDenied(NO_PRIVS)
 
-    vms = []
-    for cluster in clusters:
-        for hostname in cluster.missing_in_db:
-            vms.append(('%s:%s' % (cluster.id, hostname), hostname))
+    recorded, checked = recorded_vms(clusters, 'missing_in_db')
+    vms = [('%s:%s' % (cluster.id, hostname), hostname)
+           for cluster, hostname in recorded]
 
     if request.method == 'POST':
         # process updates if this was a form submission
@@ -188,17 +206,16 @@ def missing_db(request):
                     orphaned[cluster.pk] += 1
 
             # remove created vms from the list
-            vms = filter(lambda x: unicode(x[0])
-                         not in vm_ids, vms)
+            recorded = [(cluster, hostname) for cluster, hostname in recorded
+                        if u'%s:%s' % (cluster.id, hostname) not in vm_ids]
 
     else:
         form = ImportForm(vms)
 
     vms = {}
-    for cluster in clusters:
-        for hostname in cluster.missing_in_db:
-            vms[hostname] = (u'%s:%s' % (cluster.id, hostname),
-                             unicode(cluster.hostname), unicode(hostname))
+    for cluster, hostname in recorded:
+        vms[hostname] = (u'%s:%s' % (cluster.id, hostname),
+                         unicode(cluster.hostname), unicode(hostname))
     vmhostnames = vms.keys()
     vmhostnames.sort()
 
@@ -211,5 +228,33 @@ def missing_db(request):
     return render_to_response("ganeti/importing/missing_db.html",
                               {'vms': vms,
                                'form': form,
+                               'checked': checked,
                                },
                               context_instance=RequestContext(request), )
+
+
+@login_required
+@require_POST
+def recheck(request):
+    """
+    Request the VMs of every cluster the user administers from ganeti now and
+    record the VMs missing from the database or from ganeti.
+    """
+    user = request.user
+    if user.is_superuser:
+        clusters = Cluster.objects.all()
+    else:
+        clusters = user.get_objects_any_perms(Cluster, ['admin'])
+        if not clusters:
+            raise PermissionDenied(NO_PRIVS)
+
+    for cluster in clusters:
+        try:
+            VirtualMachineDiff.check(cluster)
+        except GanetiApiError as e:
+            messages.error(request, "%s: %s" % (cluster.hostname, e))
+
+    next = request.POST.get('next')
+    if not is_safe_url(next, host=request.get_host()):
+        next = reverse('import-missing_db')
+    return redirect(next)
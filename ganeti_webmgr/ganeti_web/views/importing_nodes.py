@@ -55,10 +55,9 @@ def missing_ganeti(request):
         if not clusters:
             raise PermissionDenied(NO_PRIVS)
 
-    nodes = []
-    for cluster in clusters:
-        for node in cluster.nodes_missing_in_ganeti:
-            nodes.append((node, node))
+    missing = [(cluster, node) for cluster in clusters
+               for node in cluster.reconcile_nodes().removed]
+    nodes = [(node, node) for cluster, node in missing]
 
     if request.method == 'POST':
         # process updates if this was a form submission
@@ -68,14 +67,15 @@ def missing_ganeti(request):
             data = form.cleaned_data
             node_ids = data['nodes']
             Node.objects.filter(hostname__in=node_ids).delete()
+            missing = [(cluster, node) for cluster, node in missing
+                       if node not in node_ids]
 
     else:
         form = NodeForm(nodes)
 
     nodes = {}
-    for cluster in clusters:
-        for node in cluster.nodes_missing_in_ganeti:
-            nodes[node] = (cluster.hostname, node)
+    for cluster, node in missing:
+        nodes[node] = (cluster.hostname, node)
 
     node_hostnames = nodes.keys()
     node_hostnames.sort()
@@ -106,10 +106,10 @@ def missing_db(request):
         if not clusters:
             raise PermissionDenied(NO_PRIVS)
 
-    nodes = []
-    for cluster in clusters:
-        for hostname in cluster.nodes_missing_in_db:
-            nodes.append(('%s:%s' % (cluster.id, hostname), hostname))
+    missing = [(cluster, hostname) for cluster in clusters
+               for hostname in cluster.reconcile_nodes().added]
+    nodes = [('%s:%s' % (cluster.id, hostname), hostname)
+             for cluster, hostname in missing]
 
     if request.method == 'POST':
         # process updates if this was a form submission
@@ -138,13 +138,15 @@ def missing_db(request):
                             hostname__in=node.info['sinst_list']) \
                     .update(secondary_node=node)
 
+            missing = [(cluster, hostname) for cluster, hostname in missing
+                       if '%s:%s' % (cluster.id, hostname) not in node_ids]
+
     else:
         form = NodeForm(nodes)
 
     nodes = {}
-    for cluster in clusters:
-        for hostname in cluster.nodes_missing_in_db:
-            nodes[hostname] = ('%s:%s' % (cluster.id, hostname),
+    for cluster, hostname in missing:
+        nodes[hostname] = ('%s:%s' % (cluster.id, hostname),
                                cluster.hostname, hostname)
     node_hostnames = nodes.keys()
     node_hostnames.sort()
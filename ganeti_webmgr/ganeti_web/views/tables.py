@@ -1,3 +1,4 @@
+from django.utils.html import conditional_escape
 from django.utils.safestring import mark_safe
 
 from django_tables2 import (Table, Column, LinkColumn, TemplateColumn,
@@ -17,6 +18,10 @@ class BaseTable(Table):
 
 
 class BaseVMTable(BaseTable):
+    """
+    Table of VMs, built from the records of
+    virtualmachines.views.vm_list_rows() and paginated by keyset.
+    """
 
     status = TemplateColumn(
         template_name="ganeti/virtual_machine/vmfield_status.html",
@@ -34,8 +39,9 @@ class BaseVMTable(BaseTable):
                 "instance": A("hostname")},
         verbose_name='name',
     )
-    owner = Column()
-    node = Column(verbose_name='node', accessor="primary_node")
+    owner = Column(orderable=False)
+    node = Column(verbose_name='node', accessor="primary_node",
+                  orderable=False)
     operating_system = Column(verbose_name='OS')
     ram = Column(verbose_name='RAM')
     disk_size = Column(verbose_name='disk space')
@@ -46,6 +52,10 @@ class BaseVMTable(BaseTable):
         order_by = ("hostname")
         empty_text = "No Virtual Machines"
 
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("template", "table_keyset.html")
+        super(BaseVMTable, self).__init__(*args, **kwargs)
+
     def render_disk_size(self, value):
         return render_storage(value)
 
@@ -59,9 +69,9 @@ class BaseVMTable(BaseTable):
         return abbreviate_fqdn(value)
 
     def render_owner(self, value):
-        url = value.get_absolute_url()
         url_str = '<a href="{0}">{1}</a>'
-        return mark_safe(url_str.format(url, value))
+        return mark_safe(url_str.format(conditional_escape(value["url"]),
+                                        conditional_escape(value["name"])))
 
 
 class VMTable(BaseVMTable):
@@ -131,26 +141,22 @@ class ClusterTable(BaseTable):
     )
     description = Column()
     version = Column(
-        accessor="info.software_version",
-        orderable=False,
+        accessor="software_version",
         default="unknown"
     )
     hypervisor = Column(
-        accessor="info.default_hypervisor",
-        orderable=False,
+        accessor="default_hypervisor",
         default="unknown"
     )
     master_node = LinkColumn(
         "node-detail",
         kwargs={"cluster_slug": A("slug"),
-                "host": A("info.master")},
-        accessor="info.master",
-        orderable=False,
+                "host": A("master")},
+        accessor="master",
         default="unknown"
     )
-    nodes = Column(accessor="nodes.count", orderable=False)
-    vms = Column(accessor="virtual_machines.count", verbose_name='VMs',
-                 orderable=False)
+    nodes = Column(accessor="node_count")
+    vms = Column(accessor="vm_count", verbose_name='VMs')
 
     class Meta:
         empty_text = "No Clusters"
@@ -163,6 +169,10 @@ class ClusterTable(BaseTable):
 
 
 class JobTable(BaseTable):
+    """
+    Table of jobs, paginated by keyset.
+    """
+
     job_id = LinkColumn(
         'job-detail',
         args=[A("cluster.slug"), A("job_id")]
@@ -185,7 +195,11 @@ class JobTable(BaseTable):
 
     class Meta:
         empty_text = "No jobs"
-        order_by = ("job_id")
+        order_by = ("-finished")
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("template", "table_keyset.html")
+        super(JobTable, self).__init__(*args, **kwargs)
 
     def render_operation(self, value):
         return format_job_op(value)
@@ -68,11 +68,17 @@ class TestGanetivizViews(TestCase):
     def test_cluster_json_ouput(self):
         testcluster0_data = {
             'nodes': [{'hostname': 'node0.example.test',
+                       'ram_allocated': 0,
+                       'disk_allocated': 0,
+                       'cpus_allocated': 0,
                        'offline': False,
                        'ram_free': -1,
                        'ram_total': -1,
                        'role': u''},
                       {'hostname': 'node1.example.test',
+                       'ram_allocated': 0,
+                       'disk_allocated': 0,
+                       'cpus_allocated': 0,
                        'offline': False,
                        'ram_free': -1,
                        'ram_total': -1,
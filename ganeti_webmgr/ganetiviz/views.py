@@ -3,6 +3,7 @@ from django.views.generic import DetailView, TemplateView
 
 from ganeti_webmgr.clusters.models import Cluster
 from ganeti_webmgr.ganeti_web.views.generic import LoginRequiredMixin
+from ganeti_webmgr.nodes.models import NO_RESOURCES, allocated_resources
 import simplejson as json
 from ganeti_webmgr.utils import get_rapi
 
@@ -24,9 +25,17 @@ class ClusterJsonView(LoginRequiredMixin, DetailView):
         # Imp. to convert to lists for making it JSON Serializable
         vms = list(vms.values('hostname', 'primary_node__hostname',
                               'secondary_node__hostname', 'status', 'owner',))
-        nodes = list(nodes.values('hostname', 'ram_total', 'ram_free',
+        nodes = list(nodes.values('id', 'hostname', 'ram_total', 'ram_free',
                                   'offline', 'role'))
 
+        # resources allocated on every node, from a few grouped queries
+        allocated = allocated_resources(cluster.id)
+        for node in nodes:
+            resources = allocated.get(node.pop('id'), NO_RESOURCES)
+            node['ram_allocated'] = resources['ram']
+            node['disk_allocated'] = resources['disk']
+            node['cpus_allocated'] = resources['cpus']
+
         cluster_data = {'nodes': nodes, 'vms': vms}
         cluster_json = json.dumps(cluster_data)
 
@@ -1,5 +1,6 @@
 from datetime import datetime
 
+from django.conf import settings
 from django.db import models
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.generic import GenericForeignKey
@@ -39,7 +40,7 @@ class Job(CachedClusterObject):
                                 editable=False)
     cluster_hash = models.CharField(max_length=40, editable=False)
 
-    finished = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True, db_index=True)
     status = models.CharField(max_length=10)
     op = models.CharField(max_length=50)
 
@@ -71,6 +72,18 @@ class Job(CachedClusterObject):
         """
         Load info for class.  This will load from ganeti if ignore_cache==True,
         otherwise this will always load from the cache.
+
+        When ``BACKGROUND_CACHE_REFRESH`` is set this always loads from the
+        cache; pending jobs are polled by the refresh daemon.
+        """
+        if settings.BACKGROUND_CACHE_REFRESH:
+            return
+        self.poll()
+
+    def poll(self):
+        """
+        Refresh this job from ganeti if it is still pending, or if nothing is
+        known about it yet.
         """
         if self.id and (self.ignore_cache or self.info is None):
             try:
@@ -162,3 +175,27 @@ class Job(CachedClusterObject):
                                              self.status)
 
     __unicode__ = __repr__
+
+
+class JobArchive(models.Model):
+    """
+    A finished job moved out of the Job table by the ``prunehistory``
+    management command.  Only the fields shown in job histories are kept;
+    the info cached from ganeti is dropped.
+    """
+
+    job_id = models.IntegerField()
+    content_type = models.ForeignKey(ContentType, related_name="+")
+    object_id = models.IntegerField()
+    cluster = models.ForeignKey('clusters.Cluster',
+                                related_name='archived_jobs', editable=False)
+    finished = models.DateTimeField(null=True, blank=True)
+    status = models.CharField(max_length=10)
+    op = models.CharField(max_length=50)
+    archived = models.DateTimeField(auto_now_add=True)
+
+    def __repr__(self):
+        return "<JobArchive %d (%d), status %r>" % (self.id, self.job_id,
+                                                    self.status)
+
+    __unicode__ = __repr__
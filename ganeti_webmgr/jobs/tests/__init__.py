@@ -1,2 +1,4 @@
 from .models import *
+from .tracker import *
 from .views import *
+from .watch import *
@@ -0,0 +1,180 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+from django.test import TestCase
+
+from ganeti_webmgr.ganeti_web import caps
+from ganeti_webmgr.utils.client import GanetiApiError
+from ganeti_webmgr.utils.proxy.constants import JOB, JOB_RUNNING
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
+from ganeti_webmgr.virtualmachines.tests.views.base import (
+    VirtualMachineTestCaseMixin)
+
+from ..models import Job
+from ..tracker import JOB_FIELDS, JobTracker
+
+__all__ = (
+    "TestJobTracker",
+)
+
+
+def job_row(info):
+    """
+    A row of a job query result for info.
+    """
+    return [[0, info.get(field)] for field in JOB_FIELDS]
+
+
+class TestJobTracker(VirtualMachineTestCaseMixin, TestCase):
+
+    def setUp(self):
+        self.vm, self.cluster = self.create_virtual_machine()
+        self.vm2, cluster = self.create_virtual_machine(
+            self.cluster, 'vm2.example.bak')
+        self.vm3, cluster = self.create_virtual_machine(
+            self.cluster, 'vm3.example.bak')
+        self.jobs = []
+        for job_id, vm in enumerate((self.vm, self.vm2, self.vm3)):
+            job = Job.objects.create(job_id=job_id + 1, obj=vm,
+                                     cluster=self.cluster)
+            VirtualMachine.objects.filter(pk=vm.pk) \
+                .update(last_job=job, ignore_cache=True)
+            self.jobs.append(job)
+
+        self.rapi = self.cluster.rapi
+        self.rapi.GetJobStatus.reset()
+
+    def tearDown(self):
+        self.rapi.GetJobStatus.response = JOB_RUNNING
+        self.rapi.GetJobStatus.error = False
+        self.rapi.GetJobs.response = None
+        self.rapi.Query.response = None
+
+    def job(self, i):
+        return Job.objects.filter(pk=self.jobs[i].pk) \
+            .values("status", "ignore_cache", "finished")[0]
+
+    def vm_values(self, vm):
+        return VirtualMachine.objects.filter(pk=vm.pk) \
+            .values("last_job", "ignore_cache", "cached")[0]
+
+    def test_poll_query(self):
+        """
+        Newer clusters resolve every pending job with a single query.
+
+        Verifies:
+            * one Query call is made and no per job calls
+            * completed jobs are stored and dispatched to their VMs
+            * archived jobs are marked unknown
+            * running jobs stay pending
+        """
+        self.rapi.Query.reset()
+        self.rapi.Query.response = {
+            "fields": [{"name": field} for field in JOB_FIELDS],
+            "data": [
+                job_row(dict(JOB, id=1)),
+                [[2, None]] * len(JOB_FIELDS),
+                job_row(dict(JOB_RUNNING, id=3)),
+            ],
+        }
+
+        JobTracker(self.cluster.id, self.rapi, caps.GANETI26).poll()
+
+        self.assertEqual(1, len(self.rapi.Query.calls))
+        args, kwargs = self.rapi.Query.calls[0]
+        self.assertEqual("job", args[0])
+        self.assertEqual(["|", ["=", "id", 1], ["=", "id", 2],
+                          ["=", "id", 3]], args[2])
+        self.rapi.GetJobStatus.assertNotCalled(self)
+
+        job = self.job(0)
+        self.assertEqual("success", job["status"])
+        self.assertFalse(job["ignore_cache"])
+        self.assertTrue(job["finished"])
+        vm = self.vm_values(self.vm)
+        self.assertEqual(None, vm["last_job"])
+        self.assertFalse(vm["ignore_cache"])
+        self.assertEqual(None, vm["cached"])
+
+        self.assertEqual("unknown", self.job(1)["status"])
+        self.assertEqual(None, self.vm_values(self.vm2)["last_job"])
+
+        self.assertTrue(self.job(2)["ignore_cache"])
+        self.assertEqual(self.jobs[2].pk, self.vm_values(self.vm3)["last_job"])
+
+    def test_poll_bulk_jobs(self):
+        """
+        Ganeti 2.5 lists all of its jobs with one bulk call.
+
+        Verifies:
+            * completed jobs drop the cluster's cached responses
+        """
+        self.rapi.GetJobs.reset()
+        self.rapi.GetJobs.response = [dict(JOB, id=i) for i in (1, 2, 3)]
+        generation = self.rapi.response_cache.generation()
+
+        JobTracker(self.cluster.id, self.rapi, caps.GANETI25).poll()
+
+        self.assertNotEqual(generation, self.rapi.response_cache.generation())
+        self.assertEqual([((), {"bulk": True})], self.rapi.GetJobs.calls)
+        self.rapi.GetJobStatus.assertNotCalled(self)
+        for i in range(3):
+            self.assertEqual("success", self.job(i)["status"])
+
+    def test_poll_ancient(self):
+        """
+        Older clusters fall back to requesting each job, still resolving
+        the jobs of every VM in one pass.
+        """
+        self.rapi.GetJobStatus.response = JOB
+
+        JobTracker(self.cluster.id, self.rapi).poll()
+
+        self.assertEqual(3, len(self.rapi.GetJobStatus.calls))
+        for i, vm in enumerate((self.vm, self.vm2, self.vm3)):
+            self.assertFalse(self.job(i)["ignore_cache"])
+            self.assertEqual(None, self.vm_values(vm)["last_job"])
+
+        # nothing is pending anymore
+        self.rapi.GetJobStatus.reset()
+        JobTracker(self.cluster.id, self.rapi).poll()
+        self.rapi.GetJobStatus.assertNotCalled(self)
+
+    def test_poll_error(self):
+        """
+        Jobs stay pending while the cluster can't be reached.
+        """
+        self.rapi.GetJobStatus.error = GanetiApiError("unreachable", 500)
+
+        JobTracker(self.cluster.id, self.rapi).poll()
+
+        for i in range(3):
+            self.assertTrue(self.job(i)["ignore_cache"])
+        self.assertTrue(self.vm_values(self.vm)["last_job"])
+
+    def test_check_job_status(self):
+        """
+        Refreshing one VM completes the finished jobs of the other VMs too.
+        """
+        self.rapi.GetJobStatus.response = JOB
+
+        vm = VirtualMachine.objects.get(pk=self.vm.pk)
+        self.assertFalse(vm.last_job_id)
+        self.assertFalse(vm.ignore_cache)
+        self.assertEqual(3, len(self.rapi.GetJobStatus.calls))
+        self.assertEqual(None, self.vm_values(self.vm2)["last_job"])
+        self.assertEqual(None, self.vm_values(self.vm3)["last_job"])
@@ -16,6 +16,7 @@
 # USA.
 
 from django.test import TestCase
+from django.utils import simplejson as json
 from django.test.client import Client
 
 from ganeti_webmgr.django_test_tools.views import ViewTestMixin
@@ -23,6 +24,7 @@ from ganeti_webmgr.django_test_tools.users import UserTestMixin
 
 from ganeti_webmgr.utils.proxy.constants import JOB_ERROR
 
+from .. import watch
 from ..models import Job
 from .models import TestJobMixin
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
@@ -206,3 +208,24 @@ class TestJobViews(TestJobMixin, TestCase, UserTestMixin, ViewTestMixin):
         self.assert_standard_fails(url, args, authorized=False)
         self.assert_200(url, args, users=[self.superuser, self.cluster_admin],
                         template='ganeti/job/detail.html')
+
+    def test_wait(self):
+        """
+        tests long-polling the progress of a job
+        """
+        job = Job.objects.create(cluster=self.cluster, obj=self.vm, job_id=1)
+
+        url = '/cluster/%s/job/%s/wait/'
+        args = (self.cluster.slug, job.job_id)
+
+        self.assert_standard_fails(url, args, authorized=False)
+
+        def tests(user, response):
+            data = json.loads(response.content)
+            self.assertEqual('success', data['status'])
+            self.assertEqual(1, data['log_serial'])
+            self.assertEqual(['shutting down'],
+                             [entry[3] for entry in data['log']])
+        self.assert_200(url, args, users=[self.user], tests=tests,
+                        mime='application/json')
+        watch.WATCHES.clear()
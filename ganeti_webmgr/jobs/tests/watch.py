@@ -0,0 +1,154 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+import threading
+import time
+from Queue import Queue
+
+from django.test import SimpleTestCase
+
+from ganeti_webmgr.utils.client import GanetiApiError
+
+from .. import watch
+
+__all__ = (
+    "TestJobWatch",
+)
+
+
+def change(status, *serials):
+    return {
+        "job_info": [1, status, [], [status], [None], None],
+        "log_entries": [[serial, [0, 0], "message", "entry %d" % serial]
+                        for serial in serials],
+    }
+
+
+class ScriptedRapi(object):
+    """
+    Answers WaitForJobChange with the changes queued by a test, blocking
+    until one is available like ganeti does.
+    """
+
+    def __init__(self):
+        self.changes = Queue()
+        self.calls = []
+
+    def WaitForJobChange(self, job_id, fields, prev_job_info, prev_log_serial,
+                         timeout=None):
+        self.calls.append((prev_job_info, prev_log_serial))
+        result = self.changes.get(timeout=5)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class TestJobWatch(SimpleTestCase):
+
+    def setUp(self):
+        self.rapi = ScriptedRapi()
+
+    def tearDown(self):
+        # let any watch that is still running finish
+        self.rapi.changes.put(change("success"))
+        watch.WATCHES.clear()
+
+    def test_shared(self):
+        """
+        Every request watching a job waits on the same WaitForJobChange.
+        """
+        job = watch.watch_job(1, self.rapi, 1)
+        self.assertTrue(job is watch.watch_job(1, self.rapi, 1))
+
+        results = []
+
+        def wait():
+            results.append(watch.watch_job(1, self.rapi, 1).wait(timeout=5))
+
+        threads = [threading.Thread(target=wait) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        self.rapi.changes.put(change("running", 1))
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(3, len(results))
+        for data in results:
+            self.assertEqual("running", data["status"])
+            self.assertEqual(1, data["log_serial"])
+        self.assertEqual([(None, None)], self.rapi.calls[:1])
+
+    def test_log_deltas(self):
+        """
+        Only log entries newer than the caller's serial are returned, and
+        the watch resumes from the last serial it received.
+        """
+        job = watch.watch_job(1, self.rapi, 1)
+        self.rapi.changes.put(change("running", 1, 2))
+        data = job.wait(timeout=5)
+        self.assertEqual([1, 2], [entry[0] for entry in data["log"]])
+
+        self.rapi.changes.put(change("running", 3))
+        data = job.wait(2, "running", timeout=5)
+        self.assertEqual([3], [entry[0] for entry in data["log"]])
+        self.assertEqual(3, data["log_serial"])
+        self.assertEqual(2, self.rapi.calls[1][1])
+
+    def test_unchanged(self):
+        """
+        A request returns when its timeout passes without a change.
+        """
+        job = watch.watch_job(1, self.rapi, 1)
+        self.rapi.changes.put(change("running", 1))
+        job.wait(timeout=5)
+
+        start = time.time()
+        data = job.wait(1, "running", timeout=0.2)
+        self.assertTrue(time.time() - start >= 0.2)
+        self.assertEqual([], data["log"])
+
+    def test_seen(self):
+        """
+        A request which returns at once keeps the watch alive too.
+        """
+        job = watch.watch_job(1, self.rapi, 1)
+        self.rapi.changes.put(change("running", 1))
+        job.wait(timeout=5)
+
+        job.last_seen = 0
+        job.wait(timeout=5)
+        self.assertTrue(job.last_seen > 0)
+
+    def test_finished(self):
+        """
+        The watch stops once the job has finished.
+        """
+        job = watch.watch_job(1, self.rapi, 1)
+        self.rapi.changes.put(change("success", 1))
+        data = job.wait(timeout=5)
+        self.assertEqual("success", data["status"])
+
+        job.wait(1, "success", timeout=5)
+        self.assertTrue(job.stopped)
+        self.assertFalse(watch.WATCHES)
+
+    def test_error(self):
+        job = watch.watch_job(1, self.rapi, 1)
+        self.rapi.changes.put(GanetiApiError("404", code=404))
+        data = job.wait(timeout=5)
+        self.assertEqual("404", data["error"])
+        self.assertFalse(watch.WATCHES)
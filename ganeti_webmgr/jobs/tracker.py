@@ -0,0 +1,257 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Batched polling of pending jobs.
+
+Asking ganeti about jobs one at a time costs a RAPI call per job, and an
+object with a long queue of jobs would check every one of them each time it
+is refreshed.  A JobTracker instead collects all pending jobs of a cluster,
+resolves them with a single request, and hands the jobs which completed to
+the objects which own them.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Q
+
+from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.ganeti_web import caps
+from ganeti_webmgr.jobs.models import Job
+from ganeti_webmgr.utils import query_rows, serialization
+from ganeti_webmgr.utils.client import GanetiApiError
+
+
+# Statuses after which a job is no longer polled and is passed on to its
+# owner.
+COMPLETE = ('success', 'error', 'unknown')
+
+# Fields requested from the query resource.  These are the keys of the dicts
+# returned by GetJobStatus.
+JOB_FIELDS = ["id", "status", "ops", "opstatus", "opresult", "oplog",
+              "summary", "received_ts", "start_ts", "end_ts"]
+
+
+def fetch_jobs(rapi, job_ids, version=caps.ANCIENT):
+    """
+    Retrieve the info of several jobs of a cluster.
+
+    Clusters running Ganeti 2.6 or newer are asked for exactly these jobs
+    with the query resource, and Ganeti 2.5 lists all of its jobs with a
+    single bulk request.  Older clusters only know GetJobStatus, so each job
+    is requested on its own.
+
+    @param rapi - RAPI client of the cluster
+    @param job_ids - ganeti ids of the jobs
+    @param version - class of the cluster, as returned by caps.classify()
+    @returns dict of job id to info, or to None for jobs which ganeti no
+    longer knows about.  Jobs which could not be requested individually are
+    left out.
+    @raises GanetiApiError if a batched request fails
+    """
+    job_ids = sorted(set(int(job_id) for job_id in job_ids))
+    if not job_ids:
+        return {}
+
+    if version < caps.GANETI25:
+        found = {}
+        for job_id in job_ids:
+            try:
+                found[job_id] = rapi.GetJobStatus(job_id)
+            except GanetiApiError as e:
+                if e.code == 404:
+                    # the job has been archived
+                    found[job_id] = None
+        return found
+
+    if version >= caps.GANETI26:
+        qfilter = ["|"] + [["=", "id", job_id] for job_id in job_ids]
+        # jobs which were archived come back without a status
+        jobs = [info for info in query_rows(rapi, "job", JOB_FIELDS, qfilter)
+                if info["status"] is not None]
+    else:
+        jobs = rapi.GetJobs(bulk=True)
+
+    found = dict((int(info["id"]), info) for info in jobs)
+    return dict((job_id, found.get(job_id)) for job_id in job_ids)
+
+
+def cluster_version(cluster_id):
+    """
+    Classify a cluster from its cached info without instantiating it, which
+    could refresh it.
+    """
+    data = Cluster.objects.filter(pk=cluster_id) \
+        .values_list("serialized_info", flat=True)
+    info = serialization.loads(data[0]) if data and data[0] else None
+    if not info:
+        return caps.ANCIENT
+    return caps.classify_version(info["software_version"])
+
+
+class JobTracker(object):
+    """
+    Polls all pending jobs of a cluster together.
+
+    Jobs are handled as values() dicts rather than Job instances, because
+    instantiating a pending Job polls it from ganeti on its own.
+    """
+
+    def __init__(self, cluster_id, rapi, version=None):
+        self.cluster_id = cluster_id
+        self.rapi = rapi
+        self.version = version
+
+    def pending(self, include=()):
+        """
+        The jobs of the cluster which are still being polled.
+
+        @param include - primary keys of further jobs to poll regardless of
+        their state
+        """
+        return Job.objects.filter(cluster=self.cluster_id) \
+            .filter(Q(ignore_cache=True) | Q(pk__in=include)) \
+            .order_by("job_id") \
+            .values("id", "job_id", "content_type", "object_id", "status",
+                    "op", "ignore_cache")
+
+    def poll(self, include=(), exclude=None):
+        """
+        Resolve every pending job of the cluster with one request, store
+        their status, and complete the jobs which finished.
+
+        Completed jobs are dispatched to their owners through
+        ``_complete_job``, except for the jobs of ``exclude``; those are
+        returned so the object can complete them itself.
+
+        @param include - see pending()
+        @param exclude - an object which completes its own jobs
+        @returns list of completed jobs of ``exclude``, ordered by job id
+        """
+        jobs = list(self.pending(include))
+        if not jobs:
+            return []
+
+        if self.version is None:
+            self.version = cluster_version(self.cluster_id)
+
+        try:
+            infos = fetch_jobs(self.rapi, [job["job_id"] for job in jobs],
+                               self.version)
+        except GanetiApiError:
+            # the cluster is unreachable; the jobs stay pending and are
+            # polled again next time.
+            return []
+
+        now = datetime.now()
+        completed = []
+        for job in jobs:
+            if job["job_id"] not in infos:
+                continue
+            if self._record(job, infos[job["job_id"]], now):
+                completed.append(job)
+
+        response_cache = getattr(self.rapi, "response_cache", None)
+        if completed and response_cache is not None:
+            # responses cached while the jobs ran may predate their changes
+            response_cache.invalidate()
+
+        if exclude is not None:
+            ct = ContentType.objects.get_for_model(exclude)
+            own = [job for job in completed if job["content_type"] == ct.id
+                   and job["object_id"] == exclude.pk]
+            completed = [job for job in completed if job not in own]
+        else:
+            own = []
+
+        self.dispatch(completed)
+        return own
+
+    def _record(self, job, info, now):
+        """
+        Store the status of a job.
+
+        @returns True if the job completed.  The update only applies if the
+        row was not changed since it was read, so a job completed by another
+        process is not completed twice.
+        """
+        if info is None:
+            values = {"status": "unknown", "ignore_cache": False}
+        elif Job.valid_job(info):
+            values = Job.parse_persistent_info(info)
+            values.update(serialized_info=serialization.dumps(info),
+                          cached=now)
+        else:
+            return False
+
+        updated = Job.objects \
+            .filter(pk=job["id"], status=job["status"],
+                    ignore_cache=job["ignore_cache"]) \
+            .update(**values)
+        job.update(values)
+        return bool(updated) and job["status"] in COMPLETE
+
+    def dispatch(self, completed):
+        """
+        Complete finished jobs for their owners.
+
+        Owners are loaded with one query per model.  Owners whose last job
+        completed have their cache flags reset and ``cached`` cleared so they
+        are refreshed with the outcome of the job the next time they are
+        loaded.
+        """
+        by_type = defaultdict(list)
+        for job in completed:
+            by_type[job["content_type"]].append(job)
+
+        for ct_id, jobs in by_type.items():
+            model = ContentType.objects.get_for_id(ct_id).model_class()
+            ids = set(job["object_id"] for job in jobs)
+            owners = dict((pk, (hostname, last_job)) for pk, hostname, last_job
+                          in model.objects.filter(pk__in=ids)
+                          .values_list("pk", "hostname", "last_job"))
+
+            for pk, (hostname, last_job) in owners.items():
+                own = [job for job in jobs if job["object_id"] == pk]
+                self._complete(model, pk, hostname, last_job, own)
+
+    def _complete(self, model, pk, hostname, last_job, jobs):
+        updates = {}
+        deleted = None
+        for job in jobs:
+            _updates = model._complete_job(self.cluster_id, hostname,
+                                           job["op"], job["status"])
+            if _updates:
+                if "deleted" in _updates:
+                    deleted = job
+                else:
+                    updates.update(_updates)
+
+        if last_job is None or last_job in [job["id"] for job in jobs]:
+            updates.update(ignore_cache=False, last_job=None, cached=None)
+
+        if deleted is not None:
+            # Clear the job from the owner first so the owner is not
+            # refreshed, and its jobs polled again, while it is deleted.
+            model.objects.filter(pk=pk) \
+                .update(ignore_cache=False, last_job=None)
+            model.objects.filter(pk=pk).delete()
+            Job.objects.filter(pk=deleted["id"]).delete()
+        elif updates:
+            model.objects.filter(pk=pk).update(**updates)
@@ -9,6 +9,8 @@ urlpatterns = patterns(
 
     url(r'^%s/status/?' % job, 'status', name='job-status'),
 
+    url(r'^%s/wait/?' % job, 'wait', name='job-wait'),
+
     url(r'^%s/clear/?' % job, 'clear', name='job-clear'),
 
     url(r'^%s/?' % job, JobDetailView.as_view(), name='job-detail'),
@@ -17,16 +17,18 @@
 
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404
 from django.shortcuts import get_object_or_404
 from django.utils import simplejson as json
 from django.views.generic.detail import DetailView
 
 from .models import Job
+from .watch import watch_job
 from ganeti_webmgr.clusters.models import Cluster
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 from ganeti_webmgr.nodes.models import Node
 from ganeti_webmgr.ganeti_web.views.generic import NO_PRIVS, LoginRequiredMixin
+from ganeti_webmgr.utils import get_rapi
 
 
 class JobDetailView(LoginRequiredMixin, DetailView):
@@ -60,6 +62,33 @@ def status(request, cluster_slug, job_id, rest=False):
         return HttpResponse(json.dumps(job.info), mimetype='application/json')
 
 
+@login_required
+def wait(request, cluster_slug, job_id):
+    """
+    Long-poll the progress of a job.
+
+    The request is held until the job's status or log changes, or for
+    ``JOB_WAIT_TIMEOUT`` seconds.  Pass the ``status`` and ``log_serial``
+    from the previous response to receive only what changed since.
+    """
+    values = Job.objects.filter(cluster__slug=cluster_slug, job_id=job_id) \
+        .values_list('cluster_id', 'cluster_hash')
+    if not values:
+        raise Http404
+    cluster_id, cluster_hash = values[0]
+
+    try:
+        log_serial = int(request.GET['log_serial'])
+    except (KeyError, ValueError):
+        log_serial = None
+    status = request.GET.get('status')
+
+    watch = watch_job(cluster_id, get_rapi(cluster_hash, cluster_id),
+                      int(job_id))
+    data = watch.wait(log_serial, status)
+    return HttpResponse(json.dumps(data), mimetype='application/json')
+
+
 @login_required
 def clear(request, cluster_slug, job_id):
     """
@@ -0,0 +1,167 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Shared long-polling of job progress.
+
+Each watched job has a single thread blocked in ``WaitForJobChange``.  Every
+request watching the job waits on that thread instead of asking ganeti
+itself, so the RAPI traffic for a job does not grow with the number of open
+browsers.  Requests pass the last log serial they have seen and only receive
+the log entries after it.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+
+from ganeti_webmgr.utils.client import GanetiApiError
+
+
+# Job fields followed by WaitForJobChange.  These are enough to render a job
+# with static/js/job_status.js.
+WAIT_FIELDS = ["id", "status", "ops", "opstatus", "opresult", "end_ts"]
+
+# Statuses after which a job no longer changes.
+FINAL = ("success", "error", "canceled")
+
+# Ganeti holds a WaitForJobChange request for up to ten seconds.
+WAIT_READ_TIMEOUT = 15
+
+# A watch stops waiting on ganeti once nobody has asked for the job for this
+# many seconds.
+WATCH_IDLE = 30
+
+WATCHES = {}
+WATCHES_LOCK = threading.Lock()
+
+
+class JobWatch(object):
+    """
+    Follows one job with WaitForJobChange on behalf of any number of
+    requests.
+    """
+
+    def __init__(self, key, rapi, job_id):
+        self.key = key
+        self.rapi = rapi
+        self.job_id = job_id
+        self.condition = threading.Condition()
+        self.job_info = None
+        self.info = None
+        self.log = []
+        self.log_serial = None
+        self.error = None
+        self.stopped = False
+        self.last_seen = time.time()
+
+    def start(self):
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        timeout = (settings.RAPI_CONNECT_TIMEOUT, WAIT_READ_TIMEOUT)
+        try:
+            while time.time() - self.last_seen < WATCH_IDLE:
+                result = self.rapi.WaitForJobChange(
+                    self.job_id, WAIT_FIELDS, self.job_info, self.log_serial,
+                    timeout=timeout)
+                if result:
+                    self.update(result)
+                if self.info and self.info["status"] in FINAL:
+                    break
+        except GanetiApiError as e:
+            with self.condition:
+                self.error = str(e)
+        finally:
+            with WATCHES_LOCK:
+                if WATCHES.get(self.key) is self:
+                    del WATCHES[self.key]
+            with self.condition:
+                self.stopped = True
+                self.condition.notify_all()
+
+    def update(self, result):
+        """
+        Record a change returned by WaitForJobChange and wake up waiting
+        requests.
+        """
+        with self.condition:
+            self.job_info = result["job_info"]
+            self.info = dict(zip(WAIT_FIELDS, self.job_info))
+            entries = result["log_entries"] or []
+            self.log.extend(entries)
+            if entries:
+                self.log_serial = max(entry[0] for entry in entries)
+            self.condition.notify_all()
+
+    def changed(self, log_serial, status):
+        if self.info is None:
+            return False
+        return self.info["status"] != status or (
+            self.log_serial is not None
+            and (log_serial is None or self.log_serial > log_serial))
+
+    def wait(self, log_serial=None, status=None, timeout=None):
+        """
+        Wait until the job differs from what the caller has seen.
+
+        @param log_serial - serial of the last log entry the caller has
+        @param status - status of the job as the caller knows it
+        @param timeout - seconds to wait at most; defaults to JOB_WAIT_TIMEOUT
+        @returns dict of the job's WAIT_FIELDS plus "log", the log entries
+        after ``log_serial``, "log_serial" and "error"
+        """
+        if timeout is None:
+            timeout = settings.JOB_WAIT_TIMEOUT
+        deadline = time.time() + timeout
+
+        with self.condition:
+            # also when returning at once, so a request polling a busy job
+            # keeps its watch alive
+            self.last_seen = time.time()
+            while not (self.stopped or self.changed(log_serial, status)):
+                self.last_seen = time.time()
+                remaining = deadline - self.last_seen
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            data = dict(self.info or {})
+            data.update(
+                id=self.job_id,
+                log=[entry for entry in self.log
+                     if log_serial is None or entry[0] > log_serial],
+                log_serial=self.log_serial,
+                error=self.error,
+            )
+            return data
+
+
+def watch_job(cluster_id, rapi, job_id):
+    """
+    Returns the watch of a job, starting one if nobody is watching it yet.
+    """
+    key = (cluster_id, job_id)
+    with WATCHES_LOCK:
+        watch = WATCHES.get(key)
+        if watch is None:
+            watch = WATCHES[key] = JobWatch(key, rapi, job_id)
+            watch.start()
+    return watch
@@ -10,6 +10,56 @@ from ganeti_webmgr.utils import get_rapi
 from ganeti_webmgr.utils.fields import LowerCaseCharField
 
 
+def capacity(total, free, allocated):
+    """
+    Build the dict of Node.ram and Node.disk.
+    """
+    return {
+        'total': total,
+        'free': total - allocated if allocated >= 0 and total >= 0 else -1,
+        'allocated': allocated,
+        'used': total - free,
+    }
+
+
+NO_RESOURCES = {'ram': 0, 'disk': 0, 'cpus': 0}
+
+
+def allocated_resources(cluster_id):
+    """
+    Compute the RAM, disk, and CPUs allocated to the VMs of every node of a
+    cluster with a few grouped queries, rather than the aggregates of
+    Node.ram, Node.disk and Node.allocated_cpus for each node.
+
+    Like those, RAM counts running VMs on both their primary and secondary
+    node, disk counts all VMs on both, and CPUs count running VMs on their
+    primary node only.
+
+    @returns dict of node id to dict of ``ram``, ``disk`` and ``cpus``.
+    Nodes without VMs are missing; use ``NO_RESOURCES`` for them.
+    """
+    vms = VirtualMachine.objects.filter(cluster=cluster_id).order_by()
+    running = vms.filter(status='running')
+    sums = (
+        ('ram', 'primary_node', running.exclude(ram=-1), 'ram'),
+        ('ram', 'secondary_node', running.exclude(ram=-1), 'ram'),
+        ('disk', 'primary_node', vms.exclude(disk_size=-1), 'disk_size'),
+        ('disk', 'secondary_node', vms.exclude(disk_size=-1), 'disk_size'),
+        ('cpus', 'primary_node', running.exclude(virtual_cpus=-1),
+         'virtual_cpus'),
+    )
+
+    allocated = {}
+    for name, node_field, qs, field in sums:
+        values = qs.exclude(**{node_field: None}).values(node_field) \
+            .annotate(total=Sum(field))
+        for row in values:
+            resources = allocated.setdefault(row[node_field],
+                                             dict(NO_RESOURCES))
+            resources[name] += row['total'] or 0
+    return allocated
+
+
 class Node(CachedClusterObject):
     """
     The Node model represents nodes within a Ganeti cluster.
@@ -35,6 +85,11 @@ class Node(CachedClusterObject):
     disk_free = models.IntegerField(default=-1)
     cpus = models.IntegerField(null=True, blank=True)
 
+    # resources allocated to the node's VMs, as computed by
+    # allocated_resources(), replace the aggregates of ram, disk and
+    # allocated_cpus when set
+    allocated = None
+
     # The last job reference indicates that there is at least one pending job
     # for this virtual machine.  There may be more than one job, and that can
     # never be prevented.  This just indicates that job(s) are pending and the
@@ -91,46 +146,34 @@ class Node(CachedClusterObject):
     @property
     def ram(self):
         """ returns dict of free and total ram """
-        values = (VirtualMachine.objects
-                  .filter(Q(primary_node=self) | Q(secondary_node=self))
-                  .filter(status='running')
-                  .exclude(ram=-1).order_by()
-                  .aggregate(used=Sum('ram')))
-
-        total = self.ram_total
-        used = total - self.ram_free
-        allocated = values.get("used") or 0
-        free = total - allocated if allocated >= 0 and total >= 0 else -1
-
-        return {
-            'total': total,
-            'free':  free,
-            'allocated': allocated,
-            'used': used,
-        }
+        if self.allocated is not None:
+            allocated = self.allocated['ram']
+        else:
+            values = (VirtualMachine.objects
+                      .filter(Q(primary_node=self) | Q(secondary_node=self))
+                      .filter(status='running')
+                      .exclude(ram=-1).order_by()
+                      .aggregate(used=Sum('ram')))
+            allocated = values.get("used") or 0
+        return capacity(self.ram_total, self.ram_free, allocated)
 
     @property
     def disk(self):
         """ returns dict of free and total disk space """
-        values = VirtualMachine.objects \
-            .filter(Q(primary_node=self) | Q(secondary_node=self)) \
-            .exclude(disk_size=-1).order_by() \
-            .aggregate(used=Sum('disk_size'))
-
-        total = self.disk_total
-        used = total - self.disk_free
-        allocated = values.get("used") or 0
-        free = total - allocated if allocated >= 0 and total >= 0 else -1
-
-        return {
-            'total': total,
-            'free':  free,
-            'allocated': allocated,
-            'used': used,
-        }
+        if self.allocated is not None:
+            allocated = self.allocated['disk']
+        else:
+            values = VirtualMachine.objects \
+                .filter(Q(primary_node=self) | Q(secondary_node=self)) \
+                .exclude(disk_size=-1).order_by() \
+                .aggregate(used=Sum('disk_size'))
+            allocated = values.get("used") or 0
+        return capacity(self.disk_total, self.disk_free, allocated)
 
     @property
     def allocated_cpus(self):
+        if self.allocated is not None:
+            return self.allocated['cpus']
         values = VirtualMachine.objects \
             .filter(primary_node=self, status='running') \
             .exclude(virtual_cpus=-1).order_by() \
@@ -23,7 +23,7 @@ from ganeti_webmgr.utils.proxy.constants import NODE
 
 from ganeti_webmgr.virtualmachines.models import VirtualMachine
 from ganeti_webmgr.clusters.models import Cluster
-from ganeti_webmgr.nodes.models import Node
+from ganeti_webmgr.nodes.models import Node, allocated_resources
 
 
 __all__ = ['TestNodeModel']
@@ -275,3 +275,46 @@ class TestNodeModel(TestCase, NodeTestCaseMixin):
         node.delete()
         node2.delete()
         c.delete()
+
+    def test_allocated_resources(self):
+        """
+        tests that allocated_resources() agrees with Node.ram, Node.disk and
+        Node.allocated_cpus for every node of a cluster
+        """
+        node, c = self.create_node()
+        node2, c = self.create_node(cluster=c, hostname='two')
+        node3, c = self.create_node(cluster=c, hostname='three')
+        node.refresh()
+        node2.refresh()
+
+        VirtualMachine.objects.create(cluster=c, primary_node=node,
+                                      secondary_node=node2, hostname='foo',
+                                      ram=123, disk_size=10, virtual_cpus=2,
+                                      status='running')
+        VirtualMachine.objects.create(cluster=c, primary_node=node2,
+                                      secondary_node=node, hostname='bar',
+                                      ram=456, disk_size=20, virtual_cpus=4,
+                                      status='running')
+        VirtualMachine.objects.create(cluster=c, primary_node=node,
+                                      hostname='xoo', ram=789, disk_size=30,
+                                      virtual_cpus=8, status='admin_down')
+        VirtualMachine.objects.create(cluster=c, primary_node=node,
+                                      hostname='boo', ram=234,
+                                      status='running')
+        VirtualMachine.objects.create(cluster=c, hostname='gar', ram=888,
+                                      status='running')
+
+        with self.assertNumQueries(5):
+            allocated = allocated_resources(c.id)
+
+        self.assertFalse(node3.pk in allocated)
+        for n in (node, node2):
+            expected = (n.ram, n.disk, n.allocated_cpus)
+            n.allocated = allocated[n.pk]
+            self.assertEqual(expected, (n.ram, n.disk, n.allocated_cpus))
+        self.assertEqual({'ram': 813, 'disk': 60, 'cpus': 2},
+                         allocated[node.pk])
+
+        VirtualMachine.objects.all().delete()
+        Node.objects.all().delete()
+        c.delete()
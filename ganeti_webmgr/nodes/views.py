@@ -294,7 +294,8 @@ def job_status(request, id, rest=False):
     jobs = Job.objects.filter(status__in=("error", "running", "waiting"),
                               content_type=ct,
                               object_id=id).order_by('job_id')
-    jobs = [j.info for j in jobs]
+    # jobs the refresh daemon has not polled yet have no info
+    jobs = [j.info for j in jobs if j.info is not None]
 
     if rest:
         return jobs
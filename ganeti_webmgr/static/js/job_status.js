@@ -36,6 +36,9 @@ function JobPoller() {
     this.SLOW = 60000;
     var get_xhr = undefined;
     var poller;
+    var watching = {};
+    var watch_count = 0;
+    var FINAL = ['success', 'error', 'canceled'];
 
 
     this.init = function (url, new_cluster, new_callback, new_errback) {
@@ -104,7 +107,8 @@ function JobPoller() {
             }
         });
 
-        if (data.length==0) {
+        // jobs that are being watched report their own progress
+        if (data.length==0 || watch_count > 0) {
             poller.poll(poller.SLOW);
         } else {
             poller.poll(poller.FAST);
@@ -112,6 +116,73 @@ function JobPoller() {
     }
 
 
+    // follow a job with long-polling requests.  The server holds each
+    // request until the job changes and only sends log entries that are new
+    // since log_serial.
+    this.watch = function (job_id, status, log_serial) {
+        if (watching[job_id] && log_serial == undefined) {
+            return;
+        }
+        // the log up to now was already rendered from the job's info
+        var first = !watching[job_id];
+        if (first) {
+            watching[job_id] = true;
+            watch_count++;
+        }
+
+        function stop() {
+            delete watching[job_id];
+            watch_count--;
+        }
+
+        $.ajax({
+            url: cluster + "/job/" + job_id + "/wait/",
+            data: {status: status, log_serial: log_serial},
+            error: function() {
+                // fall back to polling the list of jobs
+                stop();
+                poller.poll(poller.FAST);
+            },
+            success: function(data) {
+                if (data.error) {
+                    stop();
+                    poller.poll(poller.FAST);
+                    return;
+                }
+                if (!first) {
+                    render_log(job_id, data.log);
+                }
+                if (data.status && FINAL.indexOf(data.status) != -1) {
+                    // refresh the job list to render the outcome
+                    stop();
+                    poller.get_jobs();
+                } else {
+                    poller.watch(job_id, data.status,
+                                 data.log_serial == null ? "" : data.log_serial);
+                }
+            }
+        });
+    };
+
+
+    // append log entries received while watching a job
+    function render_log(job_id, log) {
+        var html = $('#job_'+job_id);
+        if (html.length==0 || log.length==0) {
+            return;
+        }
+        var log_html = html.find('.op_log');
+        if (log_html.length==0) {
+            log_html = $("<pre class='op_log'><ul></ul></pre>");
+            html.children('.scrollable').append(log_html)
+                .css('display', 'block');
+        }
+        for (var i=0; i<log.length; i++) {
+            log_html.children("ul").append("<li>"+log[i][3]+"</li>");
+        }
+    }
+
+
     function active_op(data) {
         /* Find a sub-operation which has not successfully completed. */
         for (var sub_op = 0; sub_op < data['opstatus'].length; sub_op++) {
@@ -142,6 +213,10 @@ function JobPoller() {
         var error = undefined;
         var scrollable = html.children('.scrollable');
 
+        if (FINAL.indexOf(status) == -1) {
+            poller.watch(job_id, status);
+        }
+
         if (status=='running' || status=='error') {
             html.addClass(status);
 
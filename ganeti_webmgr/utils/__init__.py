@@ -4,7 +4,12 @@ from collections import defaultdict
 
 from django.conf import settings
 
+from .circuit_breaker import CircuitBreaker
 from .client import GanetiRapiClient, GanetiApiError
+from .client_registry import ClientRegistry
+from .rapi_cache import ResponseCache
+from .rate_limit import RequestLimiter
+from .single_flight import SingleFlight
 from .proxy import RapiProxy, XenRapiProxy
 
 from ganeti_webmgr.ganeti_web import constants
@@ -16,8 +21,7 @@ def generate_random_password(length=12):
     return "".join(random.sample(string.letters + string.digits, length))
 
 
-RAPI_CACHE = {}
-RAPI_CACHE_HASHES = {}
+RAPI_CLIENTS = ClientRegistry()
 
 
 def get_rapi_client():
@@ -58,8 +62,9 @@ def get_rapi(hash, cluster):
 
     rapi_client = get_rapi_client()
 
-    if hash in RAPI_CACHE:
-        return RAPI_CACHE[hash]
+    rapi = RAPI_CLIENTS.get(hash)
+    if rapi is not None:
+        return rapi
 
     # always look up the instance, even if we were given a Cluster instance
     # it ensures we are retrieving the latest credentials.  This helps avoid
@@ -76,30 +81,61 @@ def get_rapi(hash, cluster):
     password = Cluster.decrypt_password(password) if password else None
     password = None if password in ('None', '') else password
 
-    # now that we know hash is fresh, check cache again. The original hash
-    # could have been stale. This avoids constructing a new RAPI that already
-    # exists.
-    if hash in RAPI_CACHE:
-        return RAPI_CACHE[hash]
-
-    # delete any old version of the client that was cached.
-    if cluster in RAPI_CACHE_HASHES:
-        del RAPI_CACHE[RAPI_CACHE_HASHES[cluster]]
-
+    # now that we know hash is fresh, the registry returns the client which
+    # already exists for it, if any.  The original hash could have been
+    # stale; any old version of the client is dropped, closing its pooled
+    # connections.
     # Set connect timeout in settings.py so that you do not learn patience.
-    rapi = rapi_client(host, port, user, password,
-                       timeout=settings.RAPI_CONNECT_TIMEOUT)
-    RAPI_CACHE[hash] = rapi
-    RAPI_CACHE_HASHES[cluster] = hash
-    return rapi
+    return RAPI_CLIENTS.add(cluster, hash, lambda: rapi_client(
+        host, port, user, password,
+        timeout=settings.RAPI_CONNECT_TIMEOUT,
+        pool_size=settings.RAPI_POOL_SIZE,
+        pool_idle_timeout=settings.RAPI_POOL_IDLE_TIMEOUT,
+        response_cache=ResponseCache(hash),
+        circuit_breaker=CircuitBreaker(hash),
+        single_flight=SingleFlight(),
+        limiter=RequestLimiter(hash)))
+
+
+def invalidate_rapi(cluster_id, hash=None):
+    """
+    Drops the cached RAPI client of a cluster, unless it was created for
+    ``hash``, the current hash of the cluster.
+    """
+    RAPI_CLIENTS.invalidate(cluster_id, hash)
 
 
 def clear_rapi_cache():
     """
     clears the rapi cache
     """
-    RAPI_CACHE.clear()
-    RAPI_CACHE_HASHES.clear()
+    RAPI_CLIENTS.clear()
+
+
+def rapi_pool_stats():
+    """
+    Returns connection pool statistics for every cached RAPI client, keyed by
+    cluster id.
+    """
+    return dict((cluster_id, rapi.GetPoolStats())
+                for cluster_id, rapi in RAPI_CLIENTS.clients().items())
+
+
+# Status of a value in a query result which was retrieved normally.
+RS_NORMAL = 0
+
+
+def query_rows(rapi, what, fields, qfilter=None):
+    """
+    Run a query with the Ganeti query API and return its rows as dicts of
+    field name to value.  Values which ganeti could not retrieve, for example
+    because the object no longer exists, are None.
+    """
+    result = rapi.Query(what, fields, qfilter)
+    names = [field["name"] for field in result["fields"]]
+    return [dict((name, value if status == RS_NORMAL else None)
+                 for name, (status, value) in zip(names, row))
+            for row in result["data"]]
 
 
 def cluster_default_info(cluster, hypervisor=None):
@@ -0,0 +1,256 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Asynchronous Ganeti RAPI client.
+
+AsyncGanetiRapiClient has the same methods as GanetiRapiClient, but every
+method returns a Deferred instead of blocking.  All clients share one Twisted
+connection pool, so many requests to many cluster masters can be in flight at
+once without a thread per request.
+
+Requests must be issued from the reactor thread.  Synchronous code (views,
+management commands) should use gather(), which runs the reactor in a
+background thread and waits for a batch of calls to finish::
+
+    clients = [AsyncGanetiRapiClient(c.hostname, c.port) for c in clusters]
+    infos = gather([client.GetInfo for client in clients])
+"""
+
+# No Ganeti-specific modules should be imported. The RAPI client is supposed
+# to be standalone.
+
+import atexit
+import base64
+import threading
+import urllib
+from cStringIO import StringIO
+
+from twisted.internet import defer, error, reactor, ssl
+from twisted.internet.threads import blockingCallFromThread
+from twisted.web import http
+from twisted.web.client import (Agent, FileBodyProducer, HTTPConnectionPool,
+                                ResponseFailed, ResponseNeverReceived,
+                                readBody)
+from twisted.web.http_headers import Headers
+from twisted.web.iweb import IPolicyForHTTPS
+from zope.interface import implementer
+
+from .client import (ClientError, GanetiApiError, GanetiRapiClient,
+                     GANETI_RAPI_VERSION, RAPI_POOL_SIZE)
+
+
+_pool = None
+_reactor_thread = None
+_reactor_lock = threading.Lock()
+
+
+@implementer(IPolicyForHTTPS)
+class _NoVerifyPolicy(object):
+    """
+    Accept any certificate.  Cluster masters use self-signed certificates,
+    and the synchronous client doesn't verify them either.
+    """
+
+    def creatorForNetloc(self, hostname, port):
+        return ssl.CertificateOptions(verify=False)
+
+
+def _get_pool():
+    """
+    Returns the connection pool shared by all asynchronous clients.
+    """
+    global _pool
+    if _pool is None:
+        _pool = HTTPConnectionPool(reactor, persistent=True)
+        _pool.maxPersistentPerHost = RAPI_POOL_SIZE
+    return _pool
+
+
+def start_reactor():
+    """
+    Runs the Twisted reactor in a daemon thread, if it is not running yet.
+    """
+    global _reactor_thread
+    with _reactor_lock:
+        if _reactor_thread is None:
+            _reactor_thread = threading.Thread(
+                target=reactor.run, kwargs={"installSignalHandlers": False})
+            _reactor_thread.daemon = True
+            _reactor_thread.start()
+            atexit.register(_stop_reactor)
+
+
+def _stop_reactor():
+    """
+    Stops the reactor thread, so it doesn't die mid-call at interpreter exit.
+    """
+    reactor.callFromThread(reactor.stop)
+    _reactor_thread.join(5)
+
+
+def gather(calls):
+    """
+    Runs asynchronous RAPI calls concurrently and waits for all of them.
+
+    This is meant to be called from synchronous code, never from the reactor
+    thread.
+
+    :type calls: list of callables
+    :param calls: callables returning a Deferred, e.g. bound client methods
+                  or functools.partial objects
+
+    :rtype: list
+    :return: the result of each call, in order.  A failed call returns its
+             exception (usually a GanetiApiError) instead of raising it.
+    """
+
+    start_reactor()
+
+    def fan_out():
+        d = defer.DeferredList([defer.maybeDeferred(call) for call in calls],
+                               consumeErrors=True)
+        return d.addCallback(
+            lambda results: [r if ok else r.value for ok, r in results])
+
+    return blockingCallFromThread(reactor, fan_out)
+
+
+def _synchronous_only(name):
+    def method(self, *args, **kwargs):
+        raise ClientError("%s checks the server features first and is only"
+                          " available on GanetiRapiClient" % name)
+    method.__name__ = name
+    return method
+
+
+class AsyncGanetiRapiClient(GanetiRapiClient):
+    """
+    Ganeti RAPI client returning Deferreds.
+
+    Requests are built and responses are decoded by the same code as
+    GanetiRapiClient, so query coercion and GanetiApiError codes are
+    identical.
+    """
+
+    def _GetAgent(self):
+        agent = getattr(self, "_agent", None)
+        if agent is None:
+            agent = self._agent = Agent(reactor, _NoVerifyPolicy(),
+                                        connectTimeout=self.timeout,
+                                        pool=_get_pool())
+        return agent
+
+    def _CachedRequest(self, name, path, query=None):
+        # Deferreds can't be shared through the response cache, so read-only
+        # requests always reach the cluster.
+        return self._SendRequest("get", path, query=query)
+
+    def _SendRequest(self, method, path, query=None, content=None,
+                     timeout=None):
+        """
+        Sends an HTTP request.
+
+        :rtype: Deferred
+        :return: fires with the JSON-Decoded response, or fails with
+                 GanetiApiError
+        """
+
+        url, kwargs = self._PrepareRequest(method, path, query, content,
+                                           timeout)
+
+        if "params" in kwargs:
+            url += "?" + urllib.urlencode(kwargs["params"], doseq=True)
+
+        request_headers = Headers()
+        for name, value in kwargs["headers"].items():
+            request_headers.addRawHeader(name, value)
+        if "auth" in kwargs:
+            credentials = base64.b64encode("%s:%s" % kwargs["auth"])
+            request_headers.addRawHeader("authorization",
+                                         "Basic %s" % credentials)
+
+        body = None
+        if "data" in kwargs:
+            body = FileBodyProducer(StringIO(kwargs["data"]))
+
+        def read(response):
+            d = readBody(response)
+            d.addCallback(lambda content: (response.code, content))
+            return d
+
+        def timed_out(result, timeout):
+            raise GanetiApiError("Timed out connecting to %s" %
+                                 self._base_url)
+
+        def failed(failure):
+            failure.trap(error.ConnectError, error.TimeoutError,
+                         ResponseFailed, ResponseNeverReceived)
+            raise GanetiApiError("Couldn't connect to %s" % self._base_url)
+
+        d = self._GetAgent().request(method.upper(), url, request_headers,
+                                     body)
+        d.addCallback(read)
+        if isinstance(kwargs["timeout"], tuple):
+            # (connect, read); the agent already enforces the former
+            timeout = sum(kwargs["timeout"])
+        else:
+            timeout = kwargs["timeout"]
+        d.addTimeout(timeout, reactor, onTimeoutCancel=timed_out)
+        d.addCallbacks(lambda response: self._ParseResponse(*response),
+                       failed)
+        return d
+
+    def GetFeatures(self):
+        def not_found(failure):
+            # Older RAPI servers don't support this resource.
+            failure.trap(GanetiApiError)
+            if failure.value.code == http.NOT_FOUND:
+                return []
+            return failure
+
+        d = self._SendRequest("get", "/%s/features" % GANETI_RAPI_VERSION)
+        return d.addErrback(not_found)
+
+    def GetInstances(self, bulk=False):
+        if bulk:
+            return super(AsyncGanetiRapiClient, self).GetInstances(bulk)
+        d = self._SendRequest("get", "/%s/instances" % GANETI_RAPI_VERSION)
+        return d.addCallback(lambda instances: [i["id"] for i in instances])
+
+    def GetJobs(self, bulk=False):
+        if bulk:
+            return super(AsyncGanetiRapiClient, self).GetJobs(bulk)
+        d = self._SendRequest("get", "/%s/jobs" % GANETI_RAPI_VERSION)
+        return d.addCallback(lambda jobs: [int(job["id"]) for job in jobs])
+
+    def GetNodes(self, bulk=False):
+        if bulk:
+            return super(AsyncGanetiRapiClient, self).GetNodes(bulk)
+        d = self._SendRequest("get", "/%s/nodes" % GANETI_RAPI_VERSION)
+        return d.addCallback(lambda nodes: [n["id"] for n in nodes])
+
+    def GetGroups(self, bulk=False):
+        if bulk:
+            return super(AsyncGanetiRapiClient, self).GetGroups(bulk)
+        d = self._SendRequest("get", "/%s/groups" % GANETI_RAPI_VERSION)
+        return d.addCallback(lambda groups: [g["name"] for g in groups])
+
+    CreateInstance = _synchronous_only("CreateInstance")
+    ReinstallInstance = _synchronous_only("ReinstallInstance")
+    EvacuateNode = _synchronous_only("EvacuateNode")
+    MigrateNode = _synchronous_only("MigrateNode")
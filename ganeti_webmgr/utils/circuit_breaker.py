@@ -0,0 +1,122 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Circuit breaking of unreachable cluster masters in Django's cache framework.
+
+After ``RAPI_CIRCUIT_BREAKER_THRESHOLD`` consecutive failures to connect to a
+cluster's master, the breaker of the cluster opens and requests to it fail
+immediately instead of waiting for ``RAPI_CONNECT_TIMEOUT``.  Once
+``RAPI_CIRCUIT_BREAKER_COOLDOWN`` seconds have passed, a single request is let
+through as a probe; the breaker closes again if it reaches the master.
+
+The state is stored under the hash of the cluster's connection credentials,
+so every process sharing the cache backend shares it.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+KEY_PREFIX = "gwm-breaker"
+
+# Failures further apart than this are not consecutive.
+FAILURE_TIMEOUT = 600
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of one cluster, used by GanetiRapiClient.
+    """
+
+    def __init__(self, cluster_hash):
+        self.cluster_hash = cluster_hash
+        self._failed = False
+        self._opened = False
+        self._probing = False
+
+    def _key(self, name):
+        return "%s:%s:%s" % (KEY_PREFIX, self.cluster_hash, name)
+
+    def opened(self):
+        """
+        Returns the time the breaker opened, or None if it is closed.
+        """
+        return cache.get(self._key("opened"))
+
+    def allow(self):
+        """
+        Whether a request may be sent to the master.  While the breaker is
+        open this is only true for the one request probing the master after
+        the cool-down.
+        """
+        state = cache.get_many([self._key("opened"), self._key("failures")])
+        self._failed = bool(state.get(self._key("failures")))
+        opened = state.get(self._key("opened"))
+        # the failures may expire before the breaker does
+        self._opened = opened is not None
+        self._probing = False
+        if opened is None:
+            return True
+
+        cooldown = settings.RAPI_CIRCUIT_BREAKER_COOLDOWN
+        if time.time() - opened < cooldown:
+            return False
+        # only the first process to claim the probe sends it
+        self._probing = cache.add(self._key("probe"), True, cooldown)
+        return self._probing
+
+    def release(self):
+        """
+        Give back the probe claimed by allow() for a request which was not
+        sent after all, so the next request probes the master instead.
+        """
+        if self._probing:
+            cache.delete(self._key("probe"))
+            self._probing = False
+
+    def success(self):
+        """
+        Record that the master was reached, closing the breaker.
+        """
+        if self._failed or self._opened:
+            cache.delete_many([self._key("opened"), self._key("failures"),
+                               self._key("probe")])
+            self._failed = False
+            self._opened = False
+
+    def failure(self):
+        """
+        Record a failure to connect to the master, opening the breaker once
+        there have been enough of them in a row.
+        """
+        self._failed = True
+        key = self._key("failures")
+        cache.add(key, 0, FAILURE_TIMEOUT)
+        try:
+            failures = cache.incr(key)
+        except ValueError:
+            # the count expired in between
+            failures = 1
+            cache.set(key, failures, FAILURE_TIMEOUT)
+
+        if failures >= settings.RAPI_CIRCUIT_BREAKER_THRESHOLD:
+            cache.set(self._key("opened"), time.time(),
+                      FAILURE_TIMEOUT + settings.RAPI_CIRCUIT_BREAKER_COOLDOWN)
+            cache.delete(self._key("probe"))
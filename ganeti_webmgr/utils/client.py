@@ -27,13 +27,23 @@ Ganeti RAPI client.
 import logging
 import simplejson as json
 import socket
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
 
 GANETI_RAPI_PORT = 5080
 GANETI_RAPI_VERSION = 2
 
+# Connection pool defaults.  The pool size is the number of keep-alive
+# connections held open to the cluster master; idle sessions are thrown away
+# after the idle timeout (seconds) so we don't hold sockets the master has
+# long since closed.
+RAPI_POOL_SIZE = 10
+RAPI_POOL_IDLE_TIMEOUT = 60
+
 REPLACE_DISK_PRI = "replace_on_primary"
 REPLACE_DISK_SECONDARY = "replace_on_secondary"
 REPLACE_DISK_CHG = "replace_new_secondary"
@@ -159,7 +169,11 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
     _json_encoder = json.JSONEncoder(sort_keys=True)
 
     def __init__(self, host, port=GANETI_RAPI_PORT, username=None,
-                 password=None, timeout=60, logger=logging):
+                 password=None, timeout=60, logger=logging,
+                 pool_size=RAPI_POOL_SIZE,
+                 pool_idle_timeout=RAPI_POOL_IDLE_TIMEOUT,
+                 response_cache=None, circuit_breaker=None,
+                 single_flight=None, limiter=None):
         """
         Initializes this class.
 
@@ -172,6 +186,25 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
         :type password: string
         :param password: the password to connect with
         :param logger: Logging object
+        :type pool_size: int
+        :param pool_size: maximum number of keep-alive connections to keep
+                          open to the cluster master
+        :type pool_idle_timeout: int
+        :param pool_idle_timeout: seconds a pooled session may sit unused
+                                  before it is discarded; None disables
+                                  idle eviction
+        :param response_cache: cache for the responses of read-only requests,
+                               providing fetch(name, key, func) and
+                               invalidate(); None disables caching
+        :param circuit_breaker: breaker failing requests fast while the
+                                master is unreachable, providing allow(),
+                                success() and failure(); None disables it
+        :param single_flight: group sharing one request between identical
+                              GETs sent concurrently, providing
+                              do(key, func) and stats(); None disables it
+        :param limiter: limits of the requests sent to the master at once
+                        and per second, providing acquire(long_poll) and
+                        release(slot); None disables them
         """
 
         if username is not None and password is None:
@@ -184,6 +217,24 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
         self.timeout = timeout
         self._logger = logger
 
+        self.pool_size = pool_size
+        self.pool_idle_timeout = pool_idle_timeout
+        self.response_cache = response_cache
+        self.circuit_breaker = circuit_breaker
+        self.single_flight = single_flight
+        self.limiter = limiter
+        self._adapter = None
+        self._local = threading.local()
+        self._last_used = None
+        self._seen_connections = 0
+        self._pool_lock = threading.Lock()
+        self._pool_stats = {
+            "requests": 0,
+            "hits": 0,
+            "new_connections": 0,
+            "resets": 0,
+        }
+
         try:
             socket.inet_pton(socket.AF_INET6, host)
             address = "[%s]:%s" % (host, port)
@@ -194,12 +245,113 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
 
         self._base_url = "https://%s" % address
 
-    def _SendRequest(self, method, path, query=None, content=None):
+    def _GetSession(self):
         """
-        Sends an HTTP request.
+        Returns the session the current thread uses to talk to the cluster
+        master.
 
-        This constructs a full URL, encodes and decodes HTTP bodies, and
-        handles invalid responses in a pythonic way.
+        Sessions aren't safe to share between threads, so every thread has
+        its own, but all of them draw connections from the same pool.  The
+        pool is created lazily, and recreated if it sat idle for longer than
+        ``pool_idle_timeout``.
+
+        :rtype: requests.Session
+        """
+
+        with self._pool_lock:
+            now = time.time()
+            if (self._adapter is not None
+                    and self.pool_idle_timeout is not None
+                    and now - self._last_used > self.pool_idle_timeout):
+                self._logger.debug("Evicting idle RAPI session for %s",
+                                   self._base_url)
+                self._ResetSession()
+
+            if self._adapter is None:
+                self._adapter = HTTPAdapter(pool_connections=1,
+                                            pool_maxsize=self.pool_size)
+                self._seen_connections = 0
+
+            self._last_used = now
+            adapter = self._adapter
+
+        local = self._local
+        if getattr(local, "adapter", None) is not adapter:
+            local.session = requests.Session()
+            local.session.mount("https://", adapter)
+            local.adapter = adapter
+        return local.session
+
+    def _ResetSession(self):
+        """
+        Closes the connection pool and all of its connections.  Every thread
+        starts a new session on the next request.
+
+        The caller must hold ``_pool_lock``.
+        """
+
+        if self._adapter is not None:
+            self._adapter.close()
+            self._adapter = None
+            self._pool_stats["resets"] += 1
+
+    def _RecordPoolUsage(self):
+        """
+        Updates pool statistics after a request went through the session.
+        """
+
+        with self._pool_lock:
+            if self._adapter is None:
+                return
+            pool = self._adapter.poolmanager.connection_from_url(
+                self._base_url)
+            opened = max(pool.num_connections - self._seen_connections, 0)
+            self._seen_connections = pool.num_connections
+
+            stats = self._pool_stats
+            stats["requests"] += 1
+            stats["new_connections"] += opened
+            if not opened:
+                stats["hits"] += 1
+
+    def GetPoolStats(self):
+        """
+        Gets statistics for this client's connection pool.
+
+        ``hits`` counts requests which reused an already open connection,
+        ``new_connections`` counts connections opened to the master, and
+        ``resets`` counts how often the whole pool was thrown away, either
+        because it sat idle or because a connection failed.  ``coalesced``
+        counts GETs which shared a request already in flight instead of
+        sending their own.
+
+        :rtype: dict
+        :return: pool statistics
+        """
+
+        with self._pool_lock:
+            stats = dict(self._pool_stats)
+        stats["pool_size"] = self.pool_size
+        stats["coalesced"] = 0
+        if self.single_flight is not None:
+            stats["coalesced"] = self.single_flight.stats()["coalesced"]
+        return stats
+
+    def Close(self):
+        """
+        Closes all pooled connections to the cluster master.
+        """
+
+        with self._pool_lock:
+            self._ResetSession()
+
+    def _PrepareRequest(self, method, path, query=None, content=None,
+                        timeout=None):
+        """
+        Builds the URL and keyword arguments for an HTTP request.
+
+        This is shared by every transport so they all encode requests the
+        same way.
 
         :type method: string
         :param method: HTTP method to use
@@ -209,11 +361,11 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
         :param query: query arguments to pass to urllib.urlencode
         :type content: str or None
         :param content: HTTP body content
+        :type timeout: float or tuple
+        :param timeout: overrides the client's timeout for this request
 
-        :rtype: object
-        :return: JSON-Decoded response
-
-        :raises GanetiApiError: If an invalid response is returned
+        :rtype: tuple
+        :return: the full URL and a dict of arguments for requests
         """
 
         if not path.startswith("/"):
@@ -222,7 +374,7 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
 
         kwargs = {
             "headers": headers,
-            "timeout": self.timeout,
+            "timeout": timeout or self.timeout,
             "verify": False,
         }
 
@@ -241,21 +393,152 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
         self._logger.debug("Sending request to %s %s", url, kwargs)
         # print "Sending request to %s %s" % (url, kwargs)
 
+        return url, kwargs
+
+    def _ParseResponse(self, status_code, content):
+        """
+        Decodes the body of an HTTP response.
+
+        :type status_code: int
+        :param status_code: HTTP status of the response
+        :type content: str
+        :param content: HTTP body of the response
+
+        :rtype: object
+        :return: JSON-Decoded response
+
+        :raises GanetiApiError: If an invalid response is returned
+        """
+
+        if status_code != requests.codes.ok:
+            raise GanetiApiError(str(status_code), code=status_code)
+
+        if content:
+            return json.loads(content)
+        else:
+            return None
+
+    def _SendRequest(self, method, path, query=None, content=None,
+                     timeout=None):
+        """
+        Sends an HTTP request.
+
+        This constructs a full URL, encodes and decodes HTTP bodies, and
+        handles invalid responses in a pythonic way.  Identical GETs sent
+        concurrently share a single request.
+
+        :type method: string
+        :param method: HTTP method to use
+        :type path: string
+        :param path: HTTP URL path
+        :type query: list of two-tuples
+        :param query: query arguments to pass to urllib.urlencode
+        :type content: str or None
+        :param content: HTTP body content
+        :type timeout: float or tuple
+        :param timeout: overrides the client's timeout for this request
+
+        :rtype: object
+        :return: JSON-Decoded response
+
+        :raises GanetiApiError: If an invalid response is returned
+        """
+
+        if method == "get" and self.single_flight is not None:
+            key = repr((path, sorted(query.items()) if query else None,
+                        content, timeout))
+            return self.single_flight.do(
+                key, lambda: self._SendSingleRequest(method, path, query,
+                                                     content, timeout))
+
+        return self._SendSingleRequest(method, path, query, content, timeout)
+
+    def _SendSingleRequest(self, method, path, query=None, content=None,
+                           timeout=None):
+        """
+        Sends an HTTP request, without coalescing it.  See _SendRequest.
+        """
+
+        url, kwargs = self._PrepareRequest(method, path, query, content,
+                                           timeout)
+
+        breaker = self.circuit_breaker
+        if breaker is not None and not breaker.allow():
+            raise GanetiApiError("Couldn't connect to %s recently, not "
+                                 "retrying yet" % self._base_url)
+
+        session = self._GetSession()
+
+        # Anything but a GET or a query may change the cluster, so responses
+        # cached before it are dropped: before the request, in case it fails
+        # after reaching ganeti, and after it, in case a concurrent GET cached
+        # the old state in between.
+        invalidate = (method != "get" and self.response_cache is not None
+                      and not path.startswith("/%s/query/" %
+                                              GANETI_RAPI_VERSION))
+        if invalidate:
+            self.response_cache.invalidate()
+
+        limiter = self.limiter
+        slot = None
+        if limiter is not None:
+            slot = limiter.acquire(long_poll=path.endswith("/wait"))
+            if slot is None:
+                if breaker is not None:
+                    # nothing was learned about the master
+                    breaker.release()
+                raise GanetiApiError("Too many requests to %s, try again "
+                                     "later" % self._base_url)
+
         try:
-            r = requests.request(method, url, **kwargs)
+            r = session.request(method, url, **kwargs)
         except requests.ConnectionError:
+            # A pooled connection may have been dropped by the master; start
+            # over with a fresh pool on the next request.
+            self.Close()
+            if breaker is not None:
+                breaker.failure()
             raise GanetiApiError("Couldn't connect to %s" % self._base_url)
         except requests.Timeout:
+            self.Close()
+            if breaker is not None:
+                breaker.failure()
             raise GanetiApiError("Timed out connecting to %s" %
                                  self._base_url)
+        finally:
+            if limiter is not None:
+                limiter.release(slot)
+            if invalidate:
+                self.response_cache.invalidate()
 
-        if r.status_code != requests.codes.ok:
-            raise GanetiApiError(str(r.status_code), code=r.status_code)
+        if breaker is not None:
+            breaker.success()
+        self._RecordPoolUsage()
 
-        if r.content:
-            return json.loads(r.content)
-        else:
-            return None
+        return self._ParseResponse(r.status_code, r.content)
+
+    def _CachedRequest(self, name, path, query=None):
+        """
+        Sends a GET request for a read-only resource, answering it from the
+        response cache when possible.
+
+        :type name: string
+        :param name: name of the calling method, which selects the TTL
+        :type path: string
+        :param path: HTTP URL path
+        :type query: dict
+        :param query: query arguments
+
+        :rtype: object
+        :return: JSON-Decoded response
+        """
+
+        if self.response_cache is None:
+            return self._SendRequest("get", path, query=query)
+
+        key = (path, sorted(query.items()) if query else None)
+        return self.response_cache.fetch(
+            name, key, lambda: self._SendRequest("get", path, query=query))
 
     def GetVersion(self):
         """
@@ -294,7 +577,8 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
         :return: operating systems
         """
 
-        return self._SendRequest("get", "/%s/os" % GANETI_RAPI_VERSION)
+        return self._CachedRequest("GetOperatingSystems",
+                                   "/%s/os" % GANETI_RAPI_VERSION)
 
     def GetInfo(self):
         """
@@ -304,8 +588,8 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
         :return: information about the cluster
         """
 
-        return self._SendRequest("get", "/%s/info" % GANETI_RAPI_VERSION,
-                                 None, None)
+        return self._CachedRequest("GetInfo",
+                                   "/%s/info" % GANETI_RAPI_VERSION)
 
     def RedistributeConfig(self):
         """
@@ -392,11 +676,11 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
         """
 
         if bulk:
-            return self._SendRequest("get", "/%s/instances" %
-                                     GANETI_RAPI_VERSION, query={"bulk": 1})
+            return self._CachedRequest("GetInstances", "/%s/instances" %
+                                       GANETI_RAPI_VERSION, query={"bulk": 1})
         else:
-            instances = self._SendRequest("get", "/%s/instances" %
-                                          GANETI_RAPI_VERSION)
+            instances = self._CachedRequest("GetInstances", "/%s/instances" %
+                                            GANETI_RAPI_VERSION)
             return [i["id"] for i in instances]
 
     def GetInstance(self, instance):
@@ -970,14 +1254,23 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
         return self._SendRequest("get", ("/%s/instances/%s/console" %
                                          (GANETI_RAPI_VERSION, instance)))
 
-    def GetJobs(self):
+    def GetJobs(self, bulk=False):
         """
         Gets all jobs for the cluster.
 
-        :rtype: list of int
-        :return: job ids for the cluster
+        :type bulk: bool
+        :param bulk: whether to return all information about all jobs; this
+                     requires Ganeti 2.5 or newer
+
+        :rtype: list of dict or list of int
+        :return: if bulk is True, info about the jobs,
+                 else job ids for the cluster
         """
 
+        if bulk:
+            return self._SendRequest("get", "/%s/jobs" % GANETI_RAPI_VERSION,
+                                     query={"bulk": 1})
+
         jobs = self._SendRequest("get", "/%s/jobs" % GANETI_RAPI_VERSION)
 
         return [int(job["id"]) for job in jobs]
@@ -996,12 +1289,27 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
         return self._SendRequest("get", "/%s/jobs/%s" % (GANETI_RAPI_VERSION,
                                                          job_id))
 
-    def WaitForJobChange(self, job_id, fields, prev_job_info, prev_log_serial):
+    def WaitForJobChange(self, job_id, fields, prev_job_info, prev_log_serial,
+                         timeout=None):
         """
         Waits for job changes.
 
+        Ganeti holds the request for up to ten seconds, so the client's
+        timeout is usually too short; pass a longer ``timeout``, such as a
+        (connect, read) tuple.
+
         :type job_id: int
         :param job_id: Job ID for which to wait
+        :type fields: list of string
+        :param fields: job fields to return
+        :type prev_job_info: list or None
+        :param prev_job_info: fields as returned by the previous call
+        :type prev_log_serial: int or None
+        :param prev_log_serial: serial of the last log entry already seen
+
+        :rtype: dict or None
+        :return: "job_info" and new "log_entries", or None if the job did not
+                 change
         """
 
         body = {
@@ -1011,7 +1319,8 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
         }
 
         return self._SendRequest("get", "/%s/jobs/%s/wait" %
-                                 (GANETI_RAPI_VERSION, job_id), content=body)
+                                 (GANETI_RAPI_VERSION, job_id), content=body,
+                                 timeout=timeout)
 
     def CancelJob(self, job_id, dry_run=False):
         """
@@ -1040,11 +1349,12 @@ class GanetiRapiClient(object):  # pylint: disable-msg=R0904
         """
 
         if bulk:
-            return self._SendRequest("get", "/%s/nodes" % GANETI_RAPI_VERSION,
-                                     query={"bulk": 1})
+            return self._CachedRequest("GetNodes",
+                                       "/%s/nodes" % GANETI_RAPI_VERSION,
+                                       query={"bulk": 1})
         else:
-            nodes = self._SendRequest("get", "/%s/nodes" %
-                                      GANETI_RAPI_VERSION)
+            nodes = self._CachedRequest("GetNodes", "/%s/nodes" %
+                                        GANETI_RAPI_VERSION)
             return [n["id"] for n in nodes]
 
     def GetNode(self, node):
@@ -0,0 +1,156 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Registry of the RAPI clients of a process.
+
+Clients are kept under the hash of their cluster's connection credentials,
+so a cluster whose credentials change gets a new client.  At most
+``RAPI_CLIENT_CACHE_SIZE`` clients are kept; the least recently used ones are
+dropped first, and clients unused for ``RAPI_CLIENT_CACHE_TTL`` seconds are
+dropped as well.  Dropping a client closes its pooled connections.  A thread
+still holding a dropped client can keep using it; it just isn't shared
+anymore.
+
+Every method is safe to call from several threads at once.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+
+from django.conf import settings
+
+
+class _Entry(object):
+    """
+    A registered client and the cluster it belongs to.
+    """
+
+    __slots__ = ("client", "cluster_id", "last_used")
+
+    def __init__(self, client, cluster_id, last_used):
+        self.client = client
+        self.cluster_id = cluster_id
+        self.last_used = last_used
+
+
+class ClientRegistry(object):
+    """
+    Bounded LRU registry of RAPI clients, keyed by cluster hash.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # hash -> _Entry, least recently used first
+        self._entries = OrderedDict()
+        # cluster id -> hash
+        self._hashes = {}
+
+    def get(self, hash):
+        """
+        Returns the client registered for a cluster hash, or None.
+        """
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            entry = self._entries.pop(hash, None)
+            if entry is None:
+                return None
+            entry.last_used = now
+            self._entries[hash] = entry
+            return entry.client
+
+    def add(self, cluster_id, hash, factory):
+        """
+        Returns the client registered for a cluster hash, registering one
+        made by ``factory`` if there is none.  A client registered for an
+        older hash of the cluster is dropped.
+
+        @param cluster_id - id of the cluster the client connects to
+        @param factory - callable returning a new client
+        """
+        with self._lock:
+            now = time.time()
+            entry = self._entries.pop(hash, None)
+            if entry is None:
+                old = self._hashes.get(cluster_id)
+                if old is not None:
+                    self._drop(old)
+                entry = _Entry(factory(), cluster_id, now)
+                self._hashes[cluster_id] = hash
+
+            entry.last_used = now
+            self._entries[hash] = entry
+            self._expire(now)
+            while len(self._entries) > settings.RAPI_CLIENT_CACHE_SIZE:
+                self._drop(next(iter(self._entries)))
+            return entry.client
+
+    def invalidate(self, cluster_id, hash=None):
+        """
+        Drop the client of a cluster, unless it is registered for ``hash``,
+        the current hash of the cluster.
+        """
+        with self._lock:
+            old = self._hashes.get(cluster_id)
+            if old is not None and old != hash:
+                self._drop(old)
+
+    def clear(self):
+        """
+        Drop every client.
+        """
+        with self._lock:
+            for entry in self._entries.values():
+                entry.client.Close()
+            self._entries.clear()
+            self._hashes.clear()
+
+    def clients(self):
+        """
+        Returns the registered clients, keyed by cluster id.
+        """
+        with self._lock:
+            return dict((entry.cluster_id, entry.client)
+                        for entry in self._entries.values())
+
+    def _expire(self, now):
+        """
+        Drop the clients unused for longer than the TTL.  The caller must
+        hold ``_lock``.
+        """
+        ttl = settings.RAPI_CLIENT_CACHE_TTL
+        if ttl is None:
+            return
+        for hash, entry in self._entries.items():
+            if now - entry.last_used <= ttl:
+                # the rest were used more recently
+                break
+            self._drop(hash)
+
+    def _drop(self, hash):
+        """
+        Drop the client of a hash, closing its connections.  The caller must
+        hold ``_lock``.
+        """
+        entry = self._entries.pop(hash, None)
+        if entry is None:
+            return
+        if self._hashes.get(entry.cluster_id) == hash:
+            del self._hashes[entry.cluster_id]
+        entry.client.Close()
@@ -0,0 +1,188 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Coalesced storage of GanetiErrors.
+
+When a cluster breaks, for example because its credentials changed, every
+one of its objects fails to refresh with the same error.  Inside an
+``ErrorSink`` block, errors stored and cleared by refreshes are buffered
+instead of being written one at a time.  Repeats of an error are coalesced by
+their hash, and everything is written when the block ends: one query finds
+which errors are already stored, one inserts the new ones, and errors are
+cleared with an update per cluster.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from hashlib import sha1
+import threading
+
+from django.db.models import Q
+
+
+# errors cleared by one update
+CLEAR_BATCH = 500
+
+_local = threading.local()
+
+
+def error_hash(cluster_id, obj_type_id, obj_id, code, msg):
+    """
+    Returns the hash identifying repeats of an error.
+    """
+    key = u"%s:%s:%s:%s:%s" % (cluster_id, obj_type_id, obj_id, code, msg)
+    return sha1(key.encode("utf-8")).hexdigest()
+
+
+def error_sink():
+    """
+    Returns the ErrorSink of the current thread, or a sink writing errors
+    immediately if there is none.
+    """
+    return getattr(_local, "sink", None) or DIRECT_SINK
+
+
+class DirectSink(object):
+    """
+    Stores and clears errors immediately.
+    """
+
+    def store(self, msg, obj, code):
+        from .models import GanetiError
+        GanetiError.store_error(msg, obj=obj, code=code)
+
+    def clear(self, obj):
+        from .models import GanetiError
+        GanetiError.objects.clear_errors(obj=obj)
+
+    def clear_objects(self, cluster_id, obj_type_id, obj_ids):
+        from .models import GanetiError
+        obj_ids = list(obj_ids)
+        for i in xrange(0, len(obj_ids), CLEAR_BATCH):
+            GanetiError.objects.filter(
+                cluster=cluster_id, obj_type=obj_type_id,
+                obj_id__in=obj_ids[i:i + CLEAR_BATCH]).clear_errors()
+
+
+DIRECT_SINK = DirectSink()
+
+
+class ErrorSink(DirectSink):
+    """
+    Buffers the errors stored and cleared by a thread until the end of a
+    ``with`` block, or until flush().
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.stored = {}
+        self.cleared_clusters = set()
+        self.cleared = defaultdict(lambda: defaultdict(set))
+
+    def __enter__(self):
+        self.parent = getattr(_local, "sink", None)
+        _local.sink = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.sink = self.parent
+        self.flush()
+
+    def store(self, msg, obj, code):
+        from .models import GanetiError
+        fields, covering = GanetiError.error_fields(msg, obj, code)
+        self.stored.setdefault(fields["hash"], (fields, covering))
+
+    def clear(self, obj):
+        from ganeti_webmgr.clusters.models import Cluster
+        from django.contrib.contenttypes.models import ContentType
+
+        if isinstance(obj, Cluster):
+            # every error of a cluster is cleared along with it
+            self.cleared_clusters.add(obj.pk)
+            self._discard(lambda fields: fields["cluster_id"] == obj.pk)
+        else:
+            ct = ContentType.objects.get_for_model(obj.__class__)
+            self.clear_objects(obj.cluster_id, ct.pk, [obj.pk])
+
+    def clear_objects(self, cluster_id, obj_type_id, obj_ids):
+        obj_ids = set(obj_ids)
+        self.cleared[cluster_id][obj_type_id].update(obj_ids)
+        self._discard(lambda fields: fields["obj_type_id"] == obj_type_id
+                      and fields["obj_id"] in obj_ids)
+
+    def _discard(self, cleared):
+        """
+        Forget stored errors which were cleared afterwards.
+        """
+        for key, (fields, covering) in self.stored.items():
+            if cleared(fields):
+                del self.stored[key]
+
+    def flush(self):
+        """
+        Write the buffered errors.  Errors are cleared before new ones are
+        stored.
+        """
+        from .models import GanetiError
+
+        for cluster_id in self.cleared_clusters:
+            GanetiError.objects.filter(cluster=cluster_id).clear_errors()
+            self.cleared.pop(cluster_id, None)
+        for cluster_id, types in self.cleared.items():
+            # every object of a cluster is cleared at once, a batch at a time
+            clauses = [(obj_type_id, obj_id)
+                       for obj_type_id, obj_ids in types.items()
+                       for obj_id in obj_ids]
+            for i in xrange(0, len(clauses), CLEAR_BATCH):
+                by_type = defaultdict(list)
+                for obj_type_id, obj_id in clauses[i:i + CLEAR_BATCH]:
+                    by_type[obj_type_id].append(obj_id)
+                q = reduce(lambda a, b: a | b,
+                           [Q(obj_type=obj_type_id, obj_id__in=obj_ids)
+                            for obj_type_id, obj_ids in by_type.items()])
+                GanetiError.objects.filter(q, cluster=cluster_id) \
+                    .clear_errors()
+
+        if self.stored:
+            hashes = set(self.stored)
+            hashes.update(covering for fields, covering
+                          in self.stored.values() if covering)
+            hashes = list(hashes)
+            existing = set()
+            uncleared = set()
+            for i in xrange(0, len(hashes), CLEAR_BATCH):
+                rows = GanetiError.objects \
+                    .filter(hash__in=hashes[i:i + CLEAR_BATCH]) \
+                    .values_list("hash", "cleared")
+                for key, cleared in rows:
+                    existing.add(key)
+                    if not cleared:
+                        uncleared.add(key)
+
+            now = datetime.now()
+            errors = [GanetiError(timestamp=now, **fields)
+                      for key, (fields, covering) in self.stored.items()
+                      if key not in existing
+                      and covering not in self.stored
+                      and covering not in uncleared]
+            GanetiError.objects.bulk_create(errors)
+
+        self._reset()
@@ -10,6 +10,8 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.generic import GenericForeignKey
 
+from .error_sink import error_hash
+
 
 ssh_public_key_re = re.compile(r'^ssh-(rsa|dsa|dss) [A-Z0-9+/=]+ .+$',
                                re.IGNORECASE)
@@ -57,7 +59,7 @@ class GanetiError(models.Model):
     code = models.PositiveIntegerField(blank=True, null=True)
 
     # XXX could be fixed with django-model-util's TimeStampedModel
-    timestamp = models.DateTimeField()
+    timestamp = models.DateTimeField(db_index=True)
 
     # determines if the errors still appears or not
     cleared = models.BooleanField(default=False)
@@ -67,11 +69,20 @@ class GanetiError(models.Model):
     obj_id = models.PositiveIntegerField()
     obj = GenericForeignKey("obj_type", "obj_id")
 
+    # identifies repeats of the same error; see error_hash()
+    hash = models.CharField(max_length=40, db_index=True, editable=False)
+
     objects = QuerySetManager()
 
     class Meta:
         ordering = ("-timestamp", "code", "msg")
 
+    def save(self, *args, **kwargs):
+        if not self.hash:
+            self.hash = error_hash(self.cluster_id, self.obj_type_id,
+                                   self.obj_id, self.code, self.msg)
+        super(GanetiError, self).save(*args, **kwargs)
+
     def __unicode__(self):
         base = u"[%s] %s" % (self.timestamp, self.msg)
         return base
@@ -126,64 +137,85 @@ class GanetiError(models.Model):
         return "<GanetiError '%s'>" % self.msg
 
     @classmethod
-    def store_error(cls, msg, obj, code, **kwargs):
+    def error_fields(cls, msg, obj, code):
         """
-        Create and save an error with the given information.
+        Resolve the error an object would store.
 
-        @param  msg  error's message
-        @param  obj  object (i.e. cluster or vm) affected by the error
-        @param code  error's code number
+        401 errors are always stored on the cluster.  A 404 error of any
+        other object is covered by the same error on its cluster, if there is
+        one which isn't cleared.
+
+        @returns a dict of the fields of the error, including its hash, and
+        the hash of the cluster error covering it, or None
         """
         from ganeti_webmgr.clusters.models import Cluster
-        ct = ContentType.objects.get_for_model(obj.__class__)
         is_cluster = isinstance(obj, Cluster)
 
         # 401 -- bad permissions
         # 401 is cluster-specific error and thus shouldn't appear on any other
         # object.
-        if code == 401:
-            if not is_cluster:
-                # NOTE: what we do here is almost like:
-                #  return self.store_error(msg=msg, code=code, obj=obj.cluster)
-                # we just omit the recursiveness
-                obj = obj.cluster
-                ct = ContentType.objects.get_for_model(Cluster)
-                is_cluster = True
+        if code == 401 and not is_cluster:
+            obj = obj.cluster
+            is_cluster = True
+
+        cluster_id = obj.pk if is_cluster else obj.cluster_id
+        ct = ContentType.objects.get_for_model(obj.__class__)
+        fields = dict(msg=msg, code=code, cluster_id=cluster_id,
+                      obj_type_id=ct.pk, obj_id=obj.pk,
+                      hash=error_hash(cluster_id, ct.pk, obj.pk, code, msg))
 
         # 404 -- object not found
         # 404 can occur on any object, but when it occurs on a cluster, then
         # any of its children must not see the error again
-        elif code == 404:
-            if not is_cluster:
-                # return if the error exists for cluster
-                try:
-                    c_ct = ContentType.objects.get_for_model(Cluster)
-                    return cls.objects.filter(msg=msg, obj_type=c_ct,
-                                              code=code,
-                                              obj_id=obj.cluster_id,
-                                              cleared=False)[0]
-
-                except (cls.DoesNotExist, IndexError):
-                    # we want to proceed when the error is not
-                    # cluster-specific
-                    pass
-
-        # XXX use a try/except instead of get_or_create().  get_or_create()
-        # does not allow us to set cluster_id.  This means we'd have to query
-        # the cluster object to create the error.  we can't guaranteee the
-        # cluster will already be queried so use create() instead which does
-        # allow cluster_id
+        covering = None
+        if code == 404 and not is_cluster:
+            c_ct = ContentType.objects.get_for_model(Cluster)
+            covering = error_hash(cluster_id, c_ct.pk, cluster_id, code, msg)
+
+        return fields, covering
+
+    @classmethod
+    def store_error(cls, msg, obj, code, **kwargs):
+        """
+        Create and save an error with the given information, unless it was
+        stored before.
+
+        @param  msg  error's message
+        @param  obj  object (i.e. cluster or vm) affected by the error
+        @param code  error's code number
+        """
+        fields, covering = cls.error_fields(msg, obj, code)
+
+        if covering is not None:
+            # return if the error exists for cluster
+            try:
+                return cls.objects.filter(hash=covering, cleared=False)[0]
+            except IndexError:
+                pass
+
         try:
-            return cls.objects.filter(msg=msg, obj_type=ct, obj_id=obj.pk,
-                                      code=code, **kwargs)[0]
+            return cls.objects.filter(hash=fields["hash"], **kwargs)[0]
+        except IndexError:
+            fields.update(kwargs)
+            return cls.objects.create(timestamp=datetime.now(), **fields)
 
-        except (cls.DoesNotExist, IndexError):
-            cluster_id = obj.pk if is_cluster else obj.cluster_id
 
-            return cls.objects.create(timestamp=datetime.now(), msg=msg,
-                                      obj_type=ct, obj_id=obj.pk,
-                                      cluster_id=cluster_id, code=code,
-                                      **kwargs)
+class GanetiErrorArchive(models.Model):
+    """
+    A cleared error moved out of the GanetiError table by the
+    ``prunehistory`` management command.
+    """
+    cluster = models.ForeignKey("clusters.Cluster",
+                                related_name="archived_errors")
+    msg = models.TextField()
+    code = models.PositiveIntegerField(blank=True, null=True)
+    timestamp = models.DateTimeField()
+    obj_type = models.ForeignKey(ContentType, related_name="+")
+    obj_id = models.PositiveIntegerField()
+    archived = models.DateTimeField(auto_now_add=True)
+
+    def __repr__(self):
+        return "<GanetiErrorArchive '%s'>" % self.msg
 
 
 class Quota(models.Model):
@@ -20,7 +20,7 @@ __all__ = ['INSTANCE', 'INSTANCES', 'XEN_PVM_INSTANCE', 'XEN_HVM_INSTANCE',
            'XEN_INSTANCES', 'NODE', 'NODES', 'NODES_BULK', 'INFO', 'XEN_INFO',
            'OPERATING_SYSTEMS', 'XEN_OPERATING_SYSTEMS', 'JOB', 'JOB_RUNNING',
            'JOB_ERROR', 'JOB_DELETE_SUCCESS', 'JOB_LOG', 'INSTANCES_BULK',
-           'NODES_MAP']
+           'INSTANCES_MAP', 'NODES_MAP', 'JOB_WAIT']
 
 from .response_map import ResponseMap
 
@@ -499,6 +499,11 @@ JOB_DELETE_SUCCESS = {'status': 'success',
                       'opstatus': ['success'],
                       'oplog': [[]], 'id': '17050'}
 
+# WaitForJobChange response for JOB, with the fields used by jobs.watch
+JOB_WAIT = {'job_info': [JOB['id'], JOB['status'], JOB['ops'],
+                         JOB['opstatus'], JOB['opresult'], JOB['end_ts']],
+            'log_entries': [[1, [1291845003, 1], 'message', 'shutting down']]}
+
 JOB_LOG = {'end_ts': [1292007990, 759365],
            'id': '121061',
            'oplog': [[[1,
@@ -606,7 +611,7 @@ INSTANCES_BULK = [{'admin_state': False,
                                 'vnc_x509_path': '',
                                 'vnc_x509_verify': False},
                    'mtime': 1285883187.8692000,
-                   'name': 'vm1.example.bak',
+                   'name': 'gimager.example.bak',
                    'network_port': 11165,
                    'nic.bridges': ['br42'],
                    'nic.ips': [None],
@@ -655,7 +660,7 @@ INSTANCES_BULK = [{'admin_state': False,
                                 'vnc_x509_path': '',
                                 'vnc_x509_verify': False},
                    'mtime': 1285883187.8692000,
-                   'name': 'vm2.example.bak',
+                   'name': 'gimager2.example.bak',
                    'network_port': 11165,
                    'nic.bridges': ['br42'],
                    'nic.ips': [None],
@@ -674,6 +679,15 @@ INSTANCES_BULK = [{'admin_state': False,
                    'uuid': '27bac3d3-f634-4dee-aa60-ed2eeb5f2287'}
                   ]
 
+# map instances response for bulk argument
+INSTANCES_MAP = ResponseMap([
+    (((), {}), INSTANCES),
+    (((False,), {}), INSTANCES),
+    (((), {'bulk': False}), INSTANCES),
+    (((True,), {}), INSTANCES_BULK),
+    (((), {'bulk': True}), INSTANCES_BULK),
+])
+
 # map nodes response for bulk argument
 NODES_MAP = ResponseMap([
     (((), {}), NODES),
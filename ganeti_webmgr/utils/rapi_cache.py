@@ -0,0 +1,107 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Caching of read-only RAPI responses in Django's cache framework.
+
+Responses are stored under the hash of the cluster's connection credentials,
+so every process sharing the cache backend shares them.  Invalidating a
+cluster bumps its generation number, which is part of every key, instead of
+deleting the individual responses; the stale entries simply expire.
+
+Refreshes must see what ganeti has right now, since they stamp what they
+read as current; they wrap their requests in fresh_responses().
+"""
+
+from contextlib import contextmanager
+from hashlib import sha1
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+KEY_PREFIX = "gwm-rapi"
+
+# The generation of a cluster outlives any cached response, so an expired
+# generation can't bring responses from before an invalidation back.
+GENERATION_TIMEOUT = 86400
+
+_local = threading.local()
+
+
+@contextmanager
+def fresh_responses():
+    """
+    Send the read-only requests of the current thread within the block to
+    ganeti instead of answering them from the cache.  Their responses still
+    replace the cached ones.
+    """
+    previous = getattr(_local, "fresh", False)
+    _local.fresh = True
+    try:
+        yield
+    finally:
+        _local.fresh = previous
+
+
+class ResponseCache(object):
+    """
+    Response cache of one cluster, used by GanetiRapiClient.
+    """
+
+    def __init__(self, cluster_hash):
+        self.cluster_hash = cluster_hash
+
+    def _generation_key(self):
+        return "%s:%s:generation" % (KEY_PREFIX, self.cluster_hash)
+
+    def generation(self):
+        return cache.get(self._generation_key(), 0)
+
+    def fetch(self, name, key, func):
+        """
+        Return the cached response of a request, calling ``func`` to send
+        it if there is none.
+
+        @param name - name of the client method, which selects the TTL from
+        RAPI_RESPONSE_CACHE_TTL.  Methods without a TTL are not cached.
+        @param key - arguments identifying the request
+        @param func - callable sending the request
+        """
+        ttl = settings.RAPI_RESPONSE_CACHE_TTL.get(name)
+        if not ttl:
+            return func()
+
+        cache_key = "%s:%s:%s:%s:%s" % (
+            KEY_PREFIX, self.cluster_hash, self.generation(), name,
+            sha1(repr(key)).hexdigest())
+        response = None
+        if not getattr(_local, "fresh", False):
+            response = cache.get(cache_key)
+        if response is None:
+            response = func()
+            cache.set(cache_key, response, ttl)
+        return response
+
+    def invalidate(self):
+        """
+        Drop every cached response of the cluster.
+        """
+        cache.set(self._generation_key(), repr(time.time()),
+                  GENERATION_TIMEOUT)
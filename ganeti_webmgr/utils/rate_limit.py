@@ -0,0 +1,173 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Limiting of the requests sent to a cluster master, in Django's cache
+framework.
+
+Ganeti's RAPI daemon is a single process which is easily swamped by parallel
+refreshes and busy pages.  ``RAPI_LIMITS`` caps how many requests are sent to
+each master at once, and how many are sent per second:
+
+* A request takes one of ``concurrency`` slots while it is sent.  Slots are
+  cache keys added atomically, which expire on their own if a process dies
+  holding one.
+* Requests spend tokens from a bucket of ``burst`` tokens, which is refilled
+  every ``burst / rate`` seconds.
+
+Requests sent by the background refresh (see background_requests()) may
+only use the part of both not ``reserved`` for the requests of people using
+the web interface, so pages stay responsive while clusters are refreshed.
+A request which can't get a slot or a token within ``wait`` seconds fails.
+
+The state is stored under the hash of the cluster's connection credentials,
+so every process sharing the cache backend shares the limits.
+"""
+
+from contextlib import contextmanager
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+KEY_PREFIX = "gwm-limit"
+
+# Slots outlive any request, so they are only lost for this long when the
+# process holding one dies.
+SLOT_TIMEOUT = 120
+
+# Seconds between attempts to take a slot.
+POLL_INTERVAL = 0.05
+
+_local = threading.local()
+
+
+@contextmanager
+def background_requests():
+    """
+    Mark the RAPI requests the current thread sends within the block as
+    background traffic, which yields to interactive requests.
+    """
+    previous = getattr(_local, "background", False)
+    _local.background = True
+    try:
+        yield
+    finally:
+        _local.background = previous
+
+
+def is_background():
+    """
+    Whether the current thread is sending background requests.
+    """
+    return getattr(_local, "background", False)
+
+
+class RequestLimiter(object):
+    """
+    Request limits of one cluster, used by GanetiRapiClient.
+    """
+
+    def __init__(self, cluster_hash):
+        self.cluster_hash = cluster_hash
+
+    def _key(self, *names):
+        return ":".join([KEY_PREFIX, self.cluster_hash] +
+                        [str(name) for name in names])
+
+    def _share(self, amount, limits):
+        """
+        The part of a limit available to the current thread.
+        """
+        if is_background():
+            return max(int(amount * (1 - limits.get("reserved", 0))), 1)
+        return amount
+
+    def acquire(self, long_poll=False):
+        """
+        Wait until a request may be sent.
+
+        @param long_poll - whether the request is held open by ganeti, like
+        WaitForJobChange.  These take no slot; they would starve every other
+        request of them.
+        @returns the slot taken, True if the request takes none, or None if
+        the request may not be sent
+        """
+        limits = settings.RAPI_LIMITS
+        deadline = time.time() + limits.get("wait", 0)
+
+        if not self._spend_token(limits, deadline):
+            return None
+        if long_poll or limits.get("concurrency") is None:
+            return True
+        return self._take_slot(limits, deadline)
+
+    def release(self, slot):
+        """
+        Give back the slot taken for a request that completed.
+        """
+        if slot is not None and slot is not True:
+            cache.delete(slot)
+
+    def _spend_token(self, limits, deadline):
+        rate = limits.get("rate")
+        if rate is None:
+            return True
+
+        burst = limits.get("burst") or max(int(rate), 1)
+        period = float(burst) / rate
+        tokens = self._share(burst, limits)
+        while True:
+            now = time.time()
+            window = int(now / period)
+            key = self._key("tokens", window)
+            cache.add(key, 0, int(period) + 2)
+            try:
+                spent = cache.incr(key)
+            except ValueError:
+                # the bucket expired in between
+                spent = 1
+                cache.set(key, spent, int(period) + 2)
+            if spent <= tokens:
+                return True
+            # give the token back for requests which have more of the bucket
+            try:
+                cache.decr(key)
+            except ValueError:
+                pass
+
+            refill = (window + 1) * period
+            if refill > deadline:
+                return False
+            time.sleep(refill - now)
+
+    def _take_slot(self, limits, deadline):
+        slots = self._share(limits["concurrency"], limits)
+        while True:
+            # start at a random slot so processes don't all contend for the
+            # first ones
+            start = random.randrange(slots)
+            for i in range(slots):
+                key = self._key("slot", (start + i) % slots)
+                if cache.add(key, True, SLOT_TIMEOUT):
+                    return key
+            if time.time() + POLL_INTERVAL > deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
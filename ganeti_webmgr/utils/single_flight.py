@@ -0,0 +1,124 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+"""
+Coalescing of identical concurrent RAPI reads.
+
+Threads asking a cluster master for the same thing at the same time, for
+example several wizards listing its operating systems, share a single request
+to it: the first thread sends the request and the others wait for its
+result.  Every thread, including the one which sent the request, is given
+its own copy of the response, so callers may modify what they get back.
+
+Only requests in flight within a process are coalesced; the response cache
+shares responses between processes.
+"""
+
+from copy import deepcopy
+import threading
+
+
+class _Call(object):
+    """
+    A request in flight, and its outcome once it completes.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight(object):
+    """
+    Single-flight group of one cluster, used by GanetiRapiClient.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {
+            "calls": 0,
+            "coalesced": 0,
+        }
+
+    def do(self, key, func):
+        """
+        Call ``func``, unless a call with the same key is already in flight,
+        in which case wait for it and return a copy of its result.  Errors
+        raised by the call are raised in every waiting thread.
+
+        @param key - hashable arguments identifying the request
+        @param func - callable sending the request
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats["coalesced"] += 1
+                call.followers += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if leader:
+            return self._lead(key, call, func)
+        return self._follow(call)
+
+    def _lead(self, key, call, func):
+        """
+        Send the request, publishing its outcome to the waiting threads.
+        """
+        shared = False
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                # nobody joins the call anymore
+                shared = call.followers > 0
+            call.done.set()
+
+        # the published result is never handed out, so nobody modifies it
+        # while it is being copied
+        if shared:
+            return deepcopy(call.result)
+        return call.result
+
+    def _follow(self, call):
+        """
+        Wait for the request in flight and share its outcome.
+        """
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return deepcopy(call.result)
+
+    def stats(self):
+        """
+        Returns the number of reads sent through the group, and how many of
+        them were ``coalesced`` into a read already in flight.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(self._stats)
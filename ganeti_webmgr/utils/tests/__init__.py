@@ -1,6 +1,9 @@
+from .async_client import *
+from .client import *
 from .fields import *
 from .ganeti_errors import *
 from .models import *
+from .serialization import *
 from .ssh_keys import *
 from .utilities import *
 from .views import *
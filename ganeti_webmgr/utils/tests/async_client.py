@@ -0,0 +1,129 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+import simplejson as json
+
+from django.test import SimpleTestCase
+from twisted.internet import reactor
+from twisted.internet.threads import blockingCallFromThread
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+
+from ..async_client import AsyncGanetiRapiClient, gather, start_reactor
+from ..client import ClientError, GanetiApiError
+
+__all__ = (
+    "TestAsyncRapiClient",
+)
+
+
+class FakeRapi(Resource):
+    """
+    Minimal RAPI server answering a few GET requests.
+    """
+    isLeaf = True
+
+    def __init__(self):
+        Resource.__init__(self)
+        self.requests = []
+
+    def render_GET(self, request):
+        self.requests.append(request)
+        if request.path == "/2/info":
+            return json.dumps({"name": "cluster.example.bak"})
+        elif request.path == "/2/instances":
+            if request.args.get("bulk") == ["1"]:
+                return json.dumps([{"name": "vm1.example.bak"}])
+            return json.dumps([{"id": "vm1.example.bak"},
+                               {"id": "vm2.example.bak"}])
+        elif request.path == "/2/hang":
+            return NOT_DONE_YET
+        request.setResponseCode(404)
+        return ""
+
+
+class TestAsyncRapiClient(SimpleTestCase):
+    """
+    The asynchronous client talks to a real (local) HTTP server.
+    """
+
+    def setUp(self):
+        start_reactor()
+        self.rapi = FakeRapi()
+        self.port = blockingCallFromThread(reactor, reactor.listenTCP, 0,
+                                           Site(self.rapi),
+                                           interface="127.0.0.1")
+        self.client = AsyncGanetiRapiClient("127.0.0.1", timeout=5,
+                                            username="user",
+                                            password="secret")
+        self.client._base_url = "http://127.0.0.1:%s" % \
+            self.port.getHost().port
+
+    def tearDown(self):
+        blockingCallFromThread(reactor, self.port.stopListening)
+
+    def test_gather(self):
+        """
+        Results are returned in order, using the same decoding as the
+        synchronous client.
+        """
+        info, instances, bulk = gather([
+            self.client.GetInfo,
+            self.client.GetInstances,
+            lambda: self.client.GetInstances(bulk=True),
+        ])
+        self.assertEqual({"name": "cluster.example.bak"}, info)
+        self.assertEqual(["vm1.example.bak", "vm2.example.bak"], instances)
+        self.assertEqual([{"name": "vm1.example.bak"}], bulk)
+
+        request = self.rapi.requests[0]
+        self.assertEqual(("user", "secret"),
+                         (request.getUser(), request.getPassword()))
+
+    def test_errors(self):
+        """
+        Failed calls are returned as GanetiApiErrors with the HTTP code.
+        """
+        result, = gather([lambda: self.client.GetNode("missing")])
+        self.assertTrue(isinstance(result, GanetiApiError))
+        self.assertEqual(404, result.code)
+
+        result, = gather([lambda: self.client.CreateInstance()])
+        self.assertTrue(isinstance(result, ClientError))
+
+    def test_features(self):
+        """
+        Servers which don't know about features support none of them.
+        """
+        features, = gather([self.client.GetFeatures])
+        self.assertEqual([], features)
+
+        self.client._base_url = "http://127.0.0.1:1"
+        result, = gather([self.client.GetFeatures])
+        self.assertTrue(isinstance(result, GanetiApiError))
+
+    def test_timeout(self):
+        self.client.timeout = 0.2
+        result, = gather([lambda: self.client._SendRequest("get", "/2/hang")])
+        self.assertTrue(isinstance(result, GanetiApiError))
+        self.assertTrue(str(result).startswith("Timed out"))
+
+    def test_connection_refused(self):
+        self.client._base_url = "http://127.0.0.1:1"
+        result, = gather([self.client.GetInfo])
+        self.assertTrue(isinstance(result, GanetiApiError))
+        self.assertTrue(str(result).startswith("Couldn't connect"))
@@ -0,0 +1,689 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+import json
+import threading
+import time
+
+import requests
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
+
+from ganeti_webmgr.clusters.models import Cluster
+
+from .. import RAPI_CLIENTS, clear_rapi_cache, rapi_pool_stats
+from ..circuit_breaker import CircuitBreaker
+from ..client import GanetiRapiClient, GanetiApiError
+from ..client_registry import ClientRegistry
+from ..rapi_cache import ResponseCache, fresh_responses
+from ..rate_limit import RequestLimiter, background_requests, is_background
+from ..single_flight import SingleFlight
+
+__all__ = (
+    "TestRapiConnectionPool",
+    "TestResponseCache",
+    "TestCircuitBreaker",
+    "TestSingleFlight",
+    "TestClientRegistry",
+    "TestGetRapi",
+    "TestRequestLimiter",
+)
+
+
+class FakeResponse(object):
+
+    def __init__(self, content):
+        self.status_code = 200
+        self.content = json.dumps(content)
+
+
+class TestRapiConnectionPool(SimpleTestCase):
+    """
+    The RAPI client keeps a pooled session per cluster master.
+    """
+
+    def setUp(self):
+        self.client = GanetiRapiClient("ganeti.example.org", pool_size=4,
+                                       pool_idle_timeout=60)
+
+    def tearDown(self):
+        self.client.Close()
+
+    def test_session_reused(self):
+        session = self.client._GetSession()
+        self.assertTrue(session is self.client._GetSession())
+        self.assertEqual(self.client.GetPoolStats()["resets"], 0)
+
+    def test_session_per_thread(self):
+        """
+        Threads have their own sessions sharing one pool of connections.
+        """
+        session = self.client._GetSession()
+        sessions = []
+        thread = threading.Thread(
+            target=lambda: sessions.append(self.client._GetSession()))
+        thread.start()
+        thread.join()
+        self.assertFalse(session is sessions[0])
+        self.assertTrue(session.get_adapter("https://ganeti.example.org")
+                        is sessions[0].get_adapter("https://ganeti."
+                                                   "example.org"))
+
+    def test_idle_session_evicted(self):
+        session = self.client._GetSession()
+        self.client._last_used -= 61
+        self.assertFalse(session is self.client._GetSession())
+        self.assertEqual(self.client.GetPoolStats()["resets"], 1)
+
+    def test_idle_eviction_disabled(self):
+        self.client.pool_idle_timeout = None
+        session = self.client._GetSession()
+        self.client._last_used -= 3600
+        self.assertTrue(session is self.client._GetSession())
+
+    def test_pool_stats(self):
+        self.client._GetSession()
+        pool = self.client._adapter.poolmanager.connection_from_url(
+            self.client._base_url)
+
+        # first request opens a connection, the second one reuses it
+        pool.num_connections = 1
+        self.client._RecordPoolUsage()
+        self.client._RecordPoolUsage()
+
+        stats = self.client.GetPoolStats()
+        self.assertEqual(stats["requests"], 2)
+        self.assertEqual(stats["new_connections"], 1)
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["resets"], 0)
+        self.assertEqual(stats["pool_size"], 4)
+
+    def test_connection_error_resets_pool(self):
+        session = self.client._GetSession()
+
+        def fail(*args, **kwargs):
+            raise requests.ConnectionError()
+        session.request = fail
+
+        self.assertRaises(GanetiApiError, self.client.GetInfo)
+        self.assertEqual(self.client.GetPoolStats()["resets"], 1)
+        self.assertFalse(session is self.client._GetSession())
+
+
+class TestResponseCache(SimpleTestCase):
+    """
+    Read-only requests are answered from Django's cache until the client
+    submits a job.
+    """
+
+    def setUp(self):
+        self.ttl = override_settings(
+            RAPI_RESPONSE_CACHE_TTL={"GetInfo": 60, "GetNodes": 60})
+        self.ttl.enable()
+        cache.clear()
+        self.client = GanetiRapiClient(
+            "ganeti.example.org", response_cache=ResponseCache("hash"))
+        self.requests = []
+
+        def request(method, url, **kwargs):
+            self.requests.append((method, url))
+            return FakeResponse(len(self.requests))
+        self.client._GetSession().request = request
+
+    def tearDown(self):
+        self.client.Close()
+        self.ttl.disable()
+
+    def test_cached(self):
+        self.assertEqual(1, self.client.GetInfo())
+        self.assertEqual(1, self.client.GetInfo())
+        self.assertEqual(1, len(self.requests))
+
+    def test_shared(self):
+        """
+        Clients of the same cluster share responses, other clusters don't.
+        """
+        self.client.GetInfo()
+        other = GanetiRapiClient("ganeti.example.org",
+                                 response_cache=ResponseCache("hash"))
+        other._GetSession().request = self.client._GetSession().request
+        self.assertEqual(1, other.GetInfo())
+
+        other.response_cache = ResponseCache("other")
+        self.assertEqual(2, other.GetInfo())
+        other.Close()
+
+    def test_arguments(self):
+        """
+        Requests with different arguments are cached separately.
+        """
+        self.client.GetNodes(bulk=True)
+        self.client.GetNodes(bulk=True)
+        self.assertEqual(1, len(self.requests))
+        self.client._CachedRequest("GetNodes", "/2/nodes", {"bulk": 0})
+        self.assertEqual(2, len(self.requests))
+
+    def test_uncached_method(self):
+        self.client.GetOperatingSystems()
+        self.client.GetOperatingSystems()
+        self.assertEqual(2, len(self.requests))
+
+    def test_invalidated_by_job(self):
+        self.client.GetInfo()
+        self.client.StartupInstance("instance.example.org")
+        self.assertEqual(3, self.client.GetInfo())
+
+    def test_invalidated_after_job(self):
+        """
+        Responses cached while a job is submitted are dropped once it is.
+        """
+        request = self.client._GetSession().request
+
+        def submit(method, url, **kwargs):
+            if method != "get":
+                # a concurrent read of the cluster before the job
+                self.client.GetInfo()
+            return request(method, url, **kwargs)
+        self.client._GetSession().request = submit
+
+        self.client.StartupInstance("instance.example.org")
+        self.assertEqual(3, self.client.GetInfo())
+
+    def test_query_does_not_invalidate(self):
+        self.client.GetInfo()
+        self.client.Query("node", ["name"])
+        self.assertEqual(1, self.client.GetInfo())
+
+    def test_fresh(self):
+        """
+        Fresh requests reach ganeti, and later requests see their response.
+        """
+        self.assertEqual(1, self.client.GetInfo())
+        with fresh_responses():
+            self.assertEqual(2, self.client.GetInfo())
+        self.assertEqual(2, self.client.GetInfo())
+        self.assertEqual(2, len(self.requests))
+
+    def test_disabled(self):
+        self.client.response_cache = None
+        self.client.GetInfo()
+        self.client.GetInfo()
+        self.assertEqual(2, len(self.requests))
+
+
+class TestCircuitBreaker(SimpleTestCase):
+    """
+    Requests to a master which couldn't be reached fail fast until a probe
+    reaches it again.
+    """
+
+    def setUp(self):
+        self.breaker_settings = override_settings(
+            RAPI_CIRCUIT_BREAKER_THRESHOLD=2,
+            RAPI_CIRCUIT_BREAKER_COOLDOWN=30)
+        self.breaker_settings.enable()
+        cache.clear()
+        self.requests = []
+        self.down = True
+        self.client = self.create_client()
+
+    def tearDown(self):
+        self.client.Close()
+        self.breaker_settings.disable()
+
+    def create_client(self):
+        client = GanetiRapiClient("ganeti.example.org",
+                                  circuit_breaker=CircuitBreaker("hash"))
+        client._GetSession = lambda: self
+        return client
+
+    def request(self, method, url, **kwargs):
+        self.requests.append(url)
+        if self.down:
+            raise requests.ConnectionError()
+        return FakeResponse(len(self.requests))
+
+    def cool_down(self):
+        key = "gwm-breaker:hash:opened"
+        cache.set(key, cache.get(key) - 31)
+
+    def test_opens(self):
+        """
+        Once the threshold is reached no requests are sent, by any client of
+        the cluster.
+        """
+        self.assertRaises(GanetiApiError, self.client.GetInfo)
+        self.assertRaises(GanetiApiError, self.client.GetInfo)
+        self.assertRaises(GanetiApiError, self.client.GetInfo)
+        self.assertEqual(2, len(self.requests))
+        self.assertRaises(GanetiApiError, self.create_client().GetInfo)
+        self.assertEqual(2, len(self.requests))
+
+    def test_success_resets(self):
+        """
+        Only failures in a row open the breaker.
+        """
+        self.assertRaises(GanetiApiError, self.client.GetInfo)
+        self.down = False
+        self.client.GetInfo()
+        self.down = True
+        self.assertRaises(GanetiApiError, self.client.GetInfo)
+        self.assertTrue(self.client.circuit_breaker.opened() is None)
+
+    def test_probe(self):
+        """
+        After the cool-down a single request probes the master.
+        """
+        for i in range(2):
+            self.assertRaises(GanetiApiError, self.client.GetInfo)
+        self.cool_down()
+
+        # the probe fails; the breaker opens again
+        self.assertRaises(GanetiApiError, self.client.GetInfo)
+        self.assertEqual(3, len(self.requests))
+        self.assertRaises(GanetiApiError, self.client.GetInfo)
+        self.assertEqual(3, len(self.requests))
+
+        self.cool_down()
+        breaker = CircuitBreaker("hash")
+        self.assertTrue(breaker.allow())
+        self.assertFalse(CircuitBreaker("hash").allow())
+        breaker.success()
+
+        self.down = False
+        self.assertEqual(4, self.client.GetInfo())
+        self.assertTrue(self.client.circuit_breaker.opened() is None)
+
+    def test_probe_after_failures_expired(self):
+        """
+        A successful probe closes the breaker even once the count of
+        failures which opened it has expired.
+        """
+        for i in range(2):
+            self.assertRaises(GanetiApiError, self.client.GetInfo)
+        self.cool_down()
+        cache.delete("gwm-breaker:hash:failures")
+
+        self.down = False
+        self.client.GetInfo()
+        self.assertTrue(self.client.circuit_breaker.opened() is None)
+        self.assertTrue(CircuitBreaker("hash").allow())
+
+
+    def test_probe_limited(self):
+        """
+        A probe which the request limits keep from being sent leaves the
+        probing to the next request.
+        """
+        for i in range(2):
+            self.assertRaises(GanetiApiError, self.client.GetInfo)
+        self.cool_down()
+
+        self.client.limiter = RequestLimiter("hash")
+        with self.settings(RAPI_LIMITS={"concurrency": 1, "wait": 0}):
+            slot = RequestLimiter("hash").acquire()
+            self.assertRaises(GanetiApiError, self.client.GetInfo)
+            self.assertEqual(2, len(self.requests))
+            self.client.limiter.release(slot)
+
+            self.down = False
+            self.client.GetInfo()
+        self.assertTrue(self.client.circuit_breaker.opened() is None)
+
+
+class TestSingleFlight(SimpleTestCase):
+    """
+    Identical GETs sent concurrently share a single request.
+    """
+
+    def setUp(self):
+        self.client = GanetiRapiClient("ganeti.example.org",
+                                       single_flight=SingleFlight())
+        self.client._GetSession = lambda: self
+        self.requests = []
+        self.release = threading.Event()
+        self.error = None
+
+    def tearDown(self):
+        self.release.set()
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url))
+        self.release.wait()
+        if self.error:
+            raise self.error
+        return FakeResponse({"requests": len(self.requests)})
+
+    def concurrently(self, func, count=4):
+        """
+        Call a function from several threads at once, returning what each
+        returned or raised once the request they are waiting on completes.
+        """
+        results = []
+
+        def call():
+            try:
+                results.append(func())
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=call) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        # wait for every thread to send a request or join one in flight
+        for i in range(500):
+            coalesced = self.client.GetPoolStats()["coalesced"]
+            if coalesced + len(self.requests) == count:
+                break
+            time.sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.release.clear()
+        return results
+
+    def test_coalesced(self):
+        results = self.concurrently(self.client.GetInfo)
+        self.assertEqual([{"requests": 1}] * 4, results)
+        self.assertEqual(1, len(self.requests))
+        self.assertEqual(3, self.client.GetPoolStats()["coalesced"])
+
+        # every thread gets its own copy of the response
+        self.assertEqual(4, len(set(id(result) for result in results)))
+
+        # requests which completed are not shared
+        self.release.set()
+        self.assertEqual({"requests": 2}, self.client.GetInfo())
+
+    def test_copies(self):
+        """
+        The thread which sent a shared request gets a copy of the response
+        too, so it can't modify it while the other threads copy it.
+        """
+        response = {"requests": 1}
+
+        def func():
+            self.requests.append(func)
+            self.release.wait()
+            return response
+
+        results = self.concurrently(
+            lambda: self.client.single_flight.do("key", func))
+        self.assertEqual([response] * 4, results)
+        self.assertFalse(any(result is response for result in results))
+
+        # a request which wasn't shared needs no copy
+        self.release.set()
+        self.assertTrue(self.client.single_flight.do("key", func)
+                        is response)
+
+    def test_arguments(self):
+        """
+        Only identical requests are coalesced.
+        """
+        self.release.set()
+        self.client.GetInstance("foo")
+        self.client.GetInstance("bar")
+        self.assertEqual(2, len(self.requests))
+        self.assertEqual(0, self.client.GetPoolStats()["coalesced"])
+
+    def test_error(self):
+        """
+        Errors are raised in every thread waiting on the request.
+        """
+        self.error = requests.ConnectionError()
+        results = self.concurrently(self.client.GetInfo)
+        self.assertEqual(1, len(self.requests))
+        self.assertEqual(4, len(results))
+        for result in results:
+            self.assertTrue(isinstance(result, GanetiApiError))
+
+    def test_writes_not_coalesced(self):
+        results = self.concurrently(lambda: self.client.AddClusterTags(["a"]),
+                                    count=2)
+        self.assertEqual(2, len(self.requests))
+        self.assertEqual(2, len(results))
+        self.assertEqual(0, self.client.GetPoolStats()["coalesced"])
+
+
+class FakeClient(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def Close(self):
+        self.closed = True
+
+    def GetPoolStats(self):
+        return {"name": self.name}
+
+
+class TestClientRegistry(SimpleTestCase):
+    """
+    RAPI clients are kept per cluster hash, up to a bounded number of them.
+    """
+
+    def setUp(self):
+        self.limits = override_settings(RAPI_CLIENT_CACHE_SIZE=2,
+                                        RAPI_CLIENT_CACHE_TTL=60)
+        self.limits.enable()
+        self.registry = ClientRegistry()
+
+    def tearDown(self):
+        self.limits.disable()
+
+    def add(self, cluster_id, hash):
+        return self.registry.add(cluster_id, hash, lambda: FakeClient(hash))
+
+    def test_add(self):
+        self.assertTrue(self.registry.get("a") is None)
+        client = self.add(1, "a")
+        self.assertTrue(client is self.registry.get("a"))
+        self.assertTrue(client is self.add(1, "a"))
+        self.assertEqual({1: client}, self.registry.clients())
+
+    def test_changed_hash(self):
+        """
+        A client made with old credentials is dropped.
+        """
+        old = self.add(1, "a")
+        new = self.add(1, "b")
+        self.assertTrue(old.closed)
+        self.assertTrue(self.registry.get("a") is None)
+        self.assertEqual({1: new}, self.registry.clients())
+
+    def test_lru(self):
+        """
+        The least recently used client is dropped first.
+        """
+        a = self.add(1, "a")
+        b = self.add(2, "b")
+        self.registry.get("a")
+        c = self.add(3, "c")
+        self.assertTrue(b.closed)
+        self.assertFalse(a.closed)
+        self.assertEqual({1: a, 3: c}, self.registry.clients())
+
+    def test_ttl(self):
+        a = self.add(1, "a")
+        b = self.add(2, "b")
+        self.registry._entries["a"].last_used -= 61
+        self.assertTrue(b is self.registry.get("b"))
+        self.assertTrue(a.closed)
+        self.assertTrue(self.registry.get("a") is None)
+
+    def test_ttl_disabled(self):
+        with self.settings(RAPI_CLIENT_CACHE_TTL=None):
+            a = self.add(1, "a")
+            self.registry._entries["a"].last_used -= 3600
+            self.assertTrue(a is self.registry.get("a"))
+
+    def test_invalidate(self):
+        a = self.add(1, "a")
+        self.registry.invalidate(1, "a")
+        self.assertFalse(a.closed)
+        self.registry.invalidate(1, "b")
+        self.assertTrue(a.closed)
+        self.assertEqual({}, self.registry.clients())
+
+    def test_clear(self):
+        a = self.add(1, "a")
+        b = self.add(2, "b")
+        self.registry.clear()
+        self.assertTrue(a.closed and b.closed)
+        self.assertEqual({}, self.registry.clients())
+
+    def test_threads(self):
+        """
+        Threads asking for the same cluster at once share one client.
+        """
+        clients = []
+
+        def add():
+            for i in range(100):
+                clients.append(self.add(1, "a"))
+
+        threads = [threading.Thread(target=add) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, len(set(clients)))
+
+
+class TestGetRapi(TestCase):
+    """
+    Clusters drop their cached RAPI clients when they change or go away.
+    """
+
+    def setUp(self):
+        clear_rapi_cache()
+        self.cluster = Cluster.objects.create(hostname="test.example.org",
+                                              slug="test")
+
+    def tearDown(self):
+        clear_rapi_cache()
+
+    def test_cached(self):
+        rapi = self.cluster.rapi
+        self.assertTrue(rapi is Cluster.objects.get(pk=self.cluster.pk).rapi)
+        self.assertEqual([self.cluster.pk], rapi_pool_stats().keys())
+
+    def test_changed_credentials(self):
+        rapi = self.cluster.rapi
+        self.cluster.save()
+        self.assertTrue(rapi is self.cluster.rapi)
+
+        self.cluster.port = 5081
+        self.cluster.save()
+        self.assertEqual({}, RAPI_CLIENTS.clients())
+        self.assertFalse(rapi is self.cluster.rapi)
+
+    def test_deleted(self):
+        self.cluster.rapi
+        self.cluster.delete()
+        self.assertEqual({}, RAPI_CLIENTS.clients())
+
+
+class TestRequestLimiter(SimpleTestCase):
+    """
+    Requests to a master are limited in number at once and per second, with
+    part of both kept for interactive requests.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.limiter = RequestLimiter("hash")
+
+    def limits(self, **limits):
+        limits.setdefault("wait", 0)
+        return self.settings(RAPI_LIMITS=limits)
+
+    def test_concurrency(self):
+        with self.limits(concurrency=2):
+            slots = [self.limiter.acquire(), self.limiter.acquire()]
+            self.assertTrue(all(slots))
+            self.assertTrue(RequestLimiter("hash").acquire() is None)
+            self.limiter.release(slots[0])
+            self.assertTrue(self.limiter.acquire())
+
+    def test_long_poll(self):
+        """
+        Requests held open by ganeti take no slot.
+        """
+        with self.limits(concurrency=1):
+            self.assertTrue(self.limiter.acquire())
+            self.assertTrue(self.limiter.acquire(long_poll=True) is True)
+
+    def test_rate(self):
+        # the bucket is refilled every 200 seconds
+        with self.limits(rate=0.01, burst=2):
+            self.assertTrue(self.limiter.acquire())
+            self.assertTrue(self.limiter.acquire())
+            self.assertTrue(self.limiter.acquire() is None)
+
+    def test_unlimited(self):
+        with self.limits():
+            for i in range(10):
+                self.assertTrue(self.limiter.acquire() is True)
+
+    def test_background(self):
+        """
+        Background requests leave the reserved part of the limits to
+        interactive requests.
+        """
+        with self.limits(concurrency=4, rate=0.01, burst=8, reserved=0.25):
+            with background_requests():
+                self.assertTrue(is_background())
+                for i in range(3):
+                    self.assertTrue(self.limiter.acquire())
+                self.assertTrue(self.limiter.acquire() is None)
+            self.assertFalse(is_background())
+            self.assertTrue(self.limiter.acquire())
+
+            cache.clear()
+            with background_requests():
+                for i in range(6):
+                    self.assertTrue(self.limiter.acquire(long_poll=True))
+                self.assertTrue(self.limiter.acquire(long_poll=True) is None)
+            self.assertTrue(self.limiter.acquire(long_poll=True))
+
+    def test_client(self):
+        """
+        The client fails requests which may not be sent, and gives back its
+        slot once a request completes.
+        """
+        client = GanetiRapiClient("ganeti.example.org", limiter=self.limiter)
+        session = client._GetSession()
+        session.request = lambda method, url, **kwargs: FakeResponse(1)
+
+        with self.limits(concurrency=1):
+            self.assertEqual(1, client.GetInfo())
+            self.assertEqual(1, client.GetInfo())
+
+            slot = RequestLimiter("hash").acquire()
+            self.assertRaises(GanetiApiError, client.GetInfo)
+            self.limiter.release(slot)
+
+            def fail(*args, **kwargs):
+                raise requests.ConnectionError()
+            session.request = fail
+            self.assertRaises(GanetiApiError, client.GetInfo)
+            self.assertTrue(self.limiter.acquire())
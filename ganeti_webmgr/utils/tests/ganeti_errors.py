@@ -20,7 +20,10 @@ from datetime import datetime
 from django.test import TestCase
 from django.test.client import Client
 
+from django.contrib.contenttypes.models import ContentType
+
 from ..client import GanetiApiError
+from ..error_sink import ErrorSink, error_sink
 from ..proxy import RapiProxy, CallProxy
 
 from django.contrib.auth.models import User
@@ -29,7 +32,7 @@ from ganeti_webmgr.virtualmachines.models import VirtualMachine
 from ganeti_webmgr.clusters.models import Cluster
 from ..models import GanetiError
 
-__all__ = ('TestGanetiErrorModel', 'TestErrorViews')
+__all__ = ('TestGanetiErrorModel', 'TestErrorSink', 'TestErrorViews')
 
 
 class TestGanetiErrorBase():
@@ -324,6 +327,125 @@ class TestGanetiErrorModel(TestGanetiErrorBase, TestCase):
             self.assertEqual(None, i.error)
 
 
+class TestErrorSink(TestGanetiErrorBase, TestCase):
+    """
+    Tests for buffering errors with ErrorSink.
+    """
+
+    def setUp(self):
+        super(TestErrorSink, self).setUp()
+        self.cluster = Cluster.objects.create(hostname="test0",
+                                              slug="OSL_TEST0")
+        self.vms = [VirtualMachine.objects.create(cluster=self.cluster,
+                                                  hostname="vm%d.test.org" % i)
+                    for i in range(5)]
+
+    def test_store(self):
+        """
+        Errors are written when the block ends, each only once, in one query
+        finding the stored errors and one inserting the new ones.
+        """
+        GanetiError.store_error("stored", obj=self.vms[0], code=500)
+
+        with ErrorSink() as sink:
+            self.assertEqual(sink, error_sink())
+            for i in range(3):
+                for vm in self.vms:
+                    error_sink().store("stored", vm, 500)
+            self.assertEqual(1, GanetiError.objects.count())
+            self.assertNumQueries(2, sink.flush)
+
+        self.assertNotEqual(sink, error_sink())
+        for vm in self.vms:
+            self.assertEqual(1, GanetiError.objects.get_errors(vm).count())
+
+        # errors stored again are not repeated
+        with ErrorSink():
+            error_sink().store("stored", self.vms[0], 500)
+        self.assertEqual(5, GanetiError.objects.count())
+
+    def test_specified_code_values(self):
+        """
+        401 errors are stored on the cluster, and 404 errors of a cluster
+        cover those of its virtual machines.
+        """
+        with ErrorSink():
+            for vm in self.vms:
+                error_sink().store("denied", vm, 401)
+        errors = GanetiError.objects.get_errors(self.cluster)
+        self.assertEqual(1, errors.count())
+        self.assertEqual(self.cluster, errors[0].obj)
+
+        GanetiError.objects.all().delete()
+        with ErrorSink():
+            error_sink().store("missing", self.cluster, 404)
+            for vm in self.vms:
+                error_sink().store("missing", vm, 404)
+        self.assertEqual(1, GanetiError.objects.count())
+
+        with ErrorSink():
+            error_sink().store("missing", self.vms[0], 404)
+        self.assertEqual(1, GanetiError.objects.count())
+
+        # once the cluster's error is cleared it no longer covers them
+        GanetiError.objects.clear_errors(self.cluster)
+        with ErrorSink():
+            error_sink().store("missing", self.vms[0], 404)
+        self.assertEqual(2, GanetiError.objects.count())
+
+    def test_clear(self):
+        """
+        Clearing errors clears those already stored and discards those
+        buffered before.
+        """
+        for vm in self.vms[:2]:
+            GanetiError.store_error("old", obj=vm, code=500)
+        GanetiError.store_error("old", obj=self.cluster, code=500)
+
+        ct = ContentType.objects.get_for_model(VirtualMachine)
+        with ErrorSink():
+            for vm in self.vms:
+                error_sink().store("new", vm, 500)
+            error_sink().clear(self.vms[0])
+            error_sink().clear_objects(self.cluster.pk, ct.pk,
+                                       [vm.pk for vm in self.vms[1:3]])
+
+        uncleared = GanetiError.objects.filter(cleared=False)
+        self.assertEqual(set(["new"]),
+                         set(uncleared.filter(obj_type=ct)
+                             .values_list("msg", flat=True)))
+        self.assertEqual(set(vm.pk for vm in self.vms[3:]),
+                         set(uncleared.filter(obj_type=ct)
+                             .values_list("obj_id", flat=True)))
+        self.assertEqual(1, uncleared.get_errors(self.cluster)
+                         .filter(obj_id=self.cluster.pk).count())
+
+        # clearing the cluster clears every one of its errors
+        with ErrorSink():
+            error_sink().store("new", self.vms[0], 500)
+            error_sink().clear(self.cluster)
+        self.assertFalse(GanetiError.objects.filter(cleared=False).exists())
+
+    def test_refresh_error(self):
+        """
+        Errors of refreshes are buffered by the sink.
+        """
+        RapiProxy.error = GanetiApiError("Simulating an error", 777)
+        vm = self.create_model(VirtualMachine, cluster=self.cluster,
+                               hostname="vm.test.org")
+
+        with ErrorSink():
+            vm.refresh()
+            self.assertFalse(GanetiError.objects.exists())
+        self.assertEqual(1, GanetiError.objects.get_errors(vm).count())
+
+        RapiProxy.error = None
+        with ErrorSink():
+            vm.refresh()
+            self.assertEqual(None, vm.error)
+        self.assertFalse(GanetiError.objects.filter(cleared=False).exists())
+
+
 class TestErrorViews(TestGanetiErrorBase, TestCase):
 
     def setUp(self):
@@ -0,0 +1,73 @@
+# Copyright (C) 2012 Oregon State University et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301,
+# USA.
+
+import cPickle
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from ganeti_webmgr.clusters.models import Cluster
+from ganeti_webmgr.utils import serialization
+from ganeti_webmgr.utils.proxy.constants import INSTANCE
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
+
+__all__ = (
+    "TestSerialization",
+)
+
+
+class TestSerialization(TestCase):
+
+    def test_round_trip(self):
+        """
+        Every format reads back what it wrote, whatever the current setting.
+        """
+        for name in serialization.SERIALIZERS:
+            with override_settings(SERIALIZED_INFO_FORMAT=name):
+                data = serialization.dumps(INSTANCE)
+            self.assertEqual(INSTANCE, serialization.loads(data))
+
+    def test_legacy_pickle(self):
+        self.assertEqual(INSTANCE,
+                         serialization.loads(cPickle.dumps(INSTANCE)))
+
+    def test_compressed_is_smaller(self):
+        pickled = serialization.get_serializer("pickle").dumps(INSTANCE)
+        compressed = serialization.get_serializer("zjson").dumps(INSTANCE)
+        self.assertTrue(len(compressed) < len(pickled))
+
+    def test_rewrite_serialized_info(self):
+        """
+        Rows are rewritten in batches, with extra values from the callback.
+        """
+        cluster = Cluster.objects.create(hostname="test.example.bak",
+                                         slug="test")
+        for i in range(3):
+            VirtualMachine.objects.create(
+                cluster=cluster, hostname="vm%d.example.bak" % i,
+                serialized_info=cPickle.dumps(INSTANCE))
+
+        serialization.rewrite_serialized_info(
+            VirtualMachine, "json", batch_size=2,
+            callback=lambda info: {"oper_state": info["oper_state"]})
+
+        values = VirtualMachine.objects.values_list("serialized_info",
+                                                    "oper_state")
+        for data, oper_state in values:
+            self.assertTrue(data.startswith("json:"))
+            self.assertEqual(INSTANCE, serialization.loads(data))
+            self.assertEqual(INSTANCE["oper_state"], oper_state)
@@ -1,5 +1,6 @@
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
 from django.conf import settings
 
 from ganeti_webmgr.clusters.models import CachedClusterObject
@@ -52,6 +53,11 @@ class VirtualMachine(CachedClusterObject):
     operating_system = models.CharField(max_length=128)
     status = models.CharField(max_length=14)
 
+    # copies of the info fields list views need, so they never have to load
+    # serialized_info
+    admin_state = models.BooleanField(default=False)
+    oper_state = models.BooleanField(default=False)
+
     # node relations
     primary_node = models.ForeignKey('nodes.Node', related_name='primary_vms',
                                      null=True, blank=True)
@@ -142,10 +148,14 @@ class VirtualMachine(CachedClusterObject):
         return self.status == 'running'
 
     @classmethod
-    def parse_persistent_info(cls, info):
+    def parse_persistent_info(cls, info, nodes=None):
         """
         Loads all values from cached info, included persistent properties that
         are stored in the database
+
+        @param nodes - optional dict mapping node hostnames to Node ids.  When
+        given, node relations are resolved from it (as primary_node_id and
+        secondary_node_id) instead of being queried one at a time.
         """
         from ganeti_webmgr.nodes.models import Node
         data = super(VirtualMachine, cls).parse_persistent_info(info)
@@ -160,6 +170,15 @@ class VirtualMachine(CachedClusterObject):
         data['disk_size'] = disk_size
         data['operating_system'] = info['os']
         data['status'] = info['status']
+        data['admin_state'] = info['admin_state']
+        data['oper_state'] = info['oper_state']
+
+        if nodes is not None:
+            secondary = info['snodes']
+            data['primary_node_id'] = nodes.get(info['pnode'])
+            data['secondary_node_id'] = \
+                nodes.get(secondary[0]) if secondary else None
+            return data
 
         primary = info['pnode']
         if primary:
@@ -333,3 +352,175 @@ class VirtualMachine(CachedClusterObject):
 
     def __repr__(self):
         return "<VirtualMachine: '%s'>" % self.hostname
+
+
+# VirtualMachine fields read by count_resources()
+COUNTED_FIELDS = ('owner', 'status', 'ram', 'disk_size', 'virtual_cpus')
+
+
+def count_resources(vms):
+    """
+    Sum up the resources of VirtualMachines per owner.
+
+    @param vms - tuples of the COUNTED_FIELDS of each VM
+    @returns dict of owner id to a dict of the ResourceSummary.FIELDS
+    """
+    counted = {}
+    for owner_id, status, ram, disk, virtual_cpus in vms:
+        totals = counted.get(owner_id)
+        if totals is None:
+            totals = counted[owner_id] = dict.fromkeys(ResourceSummary.FIELDS,
+                                                       0)
+        running = status == 'running'
+        totals['total'] += 1
+        totals['running'] += running
+        # VMs whose info was never retrieved don't use any resources
+        if (ram, disk, virtual_cpus) == (-1, -1, -1):
+            continue
+        totals['disk'] += disk
+        if running:
+            totals['ram'] += ram
+            totals['virtual_cpus'] += virtual_cpus
+    return counted
+
+
+class ResourceSummary(models.Model):
+    """
+    Totals of the VirtualMachines of one owner on one cluster.  VMs without
+    an owner are counted in the cluster's summary with no owner.
+
+    Summaries are adjusted whenever one of their VMs is saved or deleted, and
+    recounted when VMs are synchronized in bulk, so pages listing resources
+    per cluster read a few rows instead of aggregating the whole
+    VirtualMachine table.  Like ClusterUser.used_resources(), ``ram`` and
+    ``virtual_cpus`` only include running VMs and ``disk`` includes all of
+    them.
+    """
+    cluster = models.ForeignKey('clusters.Cluster',
+                                related_name='resource_summaries')
+    owner = models.ForeignKey('authentication.ClusterUser',
+                              related_name='resource_summaries', null=True)
+    total = models.IntegerField(default=0)
+    running = models.IntegerField(default=0)
+    ram = models.IntegerField(default=0)
+    disk = models.IntegerField(default=0)
+    virtual_cpus = models.IntegerField(default=0)
+
+    FIELDS = ('total', 'running', 'ram', 'disk', 'virtual_cpus')
+
+    class Meta:
+        # NULLs never collide, so the summaries of VMs without an owner are
+        # merged by recount() instead
+        unique_together = (('cluster', 'owner'),)
+
+    def used(self):
+        """
+        Resources used, in the format of ClusterUser.used_resources().
+        """
+        return dict(ram=self.ram, disk=self.disk,
+                    virtual_cpus=self.virtual_cpus)
+
+    @classmethod
+    def counted(cls, vm):
+        """
+        The totals a VirtualMachine adds to the summary of its owner.
+        """
+        vms = [(vm.owner_id, vm.status, vm.ram, vm.disk_size,
+                vm.virtual_cpus)]
+        return count_resources(vms)[vm.owner_id]
+
+    @classmethod
+    def adjust(cls, cluster_id, owner_id, changes):
+        """
+        Add changes to the totals of a summary.
+
+        The summary is created when the first VM of an owner is added, and
+        deleted when the last one is subtracted.
+
+        @param changes - dict of the ResourceSummary.FIELDS to the amount
+        each of them changes by, see counted()
+        """
+        summaries = cls.objects.filter(cluster=cluster_id, owner=owner_id)
+        updates = dict((f, F(f) + v) for f, v in changes.items() if v)
+        updated = summaries.update(**updates)
+        if changes['total'] > 0 and not updated:
+            if not cls._create(cluster_id, owner_id, changes):
+                # created by a concurrent save in between
+                summaries.update(**updates)
+            elif owner_id is None:
+                cls.recount(cluster_id, [None])
+        elif changes['total'] < 0:
+            summaries.filter(total__lte=0).delete()
+
+    @classmethod
+    def _create(cls, cluster_id, owner_id, totals):
+        """
+        Create a summary, unless one was created concurrently.
+
+        @returns whether the summary was created
+        """
+        sid = transaction.savepoint()
+        try:
+            cls.objects.create(cluster_id=cluster_id, owner_id=owner_id,
+                               **totals)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            return False
+        transaction.savepoint_commit(sid)
+        return True
+
+    @classmethod
+    def recount(cls, cluster_id, owner_ids=None):
+        """
+        Rebuild the summaries of a cluster from its VirtualMachines.
+
+        @param cluster_id - id of the cluster
+        @param owner_ids - ids of the owners whose summaries are rebuilt,
+        None standing for VMs without an owner.  All summaries of the
+        cluster are rebuilt if not given.
+        """
+        vms = VirtualMachine.objects.filter(cluster=cluster_id).order_by()
+        summaries = cls.objects.filter(cluster=cluster_id)
+        if owner_ids is not None:
+            owner_ids = set(owner_ids)
+            q = Q(owner__in=owner_ids - set([None]))
+            if None in owner_ids:
+                q |= Q(owner=None)
+            vms = vms.filter(q)
+            summaries = summaries.filter(q)
+
+        counted = count_resources(vms.values_list(*COUNTED_FIELDS))
+
+        # Rows are updated in place rather than replaced, so readers never
+        # miss a summary while it is recounted.
+        stale = []
+        for summary in summaries:
+            totals = counted.pop(summary.owner_id, None)
+            if totals is None:
+                # the owner has no VMs left, or this row is a duplicate
+                # summary of VMs without an owner
+                stale.append(summary.pk)
+                continue
+            if any(getattr(summary, f) != v for f, v in totals.items()):
+                cls.objects.filter(pk=summary.pk).update(**totals)
+            counted[summary.owner_id] = None
+
+        if stale:
+            cls.objects.filter(pk__in=stale).delete()
+        counted = dict((owner_id, totals)
+                       for owner_id, totals in counted.items()
+                       if totals is not None)
+        sid = transaction.savepoint()
+        try:
+            cls.objects.bulk_create([
+                cls(cluster_id=cluster_id, owner_id=owner_id, **totals)
+                for owner_id, totals in counted.items()])
+        except IntegrityError:
+            # some were created by a concurrent save in between
+            transaction.savepoint_rollback(sid)
+            for owner_id, totals in counted.items():
+                if not cls._create(cluster_id, owner_id, totals):
+                    cls.objects.filter(cluster=cluster_id, owner=owner_id) \
+                        .update(**totals)
+        else:
+            transaction.savepoint_commit(sid)
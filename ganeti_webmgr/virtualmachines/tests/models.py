@@ -19,11 +19,15 @@
 from datetime import datetime
 
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.db.models import F
+from django.db.models.query import QuerySet
 
 from ganeti_webmgr.utils.proxy.constants import (INSTANCE, JOB, JOB_RUNNING,
                                                  JOB_DELETE_SUCCESS)
 
-from ganeti_webmgr.virtualmachines.models import VirtualMachine
+from ganeti_webmgr.virtualmachines.models import (ResourceSummary,
+                                                  VirtualMachine)
 from ganeti_webmgr.clusters.models import Cluster
 from ganeti_webmgr.authentication.models import ClusterUser
 from ganeti_webmgr.jobs.models import Job
@@ -32,6 +36,7 @@ from ganeti_webmgr.ganeti_web import constants
 
 
 __all__ = (
+    'TestResourceSummary',
     'TestVirtualMachineModel',
     'VirtualMachineTestCaseMixin',
 )
@@ -305,3 +310,149 @@ class TestVirtualMachineModel(TestCase, VirtualMachineTestCaseMixin):
 
         job.delete()
         cluster.delete()
+
+
+class TestResourceSummary(TestCase, VirtualMachineTestCaseMixin):
+
+    def setUp(self):
+        self.vm, self.cluster = self.create_virtual_machine()
+        self.owner = ClusterUser.objects.create(name='owner')
+        self.other = ClusterUser.objects.create(name='other')
+
+    def summary(self, owner):
+        return ResourceSummary.objects.filter(cluster=self.cluster,
+                                              owner=owner) \
+            .values('total', 'running', 'ram', 'disk', 'virtual_cpus')[0]
+
+    def save_vm(self, vm, **kwargs):
+        for name, value in kwargs.items():
+            setattr(vm, name, value)
+        vm.save()
+
+    def test_save(self):
+        """
+        Saving a VM updates the summary of its owner.
+
+        Verifies:
+            * ram and virtual_cpus only include running VMs
+            * VMs without resources are counted but don't add resources
+        """
+        self.save_vm(self.vm, owner=self.owner, status='running', ram=512,
+                     disk_size=1024, virtual_cpus=2)
+        vm2 = VirtualMachine.objects.create(
+            cluster=self.cluster, hostname='vm2.example.bak',
+            owner=self.owner, status='stopped', ram=256, disk_size=2048,
+            virtual_cpus=1)
+        VirtualMachine.objects.create(cluster=self.cluster,
+                                      hostname='vm3.example.bak',
+                                      owner=self.owner)
+
+        self.assertEqual(dict(total=3, running=1, ram=512, disk=3072,
+                              virtual_cpus=2), self.summary(self.owner))
+        self.assertFalse(ResourceSummary.objects.filter(owner=None).exists())
+
+        vm2.status = 'running'
+        vm2.save()
+        self.assertEqual(dict(total=3, running=2, ram=768, disk=3072,
+                              virtual_cpus=3), self.summary(self.owner))
+
+    def test_adjust(self):
+        """
+        Saving a VM adds the difference to its summary rather than recounting
+        the other VMs.
+        """
+        self.save_vm(self.vm, owner=self.owner, status='running', ram=512,
+                     disk_size=1024, virtual_cpus=2)
+        ResourceSummary.objects.update(ram=F('ram') + 100)
+
+        self.save_vm(self.vm, ram=1024)
+        self.assertEqual(1124, self.summary(self.owner)['ram'])
+
+        self.save_vm(self.vm, status='stopped')
+        self.assertEqual(dict(total=1, running=0, ram=100, disk=1024,
+                              virtual_cpus=0), self.summary(self.owner))
+
+    def test_deferred(self):
+        """
+        VMs loaded with some fields deferred update their summary too.
+        """
+        self.save_vm(self.vm, owner=self.owner, status='running', ram=512)
+        vm = VirtualMachine.objects.defer('serialized_info') \
+            .get(pk=self.vm.pk)
+        self.save_vm(vm, ram=1024)
+        self.assertEqual(1024, self.summary(self.owner)['ram'])
+
+        vm = VirtualMachine.objects.only('hostname').get(pk=self.vm.pk)
+        self.save_vm(vm, owner=self.other)
+        self.assertFalse(ResourceSummary.objects.filter(owner=self.owner)
+                         .exists())
+        self.assertEqual(1, self.summary(self.other)['total'])
+
+        VirtualMachine.objects.only('hostname').get(pk=self.vm.pk).delete()
+        self.assertFalse(ResourceSummary.objects.exists())
+
+    @override_settings(BACKGROUND_CACHE_REFRESH=True)
+    def test_raw(self):
+        """
+        VMs saved raw, like by loaddata, are counted.
+        """
+        pk = self.vm.pk
+        self.vm.delete()
+        vm = VirtualMachine(id=pk, cluster=self.cluster,
+                            hostname='vm1.example.bak', owner=self.owner)
+        vm.save_base(raw=True)
+        self.assertEqual(1, self.summary(self.owner)['total'])
+
+    def test_concurrent_create(self):
+        """
+        A summary created by a concurrent save is added to, not duplicated.
+        """
+        update = QuerySet.update
+
+        def concurrent(qs, **kwargs):
+            QuerySet.update = update
+            ResourceSummary.objects.create(cluster=self.cluster,
+                                           owner=self.owner, total=1)
+            return 0
+
+        QuerySet.update = concurrent
+        try:
+            VirtualMachine.objects.create(cluster=self.cluster,
+                                          hostname='vm2.example.bak',
+                                          owner=self.owner)
+        finally:
+            QuerySet.update = update
+
+        self.assertEqual(1, ResourceSummary.objects.filter(owner=self.owner)
+                         .count())
+        self.assertEqual(2, self.summary(self.owner)['total'])
+
+    def test_change_owner(self):
+        """
+        A VM moving to another owner is subtracted from the old owner.
+        """
+        self.save_vm(self.vm, owner=self.owner)
+        vm = VirtualMachine.objects.get(pk=self.vm.pk)
+        self.save_vm(vm, owner=self.other)
+
+        self.assertFalse(ResourceSummary.objects.filter(owner=self.owner)
+                         .exists())
+        self.assertEqual(1, self.summary(self.other)['total'])
+
+    def test_delete(self):
+        self.save_vm(self.vm, owner=self.owner)
+        self.vm.delete()
+        self.assertFalse(ResourceSummary.objects.exists())
+
+    def test_recount(self):
+        """
+        Recounting repairs summaries written by bulk updates.
+        """
+        VirtualMachine.objects.filter(pk=self.vm.pk) \
+            .update(owner=self.owner, ram=128)
+        ResourceSummary.objects.create(cluster=self.cluster, owner=self.owner)
+
+        ResourceSummary.recount(self.cluster.id)
+
+        self.assertEqual(1, ResourceSummary.objects.count())
+        self.assertEqual(1, self.summary(self.owner)['total'])
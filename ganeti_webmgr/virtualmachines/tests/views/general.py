@@ -1,12 +1,15 @@
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
+from django.db.models.signals import post_init
 # #6579.
 from django.utils import simplejson as json
 
 from ganeti_webmgr.utils.models import SSHKey
+from ganeti_webmgr.virtualmachines.models import VirtualMachine
 from .base import TestVirtualMachineViewsBase
 
 __all__ = ['TestVirtualMachineViewList',
+           'TestVirtualMachineListPages',
            'TestVirtualMachineDetailView',
            'TestVirtualMachineSSHKeysView']
 
@@ -94,6 +97,83 @@ class TestVirtualMachineViewList(TestVirtualMachineViewsBase):
         self.assertEqual(set(vms), set([self.vm, vm1, vm2, vm3]))
 
 
+class TestVirtualMachineListPages(TestVirtualMachineViewsBase):
+
+    def setUp(self):
+        super(TestVirtualMachineListPages, self).setUp()
+        # self.vm is vm1.example.bak
+        for i in range(2, 6):
+            self.create_virtual_machine(self.cluster, 'vm%d.example.bak' % i)
+        self.assertTrue(self.c.login(username=self.superuser.username,
+                                     password='secret'))
+
+    def get_hostnames(self, query=''):
+        response = self.c.get('/vms/?count=2' + query)
+        self.assertEqual(200, response.status_code)
+        table = response.context['table']
+        return [row['hostname'] for row in table.data], table.keyset
+
+    def test_pages(self):
+        """
+        Pages follow each other through the cursors, in both directions.
+        """
+        hostnames, page = self.get_hostnames()
+        self.assertEqual(['vm1.example.bak', 'vm2.example.bak'], hostnames)
+        self.assertFalse(page.has_previous)
+        self.assertTrue(page.has_next)
+
+        hostnames, page = self.get_hostnames('&after=%s' % page.next_cursor)
+        self.assertEqual(['vm3.example.bak', 'vm4.example.bak'], hostnames)
+        self.assertTrue(page.has_previous)
+
+        hostnames, last = self.get_hostnames('&after=%s' % page.next_cursor)
+        self.assertEqual(['vm5.example.bak'], hostnames)
+        self.assertFalse(last.has_next)
+
+        hostnames, page = self.get_hostnames('&before=%s'
+                                             % last.previous_cursor)
+        self.assertEqual(['vm3.example.bak', 'vm4.example.bak'], hostnames)
+        self.assertTrue(page.has_next)
+
+    def test_sorted(self):
+        """
+        Descending order is paginated the same way, and a cursor which no
+        longer exists starts over.
+        """
+        hostnames, page = self.get_hostnames('&sort=-hostname')
+        self.assertEqual(['vm5.example.bak', 'vm4.example.bak'], hostnames)
+        hostnames, page = self.get_hostnames('&sort=-hostname&after=%s'
+                                             % page.next_cursor)
+        self.assertEqual(['vm3.example.bak', 'vm2.example.bak'], hostnames)
+
+        hostnames, page = self.get_hostnames('&after=12345')
+        self.assertEqual(['vm1.example.bak', 'vm2.example.bak'], hostnames)
+
+    def test_no_instances(self):
+        """
+        Listing VMs doesn't instantiate them, and owners are linked without
+        loading them.
+        """
+        self.vm.owner = self.user.get_profile()
+        self.vm.save()
+
+        created = []
+
+        def count(sender, **kwargs):
+            created.append(kwargs['instance'])
+
+        post_init.connect(count, sender=VirtualMachine)
+        try:
+            response = self.c.get('/vms/')
+        finally:
+            post_init.disconnect(count, sender=VirtualMachine)
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(created)
+        self.assertContains(response, '<a href="%s">%s</a>'
+                            % (self.user.get_absolute_url(),
+                               self.user.get_profile().name))
+
+
 class TestVirtualMachineDetailView(TestVirtualMachineViewsBase):
 
     def test_view_detail(self):
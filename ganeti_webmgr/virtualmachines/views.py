@@ -19,6 +19,7 @@
 
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import Group, User
 from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
 from django.core.exceptions import PermissionDenied
@@ -51,7 +52,7 @@ from ganeti_webmgr.ganeti_web.caps import has_shutdown_timeout, has_balloonmem
 from ganeti_webmgr.ganeti_web.templatetags.webmgr_tags import render_storage
 from ganeti_webmgr.ganeti_web.views.generic import (NO_PRIVS,
                                                     LoginRequiredMixin,
-                                                    PaginationMixin,
+                                                    KeysetPaginationMixin,
                                                     GWMBaseView)
 from ganeti_webmgr.ganeti_web.views.tables import BaseVMTable
 
@@ -93,23 +94,78 @@ def get_vm_and_cluster_or_404(cluster_slug, instance):
     raise Http404('Virtual Machine does not exist')
 
 
-class BaseVMListView(LoginRequiredMixin, PaginationMixin, GWMBaseView,
+# Columns of VirtualMachines listed in VM tables
+VM_LIST_FIELDS = ('id', 'hostname', 'status', 'admin_state', 'oper_state',
+                  'pending_delete', 'operating_system', 'ram', 'disk_size',
+                  'virtual_cpus', 'cluster__slug', 'primary_node__hostname',
+                  'owner__name', 'owner__profile__user__username',
+                  'owner__organization__group__id')
+
+
+def vm_list_rows(values):
+    """
+    Turn values() of the VM_LIST_FIELDS into the records of BaseVMTable.
+
+    Owners link to their user or group, whose URLs are built without loading
+    the owner.
+    """
+    rows = []
+    for vm in values:
+        username = vm.pop('owner__profile__user__username')
+        group_id = vm.pop('owner__organization__group__id')
+        name = vm.pop('owner__name')
+        if username is not None:
+            owner = {'name': name,
+                     'url': User(username=username).get_absolute_url()}
+        elif group_id is not None:
+            owner = {'name': name,
+                     'url': Group(pk=group_id).get_absolute_url()}
+        else:
+            owner = None
+        vm['owner'] = owner
+        vm['cluster'] = {'slug': vm.pop('cluster__slug')}
+        vm['primary_node'] = vm.pop('primary_node__hostname')
+        rows.append(vm)
+    return rows
+
+
+class BaseVMListView(LoginRequiredMixin, KeysetPaginationMixin, GWMBaseView,
                      SingleTableView):
     """
     A view for listing VirtualMachines. It does so using a custom table object
     containing the logic for displaying the list.
+
+    The table is built from a page of values() rather than VirtualMachine
+    instances, so listing VMs neither decodes their cached info nor refreshes
+    them from ganeti.
     """
     model = VirtualMachine
     table_class = BaseVMTable
     template_name = "ganeti/virtual_machine/list.html"
+    keyset_fields = {
+        'hostname': 'hostname',
+        'cluster': 'cluster__slug',
+        'status': 'status',
+        'operating_system': 'operating_system',
+        'ram': 'ram',
+        'disk_size': 'disk_size',
+        'virtual_cpus': 'virtual_cpus',
+    }
+    default_keyset_order = 'hostname'
 
     def get_template_names(self):
         if self.request.is_ajax():
-            template = ['table.html']  # all we need is the table
+            template = ['table_keyset.html']  # all we need is the table
         else:
             template = ['ganeti/virtual_machine/list.html']
         return template
 
+    def get_keyset_queryset(self):
+        return self.object_list.values(*VM_LIST_FIELDS)
+
+    def get_keyset_rows(self, rows):
+        return vm_list_rows(rows)
+
 
 class VMListView(BaseVMListView):
     def get_queryset(self):
@@ -1024,7 +1080,8 @@ def job_status(request, id, rest=False):
     jobs = Job.objects.filter(status__in=("error", "running", "waiting"),
                               content_type=ct,
                               object_id=id).order_by('job_id')
-    jobs = [j.info for j in jobs]
+    # jobs the refresh daemon has not polled yet have no info
+    jobs = [j.info for j in jobs if j.info is not None]
 
     if rest:
         return jobs